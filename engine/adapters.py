@@ -0,0 +1,125 @@
+"""Adapters emitting the historical 837 parse shapes from the shared core.
+
+`engine.parser` holds the only tokenizer; these functions fold its segment
+stream into the dicts the other entry points were built against:
+
+  - `parse_837_runner`: the `engine/src` runner shape (`claims` whose
+    `segments` run from one CLM to the next, CLM recorded twice)
+  - `parse_837_backend`: the FastAPI backend shape (`headers`, `gs`, `gs08`,
+    and claims with `raw`, `refs` and `patient`)
+
+Both accept anything `engine.parser.read_segments` does: text, bytes, mmap
+or file objects. `SHAPES` lists every shape with its parse function.
+"""
+from typing import Any, Callable, Dict, IO, Set, Tuple, Union
+
+from .parser import CHUNK_SIZE, DEFAULT_ENCODING, _transaction_type, iter_split_segments, parse_837
+
+Source = Union[str, bytes, IO]
+
+
+def parse_837_runner(raw: Source, encoding: str = DEFAULT_ENCODING) -> Dict:
+    """Plain-dict shape of the standalone engine runner (`engine/src/parser.py`)."""
+    parsed = {'claims': [], 'transaction_type': 'unknown'}
+    line_tags = set()
+    current_claim = None
+    for tag, parts, _ in iter_split_segments(raw, CHUNK_SIZE, encoding):
+        if tag == 'CLM':
+            if current_claim:
+                parsed['claims'].append(current_claim)
+            current_claim = {'CLM': parts, 'segments': []}
+            # record the CLM segment itself
+            current_claim['segments'].append({'tag': tag, 'parts': parts})
+        elif tag in ('SV1', 'SV2'):
+            line_tags.add(tag)
+            if current_claim is None:
+                current_claim = {'CLM': [], 'segments': []}
+            current_claim.setdefault('service_lines', []).append(parts)
+        elif tag == 'HI':
+            if current_claim is None:
+                current_claim = {'CLM': [], 'segments': []}
+            current_claim.setdefault('diagnosis', []).append(parts)
+        # record every segment in claim if claim exists
+        if current_claim is not None:
+            current_claim['segments'].append({'tag': tag, 'parts': parts})
+    if current_claim:
+        parsed['claims'].append(current_claim)
+    parsed['transaction_type'] = _transaction_type(line_tags)
+    return parsed
+
+
+def backend_transaction_type(gs08: str, line_tags: Set[str]) -> Tuple[str, str]:
+    """Prefer the GS08 implementation id (005010X222 = 837P; 005010X223 = 837I),
+    falling back to which service line segments were seen."""
+    if '005010X222' in gs08:
+        return 'professional', gs08
+    if '005010X223' in gs08:
+        return 'institutional', gs08
+    return _transaction_type(line_tags), ''
+
+
+def _new_backend_claim() -> Dict[str, Any]:
+    return {"raw": "", "CLM": [], "segments": []}
+
+
+def parse_837_backend(raw: Source, encoding: str = DEFAULT_ENCODING) -> Dict[str, Any]:
+    """Plain-dict shape of the FastAPI backend (`app/backend/parser.py`)."""
+    parsed = {"headers": [], "gs": [], "claims": [], "transaction_type": None, "gs08": None}
+    current_claim = None
+    first_gs = None
+    line_tags = set()
+
+    for tag, parts, seg in iter_split_segments(raw, CHUNK_SIZE, encoding):
+        if tag == 'ST':
+            parsed['transaction_set_control'] = parts[2] if len(parts) > 2 else ''
+        elif tag == 'GS':
+            if first_gs is None:
+                first_gs = parts
+            parsed['gs'].append(parts[1:])
+        elif tag == 'BHT':
+            parsed['bht'] = parts[1:]
+        elif tag == 'NM1' and len(parts) > 1 and parts[1] == '85':
+            parsed['billing_provider'] = {'name_elements': parts[2:]}
+        elif tag == 'CLM':
+            # commit previous claim
+            if current_claim:
+                parsed['claims'].append(current_claim)
+            current_claim = {"raw": seg, "CLM": parts, "segments": []}
+        elif (tag == 'NM1' and len(parts) > 1 and parts[1] == 'QC') or tag == 'PAT':
+            if current_claim is None:
+                current_claim = _new_backend_claim()
+            current_claim['patient'] = parts[2:]
+        elif tag == 'REF':
+            if current_claim is None:
+                current_claim = _new_backend_claim()
+            current_claim.setdefault('refs', []).append(parts[1:])
+        elif tag == 'HI':
+            if current_claim is None:
+                current_claim = _new_backend_claim()
+            current_claim.setdefault('diagnosis', []).append(parts[1:])
+        elif tag in ('SV1', 'SV2'):
+            line_tags.add(tag)
+            if current_claim is None:
+                current_claim = _new_backend_claim()
+            current_claim.setdefault('service_lines', []).append({'tag': tag, 'parts': parts[1:]})
+        # record segment
+        if current_claim is not None:
+            current_claim['segments'].append({'tag': tag, 'parts': parts})
+        else:
+            parsed['headers'].append({'tag': tag, 'parts': parts})
+
+    if current_claim:
+        parsed['claims'].append(current_claim)
+
+    # GS structure: GS*{functional id}*sender*receiver*date*time*control*respons*version
+    gs08 = first_gs[8] if first_gs is not None and len(first_gs) > 8 else ''
+    parsed['transaction_type'], parsed['gs08'] = backend_transaction_type(gs08, line_tags)
+    return parsed
+
+
+# shape name -> parse function, for callers and benchmarks that cover all shapes
+SHAPES: Dict[str, Callable[..., Dict]] = {
+    'engine': parse_837,
+    'runner': parse_837_runner,
+    'backend': parse_837_backend,
+}
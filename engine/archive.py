@@ -0,0 +1,246 @@
+"""Streaming ingestion of gzip, zip and tar bundles of 837 files.
+
+Clearinghouse drops arrive as `.gz`, `.zip` or (compressed) `.tar` bundles.
+`iter_members` opens one of these and yields each member as a binary
+stream that decompresses as it is read, so a member goes straight into the
+parser's streaming decode (`engine.parser.decode_stream`) without being
+extracted to disk or to memory first.
+
+`map_members` applies a function to every member across a process pool:
+
+  - zip: every worker opens the archive itself and streams the members it
+    is handed, so only member names cross the process boundary
+  - tar: members can only be reached by decompressing the archive in
+    order, so the calling process reads them one at a time and hands each
+    to a worker, with at most two members per worker in flight
+  - gzip: a single member, streamed in-process
+
+`parse_archive` parses each member with `engine.parser.parse_837` (or
+another parse function of that signature) and collects the results.
+"""
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple, Union
+
+from .logger import setup_logger
+from .parser import decode_stream, parse_837
+
+logger = setup_logger(__name__)
+
+Source = Union[str, Path, bytes, bytearray, IO[bytes]]
+
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+# POSIX tar headers carry `ustar` at this offset of their first block
+TAR_MAGIC = b'ustar'
+TAR_MAGIC_OFFSET = 257
+
+# gzip header FLG bits preceding the original file name
+_GZIP_FEXTRA = 0x04
+_GZIP_FNAME = 0x08
+
+# Members per worker queued from a tar while earlier ones are parsed
+TAR_IN_FLIGHT = 2
+
+
+def _open(source: Source) -> IO[bytes]:
+    if isinstance(source, (str, Path)):
+        return open(source, 'rb')
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+
+def _is_tar(head: bytes) -> bool:
+    return head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + len(TAR_MAGIC)] == TAR_MAGIC
+
+
+def _read_head(f: IO[bytes]) -> bytes:
+    start = f.tell()
+    head = f.read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+    if head.startswith(GZIP_MAGIC):
+        f.seek(start)
+        head = gzip.GzipFile(fileobj=f).read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+    f.seek(start)
+    return head
+
+
+def archive_kind(source: Source) -> Optional[str]:
+    """'zip', 'tar' (compressed or not) or 'gzip' for archive input, else None.
+
+    `source` is a path, the archive bytes or a seekable binary file object,
+    whose position is left unchanged.
+    """
+    f = _open(source)
+    try:
+        start = f.tell()
+        magic = f.read(len(ZIP_MAGIC))
+        f.seek(start)
+        if magic.startswith(ZIP_MAGIC):
+            return 'zip'
+        try:
+            head = _read_head(f)
+        except (OSError, EOFError):
+            # truncated or corrupt gzip data
+            return None
+        if _is_tar(head):
+            return 'tar'
+        return 'gzip' if magic.startswith(GZIP_MAGIC) else None
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _gzip_member_name(f: IO[bytes], source: Source) -> str:
+    """Original file name from the gzip header, else the archive name without `.gz`."""
+    start = f.tell()
+    header = f.read(10 + 1024)
+    f.seek(start)
+    if len(header) > 10 and header[3] & _GZIP_FNAME and not header[3] & _GZIP_FEXTRA:
+        name, sep, _ = header[10:].partition(b'\x00')
+        if sep:
+            return name.decode('latin-1')
+    name = Path(source).name if isinstance(source, (str, Path)) else getattr(source, 'name', '')
+    return name[:-3] if isinstance(name, str) and name.endswith('.gz') else ''
+
+
+def iter_members(source: Source) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Yield `(name, stream)` for each file in an archive, in archive order.
+
+    Each stream decompresses as it is read and is only valid until the next
+    member is yielded. Directories and other non-file entries are skipped.
+    Raises ValueError when `source` is not a gzip, zip or tar archive.
+    """
+    kind = archive_kind(source)
+    if kind is None:
+        raise ValueError('not a gzip, zip or tar archive')
+    f = _open(source)
+    try:
+        if kind == 'zip':
+            with zipfile.ZipFile(f) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as stream:
+                            yield info.filename, stream
+        elif kind == 'tar':
+            # stream mode: members are read in order and never seeked back to
+            with tarfile.open(fileobj=f, mode='r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member)
+        else:
+            name = _gzip_member_name(f, source)
+            with gzip.GzipFile(fileobj=f) as stream:
+                yield name, stream
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _zip_names(source: Source) -> List[str]:
+    f = _open(source)
+    try:
+        with zipfile.ZipFile(f) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+    finally:
+        if f is not source:
+            f.close()
+
+
+# The zip archive opened by each pool worker, see `_open_worker_zip`
+_worker_zip: Optional[zipfile.ZipFile] = None
+
+
+def _open_worker_zip(source: Union[str, bytes]) -> None:
+    global _worker_zip
+    _worker_zip = zipfile.ZipFile(_open(source))
+
+
+def _zip_member(task: Tuple[Callable, str]) -> Any:
+    fn, name = task
+    with _worker_zip.open(name) as stream:
+        return fn(name, stream)
+
+
+def _buffered_member(fn: Callable, name: str, data: bytes) -> Any:
+    return fn(name, io.BytesIO(data))
+
+
+def map_members(source: Source, fn: Callable[[str, IO[bytes]], Any],
+                workers: Optional[int] = None) -> List[Tuple[str, Any]]:
+    """`(name, fn(name, stream))` for every archive member, in archive order.
+
+    `fn` must be picklable (a module-level function or a `functools.partial`
+    of one) and so must its results. `workers` defaults to every core; with
+    one worker, or for a gzip file, everything runs in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    kind = archive_kind(source)
+    if workers == 1 or kind == 'gzip':
+        return [(name, fn(name, stream)) for name, stream in iter_members(source)]
+
+    if kind == 'zip':
+        names = _zip_names(source)
+        if len(names) <= 1:
+            return [(name, fn(name, stream)) for name, stream in iter_members(source)]
+        if isinstance(source, (str, Path)):
+            shared = str(source)
+        elif isinstance(source, (bytes, bytearray)):
+            shared = bytes(source)
+        else:
+            # workers cannot share a file object; they get the compressed bytes
+            start = source.tell()
+            shared = source.read()
+            source.seek(start)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_zip, initargs=(shared,)) as pool:
+            results = list(pool.map(_zip_member, [(fn, name) for name in names]))
+        logger.info(f"Processed {len(names)} zip members with {workers} workers")
+        return list(zip(names, results))
+
+    results = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name, stream in iter_members(source):
+            pending.append((name, pool.submit(_buffered_member, fn, name, stream.read())))
+            while len(pending) > workers * TAR_IN_FLIGHT:
+                name, future = pending.popleft()
+                results.append((name, future.result()))
+        results.extend((name, future.result()) for name, future in pending)
+    logger.info(f"Processed {len(results)} tar members with {workers} workers")
+    return results
+
+
+def parse_member(parse: Callable[[Any], Dict], name: str, stream: IO[bytes]) -> Dict:
+    """Parse one member with `parse`, decoding it as it streams in.
+
+    The result gains `name` and `decoding` (see `engine.parser.decode_stream`).
+    """
+    reader = decode_stream(stream)
+    parsed = parse(reader)
+    parsed['name'] = name
+    parsed['decoding'] = reader.as_dict()
+    return parsed
+
+
+def parse_archive(source: Source, parse: Callable[[Any], Dict] = parse_837,
+                  workers: int = 1) -> Dict[str, Any]:
+    """Parse every 837 in an archive; returns `archive` (its kind) and `members`.
+
+    Members are parsed in-process by default: `parse_837` claims cost more
+    to pickle back from a worker than to parse (see `engine.batch`). Plain-
+    dict shapes such as `engine.adapters.parse_837_backend` can pass
+    `workers` to spread members over a process pool with `map_members`.
+    """
+    kind = archive_kind(source)
+    if kind is None:
+        raise ValueError('not a gzip, zip or tar archive')
+    members = [parsed for _, parsed in map_members(source, partial(parse_member, parse), workers)]
+    logger.info(f"Parsed {len(members)} members of a {kind} archive")
+    return {'archive': kind, 'members': members}
@@ -0,0 +1,351 @@
+"""Parallel parsing and validation of large 837 batches.
+
+A batch is cut into shards at `ST` boundaries with byte searches, without
+decoding it. Each shard carries the ISA/GS segments in effect at its first
+transaction set, so it is a self-contained 837 that a worker process can
+parse and validate on its own. Shards are spread over a
+`ProcessPoolExecutor` and their results are merged back in input order.
+
+Workers send back per-transaction results only (claim counts, transaction
+type and rule findings); the claims themselves are dropped in the worker
+because pickling them back costs more than parsing them.
+
+Envelope checks are split the same way: a worker checks the SE trailers of
+its own transaction sets, while the GE and IEA trailers, which a shard may
+not hold, are checked by the parent in a byte search over the whole batch
+(`_interchange_errors`). Each transaction set is validated with the
+envelope errors of both that fall to it.
+
+`validate_archive` does the same for gzip, zip and tar bundles of 837s,
+with one archive member per task (see `engine.archive`).
+"""
+import mmap
+import os
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from heapq import merge
+from typing import Any, Dict, IO, Iterator, List, Optional, Sequence, Tuple, Union
+
+from . import rules_engine
+from .archive import archive_kind, map_members
+from .claims import build_tag_index
+from .envelope import TRANSACTION_CHECKS, EnvelopeReport
+from .logger import setup_logger
+from .parser import (DEFAULT_ENCODING, DELIMITER_LOOKAHEAD, _transaction_type, decode_stream, detect_delimiters,
+                     iter_claims)
+
+logger = setup_logger(__name__)
+
+# Target bytes of input per shard; shards never split a transaction set
+SHARD_SIZE = 4 * 1024 * 1024
+
+# Shard tasks queued per worker process; buffer shards are copied as queued
+SHARDS_IN_FLIGHT = 2
+
+_WHITESPACE = b' \t\r\n'
+
+
+def _segment_starts(buf, tag: bytes, element: bytes, terminator: bytes) -> Iterator[int]:
+    """Offsets of the segments tagged `tag`, found by byte search.
+
+    A match only counts when the previous non-blank byte is the segment
+    terminator (or it sits at the very start), so the tag showing up inside
+    an element value is not mistaken for a segment.
+    """
+    needle = tag + element
+    term = terminator[0]
+    pos = buf.find(needle)
+    while pos >= 0:
+        j = pos - 1
+        while j >= 0 and buf[j] in _WHITESPACE:
+            j -= 1
+        if j < 0 or buf[j] == term:
+            yield pos
+        pos = buf.find(needle, pos + 1)
+
+
+def _segment_at(buf, pos: int, terminator: bytes) -> bytes:
+    end = buf.find(terminator, pos)
+    return bytes(buf[pos:len(buf) if end < 0 else end + 1])
+
+
+def iter_shards(buf, shard_size: int = SHARD_SIZE) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield `(prefix, start, end)` shards of a byte buffer or mmap.
+
+    `buf[start:end]` holds whole transaction sets (from one `ST` up to the
+    next) adding up to at least `shard_size` bytes, and `prefix` is the ISA
+    and GS segments in effect for the first of them. Later envelopes inside
+    the shard travel with its body, since the parser follows envelope
+    changes itself; delimiters are taken from the first ISA of the batch.
+    """
+    delimiters = detect_delimiters(bytes(buf[:DELIMITER_LOOKAHEAD]).decode('latin-1'))
+    element = delimiters.element.encode('latin-1')
+    terminator = delimiters.segment.encode('latin-1')
+
+    starts = _segment_starts(buf, b'ST', element, terminator)
+    first = next(starts, None)
+    if first is None:
+        if len(buf):
+            yield b'', 0, len(buf)
+        return
+
+    envelopes = {tag: _segment_starts(buf, tag, element, terminator) for tag in (b'ISA', b'GS')}
+    upcoming = {tag: next(it, None) for tag, it in envelopes.items()}
+    current = dict.fromkeys(envelopes)
+
+    def envelope_before(pos: int) -> Tuple[Optional[int], Optional[int]]:
+        for tag, it in envelopes.items():
+            while upcoming[tag] is not None and upcoming[tag] < pos:
+                current[tag] = upcoming[tag]
+                upcoming[tag] = next(it, None)
+        return current[b'ISA'], current[b'GS']
+
+    shard_start, shard_envelope = first, envelope_before(first)
+    for pos in starts:
+        if pos - shard_start >= shard_size:
+            yield _prefix(buf, shard_envelope, terminator), shard_start, pos
+            shard_start, shard_envelope = pos, envelope_before(pos)
+    yield _prefix(buf, shard_envelope, terminator), shard_start, len(buf)
+
+
+def _prefix(buf, envelope: Tuple[Optional[int], Optional[int]], terminator: bytes) -> bytes:
+    return b''.join(_segment_at(buf, pos, terminator) for pos in envelope if pos is not None)
+
+
+def _tagged_starts(buf, tag: bytes, element: bytes, terminator: bytes) -> Iterator[Tuple[int, str]]:
+    for pos in _segment_starts(buf, tag, element, terminator):
+        yield pos, tag.decode('ascii')
+
+
+def _interchange_errors(buf) -> Tuple[List[int], List[Dict[str, Any]]]:
+    """Offsets of the `ST` segments of a batch, and its group and interchange errors.
+
+    ISA/GS/ST/GE/IEA segments are found by byte search as for the shards
+    and fed to an `EnvelopeReport` that skips the SE checks, so `errors`
+    holds the GE and IEA checks only; their `transaction` is the number of
+    the transaction set they follow in the whole batch.
+    """
+    delimiters = detect_delimiters(bytes(buf[:DELIMITER_LOOKAHEAD]).decode('latin-1'))
+    element = delimiters.element.encode('latin-1')
+    terminator = delimiters.segment.encode('latin-1')
+    report = EnvelopeReport(transaction_sets=False)
+    starts = []
+    found = (_tagged_starts(buf, tag, element, terminator) for tag in (b'ISA', b'GS', b'ST', b'GE', b'IEA'))
+    for pos, tag in merge(*found):
+        if tag == 'ST':
+            # only counted toward GE01
+            starts.append(pos)
+            report.control(tag, (), None)
+            continue
+        segment = _segment_at(buf, pos, terminator).rstrip(_WHITESPACE)
+        if segment.endswith(terminator):
+            segment = segment[:-len(terminator)]
+        report.control(tag, segment.decode('latin-1').split(delimiters.element), None)
+    report.finish()
+    return starts, report.errors
+
+
+def _shard_errors(errors: List[Dict[str, Any]], starts: List[int], start: int, end: int) -> List[Dict[str, Any]]:
+    """The `_interchange_errors` falling to the transaction sets of `buf[start:end]`,
+    numbered from 1 at the shard's first set as its worker numbers them."""
+    first = bisect_left(starts, start) + 1
+    last = bisect_left(starts, end)
+    # errors ahead of the first ST go to the first transaction set
+    return [dict(e, transaction=max(e['transaction'] - first + 1, 0)) for e in errors
+            if first <= e['transaction'] <= last or (e['transaction'] == 0 and first == 1)]
+
+
+def _validate_shard(task: Tuple) -> List[Dict[str, Any]]:
+    """Worker: parse one shard and validate each of its transaction sets.
+
+    The shard is `source[start:end]` of a file path or a buffer, or the
+    whole of `source` when `start` is None (the bytes shipped to a worker).
+    """
+    source, prefix, start, end, rules, encoding, errors = task
+    if isinstance(source, str):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            body = mapped[start:end]
+    elif start is None:
+        body = source
+    else:
+        body = memoryview(source)[start:end]
+    report = EnvelopeReport()
+    claims = iter_claims(prefix + body, encoding=encoding, envelope_report=report)
+    return _validate_transactions(claims, rules, report, TRANSACTION_CHECKS, errors)
+
+
+def _shipped(task: Tuple) -> Tuple:
+    """A shard task as sent to a worker: a buffer shard becomes its own bytes."""
+    source, prefix, start, end, *rest = task
+    if isinstance(source, str):
+        return task
+    return (bytes(memoryview(source)[start:end]), prefix, None, None, *rest)
+
+
+def _map_shards(tasks: List[Tuple], workers: int) -> List[List[Dict[str, Any]]]:
+    """`_validate_shard` of every task over a process pool, in order.
+
+    Tasks are submitted as results come back, at most `SHARDS_IN_FLIGHT`
+    per worker, so buffer shards are copied for their worker one at a time
+    rather than all up front.
+    """
+    results = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for task in tasks:
+            pending.append(pool.submit(_validate_shard, _shipped(task)))
+            while len(pending) > workers * SHARDS_IN_FLIGHT:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+    return results
+
+
+def _take_errors(errors: List[Dict[str, Any]], start: int, number: int) -> int:
+    """Index past the errors from `start` on recorded up to transaction set `number`."""
+    while start < len(errors) and errors[start]['transaction'] <= number:
+        start += 1
+    return start
+
+
+def _validate_transactions(claims: Iterator[Tuple[Dict, Any]], rules: Optional[List[Dict[str, Any]]],
+                           report: EnvelopeReport, checks: Optional[Sequence[str]] = None,
+                           extra: Sequence[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+    """Results of the transaction sets in an `iter_claims` stream, in order.
+
+    `report` is the `EnvelopeReport` fed by the stream. Each transaction
+    set is validated with its errors (of `checks` only, when given) and
+    those of `extra`; errors of sets holding no claim go to the next set
+    reported.
+    """
+    results = []
+    group: List = []
+    taken = [0, 0]
+
+    def close(group: List) -> None:
+        number = group[0].transaction.number
+        own, more = taken
+        taken[:] = _take_errors(report.errors, own, number), _take_errors(extra, more, number)
+        errors = [e for e in report.errors[own:taken[0]] if checks is None or e['check'] in checks]
+        results.append(_transaction_result(group, rules, errors + list(extra[more:taken[1]])))
+
+    for _, claim in claims:
+        if group and claim.transaction is not group[0].transaction:
+            close(group)
+            group = []
+        group.append(claim)
+    if group:
+        close(group)
+    return results
+
+
+def _transaction_result(claims: List, rules: Optional[List[Dict[str, Any]]],
+                        errors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate the claims of one transaction set as a document of their own,
+    with `errors` as its envelope errors."""
+    tag_index = build_tag_index(claims)
+    st = claims[0].transaction.find('ST')
+    parts = st['parts'] if st is not None else ()
+    doc = {'claims': claims, 'transaction_type': _transaction_type(tag_index), 'tag_index': tag_index,
+           'envelope': {'transactions': 1, 'valid_headers': int(len(parts) > 1 and parts[1].strip() == '837'),
+                        'errors': errors}}
+    result = {
+        'control_number': parts[2] if len(parts) > 2 else '',
+        'transaction_type': doc['transaction_type'],
+        'claim_count': len(claims),
+    }
+    if rules is not None:
+        result['findings'] = rules_engine.evaluate_rules(doc, rules)
+    return result
+
+
+def _summary(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    types = {t['transaction_type'] for t in transactions}
+    return {
+        'transaction_type': next((t for t in ('professional', 'institutional') if t in types), 'unknown'),
+        'claim_count': sum(t['claim_count'] for t in transactions),
+    }
+
+
+def _version(rules: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    return rules_engine.rules_version(rules) if rules is not None else None
+
+
+def validate_batch(source: Union[os.PathLike, str, bytes, bytearray, memoryview],
+                   rules: Optional[List[Dict[str, Any]]] = None,
+                   workers: Optional[int] = None,
+                   shard_size: int = SHARD_SIZE,
+                   encoding: str = DEFAULT_ENCODING) -> Dict[str, Any]:
+    """Parse and validate an 837 batch across a process pool.
+
+    `source` is a file path as an `os.PathLike` (workers memory-map it
+    themselves, so only byte offsets cross the process boundary), or the
+    batch as bytes or as 837 text, encoded with `encoding`; a buffer's
+    shards are sliced without copying and only copied when shipped to a
+    worker. `workers`
+    defaults to every core and `shard_size` sets the bytes per task; with
+    one worker everything runs in-process. `rules` are evaluated per
+    transaction set, and `ruleset_version` identifies them; without them
+    only the parse summary is produced.
+    Transaction sets that hold no claim are not reported.
+    """
+    workers = workers or os.cpu_count() or 1
+    if isinstance(source, os.PathLike):
+        path = os.fspath(source)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                shards = []
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    starts, errors = _interchange_errors(mapped)
+                    shards = [(path, prefix, start, end, rules, encoding, _shard_errors(errors, starts, start, end))
+                              for prefix, start, end in iter_shards(mapped, shard_size)]
+    else:
+        if isinstance(source, str):
+            buf = source.encode(encoding)
+        else:
+            # the byte searches need bytes; a memoryview is copied once
+            buf = memoryview(source).cast('B').tobytes() if isinstance(source, memoryview) else source
+        starts, errors = _interchange_errors(buf)
+        shards = [(buf, prefix, start, end, rules, encoding, _shard_errors(errors, starts, start, end))
+                  for prefix, start, end in iter_shards(buf, shard_size)]
+
+    if workers == 1 or len(shards) <= 1:
+        per_shard = [_validate_shard(task) for task in shards]
+    else:
+        per_shard = _map_shards(shards, workers)
+
+    transactions = [result for shard in per_shard for result in shard]
+    logger.info(f"Validated {len(transactions)} transaction sets in {len(shards)} shards with {workers} workers")
+    return dict(_summary(transactions), shard_count=len(shards), ruleset_version=_version(rules),
+                transactions=transactions)
+
+
+def _validate_member(rules: Optional[List[Dict[str, Any]]], encoding: Optional[str],
+                     name: str, stream: IO[bytes]) -> Dict[str, Any]:
+    """Worker: stream one archive member through the parser and validate it."""
+    reader = decode_stream(stream, encoding)
+    report = EnvelopeReport()
+    transactions = _validate_transactions(iter_claims(reader, envelope_report=report), rules, report)
+    return dict(_summary(transactions), name=name, decoding=reader.as_dict(), transactions=transactions)
+
+
+def validate_archive(source: Union[str, bytes, IO[bytes]],
+                     rules: Optional[List[Dict[str, Any]]] = None,
+                     workers: Optional[int] = None,
+                     encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Parse and validate every 837 in a gzip, zip or tar archive.
+
+    Members are decompressed as the parser reads them and spread over a
+    process pool by `engine.archive.map_members`, one member per task; each
+    member's encoding is sniffed unless `encoding` is given. `members` holds
+    one `validate_batch`-style summary per member, in archive order.
+    """
+    kind = archive_kind(source)
+    if kind is None:
+        raise ValueError('not a gzip, zip or tar archive')
+    members = [result for _, result in map_members(source, partial(_validate_member, rules, encoding), workers)]
+    transactions = [t for member in members for t in member['transactions']]
+    logger.info(f"Validated {len(members)} members of a {kind} archive")
+    return dict(_summary(transactions), archive=kind, ruleset_version=_version(rules), members=members)
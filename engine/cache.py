@@ -0,0 +1,161 @@
+"""Content-addressed cache for parse and validation results.
+
+Entries are keyed by a SHA-256 of the submitted 837 content plus the
+version of the ruleset that produced them (see
+`rules_engine.ruleset_version`), so a repeat upload of the same file under
+the same rules is answered without parsing or validating it again, while
+any change to either misses.
+
+`ResultCache` keeps a bounded LRU tier in memory and, when given a
+directory, a pickle-per-entry tier on disk that survives restarts and is
+shared by every process pointed at it. `RESULT_CACHE` is the process-wide
+instance used by the Streamlit and FastAPI apps; it adds the disk tier when
+the `OPTICLAIM_CACHE_DIR` environment variable names a directory.
+"""
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Union
+
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Results kept in memory before the least recently used is evicted
+CACHE_ENTRIES = 32
+
+# Files kept in the disk tier before the oldest are removed
+DISK_ENTRIES = 256
+
+# Environment variable naming the directory of the shared disk tier
+CACHE_DIR_ENV = 'OPTICLAIM_CACHE_DIR'
+
+_MISSING = object()
+
+
+def cache_key(kind: str, content: Union[str, bytes, bytearray, memoryview], version: str = '') -> str:
+    """Key for the `kind` of result computed from `content` under ruleset `version`."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()
+    return f'{kind}-{version}-{digest}' if version else f'{kind}-{digest}'
+
+
+class ResultCache:
+    """LRU memory tier with an optional on-disk tier behind it.
+
+    Values are returned as stored, not copied; callers must treat them as
+    read-only. Disk entries are only ever written by this class, and a file
+    that cannot be read back is treated as a miss.
+    """
+
+    def __init__(self, max_entries: int = CACHE_ENTRIES, directory: Optional[str] = None,
+                 max_disk_entries: int = DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._load(key)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._remember(key, value)
+        self._store(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Cached value for `key`, calling `compute` and storing its result on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        """Drop the memory tier; disk entries are left for other processes."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _load(self, key: str) -> Any:
+        if not self.directory:
+            return _MISSING
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # keep recently read files out of reach of `_prune`
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return _MISSING
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+            return _MISSING
+
+    def _store(self, key: str, value: Any) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._prune()
+
+    def _prune(self) -> None:
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith('.pkl')]
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def shared_cache() -> ResultCache:
+    """Cache for `RESULT_CACHE`, on disk under `$OPTICLAIM_CACHE_DIR` when it is set."""
+    return ResultCache(directory=os.environ.get(CACHE_DIR_ENV) or None)
+
+
+RESULT_CACHE = shared_cache()
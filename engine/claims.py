@@ -0,0 +1,309 @@
+"""Compact claim model produced by `engine.parser`.
+
+`Segment` and `Claim` use `__slots__` instead of per-segment dicts, and a
+segment keeps only its raw text until its elements are first read, which
+cuts the memory held per claim several times over. Both are read-only
+mappings that present the historical dict shape (`{'tag', 'parts'}` and
+`{'CLM', 'segments', 'service_lines', 'diagnosis'}`), so callers written
+against plain dicts keep working; `as_dict()` returns real dicts for JSON.
+
+Claims are nodes of a `Loop` tree built from HL parent IDs, so each claim
+reaches its billing provider and subscriber loops through parent pointers.
+The root of each tree is a `Transaction`, the ST loop of one transaction set.
+"""
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+SERVICE_LINE_TAGS = ('SV1', 'SV2')
+DIAGNOSIS_TAGS = ('HI',)
+
+
+class Segment(Mapping):
+    """One segment: its tag and either its raw text or its elements.
+
+    `parts` (the element list, `parts[0]` being the tag) is split from the
+    raw text with the document's shared `split` function on first access,
+    and the list then takes the place of the raw text; `raw` joins it back
+    with `split.join`. Segments the parser splits itself are handed over as
+    parts only, so no segment holds both, and segments nobody reads never
+    hold a list of element strings.
+    """
+    __slots__ = ('tag', '_data', '_split')
+
+    _KEYS = ('tag', 'parts')
+
+    def __init__(self, tag: str, raw: Any, split: Callable[[Any], List[str]],
+                 parts: Optional[List[str]] = None):
+        self.tag = tag
+        self._data = raw if parts is None else parts
+        self._split = split
+
+    @property
+    def parts(self) -> List[str]:
+        data = self._data
+        if isinstance(data, list):
+            return data
+        parts = self._data = self._split(data)
+        return parts
+
+    @property
+    def raw(self) -> Any:
+        data = self._data
+        if isinstance(data, list):
+            return self._split.join(data)
+        return data
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'tag':
+            return self.tag
+        if key == 'parts':
+            return self.parts
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return 2
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'tag': self.tag, 'parts': list(self.parts)}
+
+
+class Loop:
+    """One node of the 837 loop tree.
+
+    Holds the segments of the loop, a tag -> positions index built on its
+    first use and kept current by `append` afterwards (so presence checks
+    never rescan, and loops nobody queries never hold one), and a pointer
+    to the enclosing loop: 2400 -> 2300 claim -> 2000C/2000B -> 2000A ->
+    `ST` transaction header. 2010 name loops are kept inside their 2000 loop.
+    """
+    __slots__ = ('loop_id', 'parent', 'segments', '_tag_index')
+
+    def __init__(self, loop_id: str, parent: Optional['Loop'] = None):
+        self.loop_id = loop_id
+        self.parent = parent
+        self.segments: List[Segment] = []
+        self._tag_index: Optional[Dict[str, List[int]]] = None
+
+    @property
+    def tag_index(self) -> Dict[str, List[int]]:
+        index = self._tag_index
+        if index is None:
+            index = self._tag_index = {}
+            for n, segment in enumerate(self.segments):
+                positions = index.get(segment.tag)
+                if positions is None:
+                    index[segment.tag] = [n]
+                else:
+                    positions.append(n)
+        return index
+
+    def append(self, segment: Segment) -> None:
+        index = self._tag_index
+        if index is not None:
+            positions = index.get(segment.tag)
+            if positions is None:
+                index[segment.tag] = [len(self.segments)]
+            else:
+                positions.append(len(self.segments))
+        self.segments.append(segment)
+
+    def has(self, *tags: str) -> bool:
+        """True when the loop holds a segment with any of `tags`."""
+        return any(tag in self.tag_index for tag in tags)
+
+    def positions(self, *tags: str) -> List[int]:
+        """Positions in `segments` of the segments with any of `tags`, in order."""
+        if len(tags) == 1:
+            return self.tag_index.get(tags[0], [])
+        return sorted(p for tag in tags for p in self.tag_index.get(tag, ()))
+
+    def find(self, tag: str, qualifier: Optional[str] = None) -> Optional[Segment]:
+        """First segment with `tag` (and first element `qualifier`, if given)."""
+        for i in self.tag_index.get(tag, ()):
+            segment = self.segments[i]
+            if qualifier is None:
+                return segment
+            parts = segment.parts
+            if len(parts) > 1 and parts[1] == qualifier:
+                return segment
+        return None
+
+    def ancestor(self, loop_id: str) -> Optional['Loop']:
+        """This loop or the nearest enclosing one with `loop_id`."""
+        loop = self
+        while loop is not None and loop.loop_id != loop_id:
+            loop = loop.parent
+        return loop
+
+    def __repr__(self) -> str:
+        return f'<Loop {self.loop_id}: {len(self.segments)} segments>'
+
+
+class Transaction(Loop):
+    """The ST loop of one transaction set.
+
+    `number` is its 1-based position in the document (0 for segments ahead
+    of any ST) and `segment_count` the segments counted from ST through its
+    first SE, set when that SE is reached. `claims_after_se` is True when a
+    claim was opened after the SE, before the next ST.
+    """
+    __slots__ = ('number', 'segment_count', 'claims_after_se')
+
+    def __init__(self, number: int = 0):
+        super().__init__('ST')
+        self.number = number
+        self.segment_count: Optional[int] = None
+        self.claims_after_se = False
+
+
+class Claim(Loop, Mapping):
+    """A 2300 claim loop: segments from a CLM up to the next CLM, HL or SE.
+
+    Its 2400 service line segments are kept in `segments` as well, and the
+    parent chain reaches the billing provider, subscriber and patient loops
+    without searching. Service lines and diagnoses are read through the tag
+    index; the `service_lines` and `diagnosis` keys build their lists on
+    access and are absent when the claim has none, exactly like the old
+    dicts.
+    """
+    __slots__ = ('clm',)
+
+    def __init__(self, clm: Optional[Sequence[str]] = None, parent: Optional[Loop] = None):
+        super().__init__('2300', parent)
+        self.clm = clm if clm is not None else []
+
+    @property
+    def billing_provider(self) -> Optional[Loop]:
+        return self.ancestor('2000A')
+
+    @property
+    def subscriber(self) -> Optional[Loop]:
+        return self.ancestor('2000B')
+
+    @property
+    def patient(self) -> Optional[Loop]:
+        return self.ancestor('2000C')
+
+    @property
+    def transaction(self) -> Optional[Loop]:
+        return self.ancestor('ST')
+
+    def service_line_loops(self) -> List[Loop]:
+        """2400 loops of the claim, each opened by an LX (or by SV1/SV2 without LX)."""
+        starts = self.positions('LX') or self.positions(*SERVICE_LINE_TAGS)
+        lines = []
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(self.segments)
+            line = Loop('2400', self)
+            for segment in self.segments[start:end]:
+                line.append(segment)
+            lines.append(line)
+        return lines
+
+    @property
+    def service_lines(self) -> List[Sequence[str]]:
+        return [self.segments[i].parts for i in self.positions(*SERVICE_LINE_TAGS)]
+
+    @property
+    def diagnosis(self) -> List[Sequence[str]]:
+        return [self.segments[i].parts for i in self.positions(*DIAGNOSIS_TAGS)]
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'CLM':
+            return self.clm
+        if key == 'segments':
+            return self.segments
+        if key == 'service_lines' and self.has(*SERVICE_LINE_TAGS):
+            return self.service_lines
+        if key == 'diagnosis' and self.has(*DIAGNOSIS_TAGS):
+            return self.diagnosis
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield 'CLM'
+        yield 'segments'
+        if self.has(*SERVICE_LINE_TAGS):
+            yield 'service_lines'
+        if self.has(*DIAGNOSIS_TAGS):
+            yield 'diagnosis'
+
+    def __len__(self) -> int:
+        return 2 + self.has(*SERVICE_LINE_TAGS) + self.has(*DIAGNOSIS_TAGS)
+
+    # a claim is a node of its parse's loop tree, so it compares and hashes
+    # by identity rather than by the contents `Mapping` would compare;
+    # compare `as_dict()` copies to match claims across parses
+    def __eq__(self, other: object) -> bool:
+        return self is other
+
+    def __hash__(self) -> int:
+        return id(self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Plain-dict copy in the historical shape, safe for `json.dumps`."""
+        out = {'CLM': list(self.clm), 'segments': [s.as_dict() for s in self.segments]}
+        if self.has(*SERVICE_LINE_TAGS):
+            out['service_lines'] = [list(p) for p in self.service_lines]
+        if self.has(*DIAGNOSIS_TAGS):
+            out['diagnosis'] = [list(p) for p in self.diagnosis]
+        return out
+
+
+def claim_tags(claim: Mapping) -> Iterable[str]:
+    """Distinct segment tags of a claim object or a plain claim dict."""
+    index = getattr(claim, 'tag_index', None)
+    if index is not None:
+        return index.keys()
+    return {s.get('tag') for s in (claim.get('segments') or [])}
+
+
+def tagged_segments(claim: Mapping, tag: str) -> Iterator[Mapping]:
+    """Segments of a claim with the given tag, using its index when it has one."""
+    index = getattr(claim, 'tag_index', None)
+    if index is not None:
+        segments = claim.segments
+        return (segments[i] for i in index.get(tag, ()))
+    return (s for s in (claim.get('segments') or []) if s.get('tag') == tag)
+
+
+def context_has(claim: Mapping, loop_id: str, *tags: str) -> bool:
+    """True when the claim's enclosing `loop_id` loop holds any of `tags`.
+
+    Plain claim dicts carry no loop tree and always answer False.
+    """
+    ancestor = getattr(claim, 'ancestor', None)
+    if ancestor is None:
+        return False
+    loop = ancestor(loop_id)
+    return loop is not None and loop.has(*tags)
+
+
+def build_tag_index(claims: Iterable[Mapping]) -> Dict[str, List[int]]:
+    """Document-level index: segment tag -> positions of the claims holding it."""
+    index: Dict[str, List[int]] = {}
+    for i, claim in enumerate(claims):
+        for tag in claim_tags(claim):
+            positions = index.get(tag)
+            if positions is None:
+                index[tag] = [i]
+            else:
+                positions.append(i)
+    return index
+
+
+def to_plain(obj: Any) -> Any:
+    """`json.dumps` default hook for parsed documents holding claim objects."""
+    if hasattr(obj, 'as_dict'):
+        return obj.as_dict()
+    if isinstance(obj, Sequence):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,119 @@
+"""Incremental decoding of 837 byte input with encoding detection.
+
+`DecodingReader` is a read-only text stream over an iterable of byte chunks.
+It sniffs the encoding from a byte order mark or from the first bytes (the
+ISA header onwards), then decodes one chunk at a time, so the parser's text
+path can consume an upload without a decoded copy of the whole file being
+made first. Bytes that are invalid in the detected encoding are replaced
+with U+FFFD rather than dropped, and counted: `as_dict()` reports them for
+the `decoding_clean` rule condition.
+"""
+import codecs
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Bytes examined when sniffing the encoding
+SNIFF_BYTES = 64 * 1024
+
+# Replacement offsets kept in the report; the count covers all of them
+MAX_REPORTED_OFFSETS = 10
+
+# Byte order marks, longest first so UTF-32 is not mistaken for UTF-16
+BOMS: Tuple[Tuple[bytes, str], ...] = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+REPLACEMENT = '\ufffd'
+
+
+def sniff_encoding(head: bytes) -> Tuple[str, bytes]:
+    """`(encoding, bom)` of input starting with `head`.
+
+    A byte order mark decides the encoding. Otherwise an ISA header with
+    zero bytes between its letters is UTF-16; anything else is UTF-8 when
+    `head` is valid UTF-8 and latin-1 (which maps every byte) when not.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, bom
+    start = head.lstrip()
+    if start.startswith(b'I\x00S\x00A\x00'):
+        return 'utf-16-le', b''
+    if start.startswith(b'\x00I\x00S\x00A'):
+        return 'utf-16-be', b''
+    try:
+        # not final: `head` may end inside a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8', b''
+    except UnicodeDecodeError:
+        return 'latin-1', b''
+
+
+class DecodingReader:
+    """Text file object decoding byte chunks as they are read.
+
+    `encoding` is sniffed with `sniff_encoding` unless given; a byte order
+    mark is skipped either way. `replaced` counts the U+FFFD characters in
+    the decoded text and `offsets` holds the character offsets of the first
+    `MAX_REPORTED_OFFSETS` of them.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], encoding: Optional[str] = None):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        head = b''
+        for chunk in self._chunks:
+            head += chunk
+            if len(head) >= SNIFF_BYTES:
+                break
+        sniffed, self.bom = sniff_encoding(head)
+        self.encoding = encoding or sniffed
+        self.replaced = 0
+        self.offsets: List[int] = []
+        self._decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        self._position = 0
+        self._buffer = ''
+        self._done = False
+        self._decode(head[len(self.bom):])
+
+    def _decode(self, data: Optional[bytes]) -> None:
+        if data is None:
+            text = self._decoder.decode(b'', final=True)
+            self._done = True
+        else:
+            text = self._decoder.decode(data)
+        if REPLACEMENT in text:
+            self.replaced += text.count(REPLACEMENT)
+            pos = text.find(REPLACEMENT)
+            while pos >= 0 and len(self.offsets) < MAX_REPORTED_OFFSETS:
+                self.offsets.append(self._position + pos)
+                pos = text.find(REPLACEMENT, pos + 1)
+        self._position += len(text)
+        self._buffer += text
+
+    def _fill(self, size: int) -> None:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            self._decode(next(self._chunks, None))
+
+    def peek(self, size: int) -> str:
+        """Up to `size` upcoming characters, left unread."""
+        self._fill(size)
+        return self._buffer[:size]
+
+    def read(self, size: int = -1) -> str:
+        self._fill(size)
+        if size < 0 or len(self._buffer) <= size:
+            text, self._buffer = self._buffer, ''
+        else:
+            text, self._buffer = self._buffer[:size], self._buffer[size:]
+        return text
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'encoding': self.encoding,
+            'bom': bool(self.bom),
+            'replaced': self.replaced,
+            'offsets': list(self.offsets),
+        }
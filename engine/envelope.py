@@ -0,0 +1,195 @@
+"""Envelope integrity checks, computed while the parser streams segments.
+
+`EnvelopeReport` is fed the ISA/GS/ST headers and SE/GE/IEA trailers by
+`engine.parser.iter_claims` as they go past, so the checks cost nothing
+beyond the single parsing pass:
+
+  - SE01 equals the number of segments from ST through SE
+  - SE02 equals ST02, GE02 equals GS06 and IEA02 equals ISA13
+  - GE01 equals the transaction sets in the group, IEA01 the groups in
+    the interchange
+  - every header has its trailer and every trailer its header
+
+Each failed check becomes an entry of `errors`, which `parse_837` exposes
+as `parsed['envelope']` for the `envelope_valid` rule condition.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+# Checks reported in `errors`: the element compared, or the trailer or
+# header segment that is missing
+COUNT_CHECKS = ('SE01', 'GE01', 'IEA01')
+CONTROL_NUMBER_CHECKS = ('SE02', 'GE02', 'IEA02')
+STRUCTURE_CHECKS = ('SE', 'GE', 'IEA', 'ST', 'GS', 'ISA')
+
+# Checks made at a transaction set's own SE trailer
+TRANSACTION_CHECKS = ('SE01', 'SE02', 'SE', 'ST')
+
+
+def _element(parts: Sequence[str], n: int) -> str:
+    return parts[n].strip() if len(parts) > n else ''
+
+
+def _same_number(declared: str, actual: str) -> bool:
+    """Control numbers match textually, or as numbers when both are numeric."""
+    if declared == actual:
+        return True
+    return declared.isdigit() and actual.isdigit() and int(declared) == int(actual)
+
+
+def segment_count_error(transaction: Any, counted: int, se: Optional[Sequence[str]] = None,
+                        control: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """SE01 error for a transaction set loop holding `counted` segments, if any.
+
+    `se` (the SE parts) and `control` (ST02) are read from the loop unless
+    given.
+    """
+    if se is None:
+        segment = transaction.find('SE')
+        if segment is None:
+            return None
+        se = segment.parts
+    declared = _element(se, 1)
+    if declared.isdigit() and int(declared) == counted:
+        return None
+    if control is None:
+        st = transaction.find('ST')
+        control = _element(st.parts, 2) if st is not None else ''
+    return {
+        'check': 'SE01',
+        'transaction': transaction.number,
+        'control_number': control,
+        'expected': str(counted),
+        'found': declared,
+        'message': f"SE01 says {declared or 'nothing'} but transaction set {control} has {counted} segments",
+    }
+
+
+class EnvelopeReport:
+    """Counters and errors for the envelopes of one document.
+
+    With `transaction_sets` False only the interchange and group checks are
+    made: ST headers still count toward GE01, but SE trailers are ignored.
+    """
+
+    def __init__(self, transaction_sets: bool = True):
+        self.transaction_sets = transaction_sets
+        self.interchanges = 0
+        self.groups = 0
+        self.transactions = 0
+        # ST headers whose ST01 identifies an 837
+        self.valid_headers = 0
+        self.errors: List[Dict[str, Any]] = []
+        # control numbers of the open ISA, GS and ST (None when closed)
+        self._isa: Optional[str] = None
+        self._gs: Optional[str] = None
+        self._st: Optional[str] = None
+        self._groups_in_isa = 0
+        self._sets_in_gs = 0
+
+    def _error(self, check: str, control: str, expected: str, found: str, message: str) -> None:
+        self.errors.append({
+            'check': check,
+            'transaction': self.transactions,
+            'control_number': control,
+            'expected': expected,
+            'found': found,
+            'message': message,
+        })
+
+    def _missing_trailer(self, trailer: str, control: str) -> None:
+        self._error(trailer, control, trailer, '', f'{trailer} trailer missing for control number {control}')
+
+    def control(self, tag: str, parts: Sequence[str], transaction: Any) -> None:
+        """Record one envelope segment; `transaction` is the current ST loop."""
+        if tag == 'ISA':
+            if self._isa is not None:
+                self._missing_trailer('IEA', self._isa)
+            self.interchanges += 1
+            self._isa = _element(parts, 13)
+            self._groups_in_isa = 0
+        elif tag == 'GS':
+            if self._gs is not None:
+                self._missing_trailer('GE', self._gs)
+            self.groups += 1
+            self._groups_in_isa += 1
+            self._gs = _element(parts, 6)
+            self._sets_in_gs = 0
+        elif tag == 'ST':
+            if self._st is not None:
+                self._missing_trailer('SE', self._st)
+            self.transactions += 1
+            self._sets_in_gs += 1
+            if self.transaction_sets:
+                self._st = _element(parts, 2)
+            if _element(parts, 1) == '837':
+                self.valid_headers += 1
+        elif tag == 'SE':
+            if not self.transaction_sets:
+                return
+            if self._st is None:
+                self._error('ST', _element(parts, 2), 'ST', '', 'SE trailer without an ST header')
+                return
+            error = segment_count_error(transaction, transaction.segment_count, parts, self._st)
+            if error is not None:
+                self.errors.append(error)
+            self._trailer_control('SE02', parts, self._st)
+            self._st = None
+        elif tag == 'GE':
+            if self._gs is None:
+                self._error('GS', _element(parts, 2), 'GS', '', 'GE trailer without a GS header')
+                return
+            self._trailer_count('GE01', parts, self._sets_in_gs, 'group', self._gs, 'transaction sets')
+            self._trailer_control('GE02', parts, self._gs)
+            self._gs = None
+        elif tag == 'IEA':
+            if self._isa is None:
+                self._error('ISA', _element(parts, 2), 'ISA', '', 'IEA trailer without an ISA header')
+                return
+            self._trailer_count('IEA01', parts, self._groups_in_isa, 'interchange', self._isa, 'functional groups')
+            self._trailer_control('IEA02', parts, self._isa)
+            self._isa = None
+
+    def _trailer_count(self, check: str, parts: Sequence[str], actual: int, envelope: str, control: str,
+                       what: str) -> None:
+        declared = _element(parts, 1)
+        if not (declared.isdigit() and int(declared) == actual):
+            self._error(check, control, str(actual), declared,
+                        f"{check} says {declared or 'nothing'} but {envelope} {control} encloses {actual} {what}")
+
+    def _trailer_control(self, check: str, parts: Sequence[str], control: str) -> None:
+        declared = _element(parts, 2)
+        if not _same_number(declared, control):
+            self._error(check, control, control, declared,
+                        f"{check} control number {declared or 'missing'} does not match header {control}")
+
+    def finish(self) -> None:
+        """Report the envelopes still open at the end of the input."""
+        if self._st is not None:
+            self._missing_trailer('SE', self._st)
+        if self._gs is not None:
+            self._missing_trailer('GE', self._gs)
+        if self._isa is not None:
+            self._missing_trailer('IEA', self._isa)
+        self._st = self._gs = self._isa = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'interchanges': self.interchanges,
+            'groups': self.groups,
+            'transactions': self.transactions,
+            'valid_headers': self.valid_headers,
+            'errors': self.errors,
+        }
+
+
+def with_segment_count(envelope: Dict[str, Any], transaction: Any, counted: int) -> Dict[str, Any]:
+    """Copy of a `parsed['envelope']` dict with the SE01 check of `transaction`
+    redone for `counted` segments, keeping errors in document order."""
+    number = transaction.number
+    errors = [e for e in envelope['errors'] if not (e['check'] == 'SE01' and e['transaction'] == number)]
+    error = segment_count_error(transaction, counted)
+    if error is not None:
+        # SE01 is the first check made at a transaction set's SE
+        at = next((i for i, e in enumerate(errors) if e['transaction'] >= number), len(errors))
+        errors.insert(at, error)
+    return dict(envelope, errors=errors)
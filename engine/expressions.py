@@ -0,0 +1,354 @@
+"""Safe compiled expressions for the `model/rules/ruleset.json` conditions.
+
+Conditions there are small Python-like expressions over X12 element
+references and named reference data::
+
+    clm05_1 is null
+    len(npi) != 10 or not npi.isdigit()
+    procedure in em_list and '25' not in modifiers
+
+`compile_expression` parses one with `ast` and turns every node into a
+closure, rejecting any node outside a small whitelist (comparisons,
+boolean logic, literals, subscripts, `len` and a few string methods), so
+no condition text is ever passed to `eval`. Compiled expressions are
+cached by their text.
+
+Names shaped like `<segment><element>[_<component>]` (`st01`, `clm05_1`,
+`sv101_2`) read the first such segment of the claim, or of its nearest
+enclosing loop, and evaluate to None when the element is absent or blank
+(`null` is None). Any other name is looked up in the `variables` the
+expression is evaluated with.
+
+`load_ruleset` reads the ruleset as rule dicts with an `expression`
+condition, ready for `engine.rules_engine.evaluate_rules` and
+`evaluate_claims`.
+"""
+import ast
+import io
+import json
+import operator
+import os
+import re
+import tokenize
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional
+
+from .claims import tagged_segments
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+RULESET_PATH = os.path.join(os.path.dirname(__file__), '..', 'model', 'rules', 'ruleset.json')
+
+# Element reference: segment tag, two-digit element position, optional component
+ELEMENT_NAME = re.compile(r'([a-z][a-z0-9]{1,2}?)(\d{2})(?:_(\d+))?')
+
+# Callables an expression may use
+FUNCTIONS: Dict[str, Callable] = {'len': len, 'int': int, 'str': str}
+
+# String methods an expression may call
+STRING_METHODS = frozenset({'isdigit', 'startswith', 'endswith', 'upper', 'lower', 'strip'})
+
+# Failures of an expression on one claim's data (a missing value compared
+# with `<`, indexing a short string, ...): the expression does not hold
+EVALUATION_ERRORS = (TypeError, ValueError, IndexError, KeyError)
+
+_COMPARISONS: Dict[type, Callable[[Any, Any], bool]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+_UNARY: Dict[type, Callable[[Any], Any]] = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+_CONSTANT_TYPES = (str, int, float, bool, type(None))
+
+
+class ExpressionError(ValueError):
+    """A condition that is not valid syntax or uses something outside the whitelist."""
+
+
+class Scope:
+    """What an expression reads while evaluated against one claim.
+
+    Segments are looked up once per tag: in the claim, then in its
+    enclosing loops (`engine.parser` claims) or among its `segments`
+    (plain claim dicts).
+    """
+    __slots__ = ('claim', 'component', 'variables', '_segments')
+
+    def __init__(self, claim: Mapping, component: str = ':', variables: Optional[Mapping] = None):
+        self.claim = claim
+        self.component = component
+        self.variables = variables or {}
+        self._segments: Dict[str, Optional[Any]] = {}
+
+    def _segment(self, tag: str) -> Optional[Any]:
+        if tag in self._segments:
+            return self._segments[tag]
+        segment = next(tagged_segments(self.claim, tag), None)
+        loop = getattr(self.claim, 'parent', None)
+        while segment is None and loop is not None:
+            segment = loop.find(tag)
+            loop = loop.parent
+        self._segments[tag] = segment
+        return segment
+
+    def element(self, tag: str, position: int, component: Optional[int]) -> Optional[str]:
+        segment = self._segment(tag)
+        parts = segment['parts'] if segment is not None else ()
+        value = parts[position] if len(parts) > position else ''
+        if component is not None and value:
+            components = value.split(self.component)
+            value = components[component - 1] if len(components) >= component else ''
+        return value or None
+
+
+Node = Callable[[Scope], Any]
+
+
+def _compile_compare(node: ast.Compare) -> Node:
+    left = _compile(node.left)
+    steps = []
+    for op, right in zip(node.ops, node.comparators):
+        if isinstance(op, (ast.In, ast.NotIn)) and _is_literal(right):
+            # a literal code list is searched as a set, built once
+            values = frozenset(item.value for item in right.elts)
+            steps.append((_COMPARISONS[type(op)], lambda scope, values=values: values))
+        else:
+            steps.append((_COMPARISONS[type(op)], _compile(right)))
+    if len(steps) == 1:
+        (op, right), = steps
+        return lambda scope: op(left(scope), right(scope))
+
+    def compare(scope: Scope) -> bool:
+        # chained comparisons: each operand is evaluated at most once
+        a = left(scope)
+        for op, right in steps:
+            b = right(scope)
+            if not op(a, b):
+                return False
+            a = b
+        return True
+    return compare
+
+
+def _compile_bool(node: ast.BoolOp) -> Node:
+    operands = [_compile(value) for value in node.values]
+    if isinstance(node.op, ast.And):
+        def all_of(scope: Scope) -> Any:
+            for operand in operands:
+                value = operand(scope)
+                if not value:
+                    return value
+            return value
+        return all_of
+
+    def any_of(scope: Scope) -> Any:
+        for operand in operands:
+            value = operand(scope)
+            if value:
+                return value
+        return value
+    return any_of
+
+
+def _compile_name(node: ast.Name) -> Node:
+    name = node.id
+    if name.startswith('_'):
+        raise ExpressionError(f"name '{name}' is not allowed")
+    match = ELEMENT_NAME.fullmatch(name)
+    if match:
+        tag, position, component = match.group(1).upper(), int(match.group(2)), match.group(3)
+        component = int(component) if component else None
+        return lambda scope: scope.element(tag, position, component)
+    return lambda scope: scope.variables[name]
+
+
+def _compile_call(node: ast.Call) -> Node:
+    if node.keywords:
+        raise ExpressionError('keyword arguments are not allowed')
+    args = [_compile(arg) for arg in node.args]
+    func = node.func
+    if isinstance(func, ast.Name) and func.id in FUNCTIONS:
+        fn = FUNCTIONS[func.id]
+        return lambda scope: fn(*[arg(scope) for arg in args])
+    if isinstance(func, ast.Attribute) and func.attr in STRING_METHODS:
+        target, method = _compile(func.value), getattr(str, func.attr)
+
+        def call(scope: Scope) -> Any:
+            value = target(scope)
+            if not isinstance(value, str):
+                raise TypeError(f"{func.attr}() of a {type(value).__name__}")
+            return method(value, *[arg(scope) for arg in args])
+        return call
+    raise ExpressionError(f"call to '{ast.unparse(func)}' is not allowed")
+
+
+def _compile_sequence(node: ast.AST) -> Node:
+    items = [_compile(item) for item in node.elts]
+    build = {ast.List: list, ast.Tuple: tuple, ast.Set: frozenset}[type(node)]
+    if _is_literal(node):
+        values = build(item.value for item in node.elts)
+        return lambda scope: values
+    return lambda scope: build(item(scope) for item in items)
+
+
+def _is_literal(node: ast.AST) -> bool:
+    return isinstance(node, (ast.List, ast.Tuple, ast.Set)) and all(
+        isinstance(item, ast.Constant) for item in node.elts)
+
+
+def _compile_subscript(node: ast.Subscript) -> Node:
+    value = _compile(node.value)
+    index = node.slice
+    if isinstance(index, ast.Slice):
+        bounds = [_compile(b) if b is not None else (lambda scope: None)
+                  for b in (index.lower, index.upper, index.step)]
+        return lambda scope: value(scope)[slice(*[b(scope) for b in bounds])]
+    key = _compile(index)
+    return lambda scope: value(scope)[key(scope)]
+
+
+def _compile(node: ast.AST) -> Node:
+    """Closure evaluating a whitelisted expression node against a `Scope`."""
+    if isinstance(node, ast.Expression):
+        return _compile(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, _CONSTANT_TYPES):
+        value = node.value
+        return lambda scope: value
+    if isinstance(node, ast.Name):
+        return _compile_name(node)
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARISONS for op in node.ops):
+        return _compile_compare(node)
+    if isinstance(node, ast.BoolOp):
+        return _compile_bool(node)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        op, operand = _UNARY[type(node.op)], _compile(node.operand)
+        return lambda scope: op(operand(scope))
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return _compile_sequence(node)
+    if isinstance(node, ast.Subscript):
+        return _compile_subscript(node)
+    if isinstance(node, ast.Call):
+        return _compile_call(node)
+    raise ExpressionError(f"{type(node).__name__} is not allowed in a condition")
+
+
+def _python_source(text: str) -> str:
+    """`text` with every `null` name token spelled `None`."""
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(text).readline):
+            if token.type == tokenize.NAME and token.string == 'null':
+                token = token._replace(string='None')
+            tokens.append(token)
+    except (tokenize.TokenError, IndentationError) as e:
+        raise ExpressionError(f"invalid condition {text!r}: {e}") from None
+    return tokenize.untokenize(tokens)
+
+
+class Expression:
+    """A compiled condition: call it with a `Scope` for its value.
+
+    `elements` are the element references it reads and `names` the
+    variables it needs.
+    """
+    __slots__ = ('text', 'elements', 'names', '_node')
+
+    def __init__(self, text: str, node: Node, elements: FrozenSet[str], names: FrozenSet[str]):
+        self.text = text
+        self.elements = elements
+        self.names = names
+        self._node = node
+
+    def __call__(self, scope: Scope) -> Any:
+        return self._node(scope)
+
+    def holds(self, scope: Scope) -> bool:
+        """Whether the expression is true for the scope's claim; False when it fails on its data."""
+        try:
+            return bool(self._node(scope))
+        except EVALUATION_ERRORS:
+            return False
+
+    def __repr__(self) -> str:
+        return f"Expression({self.text!r})"
+
+
+@lru_cache(maxsize=None)
+def compile_expression(text: str) -> Expression:
+    """Compile a condition once; later calls with the same text return the same `Expression`."""
+    try:
+        tree = ast.parse(_python_source(text).strip(), mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError(f"invalid condition {text!r}: {e.msg}") from None
+    node = _compile(tree)
+    called = {id(n.func) for n in ast.walk(tree) if isinstance(n, ast.Call)}
+    names = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and id(n) not in called}
+    elements = frozenset(n for n in names if ELEMENT_NAME.fullmatch(n))
+    return Expression(text, node, elements, frozenset(names - elements))
+
+
+# ruleset.json claim types -> `transaction_type` of the parses they apply to
+CLAIM_TYPES = {'837P': 'professional', '837I': 'institutional'}
+
+
+def ruleset_rule(rule: Dict[str, Any], variables: Optional[Mapping] = None) -> Dict[str, Any]:
+    """A ruleset.json rule as a `rules_engine` rule dict with an `expression` condition."""
+    # rejects bad conditions at load time
+    missing = compile_expression(rule['condition']).names - set(variables or ())
+    if missing:
+        logger.warning(f"Rule {rule.get('id')} needs {', '.join(sorted(missing))}; it never matches without them")
+    conditions: List[Dict[str, Any]] = []
+    if rule.get('claim_type') in CLAIM_TYPES:
+        conditions.append({'type': 'txn_is', 'value': CLAIM_TYPES[rule['claim_type']]})
+    condition = {'type': 'expression', 'expr': rule['condition']}
+    if variables:
+        condition['variables'] = dict(variables)
+    conditions.append(condition)
+    return {
+        'id': rule.get('id'),
+        'category': rule.get('category'),
+        'severity': rule.get('severity', 'medium'),
+        'message': rule.get('description'),
+        'fix': rule.get('recommendation'),
+        'conditions': conditions,
+    }
+
+
+def load_ruleset(path: str = RULESET_PATH, variables: Optional[Mapping] = None) -> List[Dict[str, Any]]:
+    """Rules of a ruleset.json file, converted with `ruleset_rule`.
+
+    `variables` is the reference data (code lists, eligibility dates, ...)
+    the conditions name besides element references. A rule that needs a
+    variable not given never matches.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    rules = [ruleset_rule(rule, variables) for rule in data.get('rules', [])]
+    logger.info(f"Loaded {len(rules)} expression rules from {os.path.basename(path)}")
+    return rules
+
+
+def expression_test(expr: str, variables: Optional[Mapping] = None) -> Callable[[Mapping, str], bool]:
+    """`test(claim, component)`: whether `expr` holds for a claim, with `variables` bound.
+
+    Without every variable it names, the expression never holds.
+    """
+    expression = compile_expression(expr)
+    variables = dict(variables or {})
+    if expression.names - variables.keys():
+        return lambda claim, component: False
+    return lambda claim, component: expression.holds(Scope(claim, component, variables))
@@ -0,0 +1,317 @@
+"""Incremental re-parse and re-validation of edited 837 text.
+
+`IncrementalDocument` keeps a parse together with the text it came from and
+absorbs edits without parsing the whole file again: the edited text is
+compared with the previous one to find the changed range, the claims
+covering that range are re-parsed from the edited text and spliced into a
+new result, and the document tag index, per-claim rule facts and the SE01
+check of the edited transaction set are updated for those claims only.
+Claims whose content hash is unchanged keep their previous objects and
+facts.
+
+Edits that reach outside claim loops (envelope, HL, provider or subscriber
+segments) change the context of other claims, so they fall back to a full
+parse. The previous result is never modified, so it may safely live in
+`engine.cache`.
+"""
+import hashlib
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import rules_engine
+from .claims import Claim, Segment, build_tag_index
+from .envelope import with_segment_count
+from .logger import setup_logger
+from .parser import CLAIM_CLOSING_TAGS, DEFAULT_ENCODING, _tokenize, _transaction_type, parse_837, read_segments
+
+logger = setup_logger(__name__)
+
+# Characters compared at a time when looking for the edited range
+COMPARE_BLOCK = 64 * 1024
+
+_WHITESPACE = {str: re.compile(r'\s*'), bytes: re.compile(rb'\s*')}
+
+
+def claim_digest(claim: Claim) -> bytes:
+    """Content hash of a claim's raw segments."""
+    h = hashlib.blake2b(digest_size=16)
+    for segment in claim.segments:
+        raw = segment.raw
+        h.update(raw.encode('utf-8') if isinstance(raw, str) else raw)
+        h.update(b'\x1e')
+    return h.digest()
+
+
+def _common_prefix(a, b) -> int:
+    """Length of the longest common prefix of two strings (or byte strings)."""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + COMPARE_BLOCK] == b[i:i + COMPARE_BLOCK]:
+        i += COMPARE_BLOCK
+    hi = min(i + COMPARE_BLOCK, n)
+    while i < hi:
+        mid = (i + hi + 1) // 2
+        if a[i:mid] == b[i:mid]:
+            i = mid
+        else:
+            hi = mid - 1
+    return i
+
+
+def _common_suffix(a, b, limit: int) -> int:
+    """Length of the longest common suffix of `a` and `b`, at most `limit`."""
+    la, lb = len(a), len(b)
+    i = 0
+    while i < limit:
+        step = min(COMPARE_BLOCK, limit - i)
+        if a[la - i - step:la - i] == b[lb - i - step:lb - i]:
+            i += step
+            continue
+        lo, hi = 0, step
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[la - i - mid:la - i] == b[lb - i - mid:lb - i]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return i + lo
+    return i
+
+
+def _claim_spans(raw, claims: List[Claim], terminator, pos: int = 0) -> Optional[Tuple[List[int], List[int]]]:
+    """Start and end offsets of `claims` in `raw`, searching from `pos`.
+
+    An end includes the terminator and whitespace after the claim's last
+    segment, so text inserted right after a claim falls inside its span.
+    None when a claim does not start with a CLM or its segments are not
+    found one after the other at segment boundaries.
+    """
+    skip = _WHITESPACE[type(raw)].match
+    starts, ends = [], []
+    for claim in claims:
+        segments = claim.segments
+        if not segments or segments[0].tag != 'CLM':
+            return None
+        pos = raw.find(segments[0].raw, pos)
+        while pos > 0 and not _at_segment_start(raw, pos, terminator):
+            pos = raw.find(segments[0].raw, pos + 1)
+        if pos < 0:
+            return None
+        starts.append(pos)
+        for n, segment in enumerate(segments):
+            if n and not raw.startswith(segment.raw, pos):
+                return None
+            pos = skip(raw, pos + len(segment.raw)).end()
+            if raw.startswith(terminator, pos):
+                pos = skip(raw, pos + len(terminator)).end()
+            elif n + 1 < len(segments):
+                return None
+        ends.append(pos)
+    return starts, ends
+
+
+def _at_segment_start(raw, pos: int, terminator) -> bool:
+    """True when only whitespace separates `pos` from the previous terminator."""
+    end = pos
+    while end > 0 and raw[end - 1:end].isspace():
+        end -= 1
+    return end == 0 or raw[end - len(terminator):end] == terminator
+
+
+class IncrementalDocument:
+    """A parsed 837 that can be re-parsed and re-validated after edits.
+
+    `raw` must be `str` or `bytes`; `parsed` may be passed when the text has
+    already been parsed with `parse_837`. With `rules`, `findings` holds the
+    rule findings of the current text. After `update`, `changed` is the
+    `(start, stop)` range of claim positions that were re-parsed, or None
+    when the whole document was.
+    """
+
+    def __init__(self, raw: Union[str, bytes], rules: Optional[List[Dict[str, Any]]] = None,
+                 parsed: Optional[Dict] = None, encoding: str = DEFAULT_ENCODING):
+        self.encoding = encoding
+        self.rules = rules
+        self.changed: Optional[Tuple[int, int]] = None
+        self._reset(raw, parsed if parsed is not None else parse_837(raw, encoding=encoding))
+
+    def _reset(self, raw, parsed: Dict) -> None:
+        self.raw = raw
+        self.parsed = parsed
+        self._delimiters = None
+        self._spans = None
+        self._digests = None
+        self._facts = None
+        self._fact_counts = None
+        # segments added (or removed) per transaction set number since the full parse
+        self._segment_delta: Dict[int, int] = {}
+        self.findings = None
+        if self.rules is not None:
+            self._facts = [rules_engine.claim_facts(c) for c in parsed['claims']]
+            self._fact_counts = rules_engine.count_facts(self._facts)
+            self.findings = rules_engine.evaluate_rules(parsed, self.rules, fact_counts=self._fact_counts)
+
+    def update(self, edited: Union[str, bytes]) -> Dict:
+        """Re-parse after the text changed to `edited`; returns the new parse."""
+        if edited == self.raw:
+            self.changed = (0, 0)
+            return self.parsed
+        window = self._edited_window(edited)
+        claims = self._parse_window(edited, *window) if window is not None else None
+        if claims is not None and getattr(self.parsed['claims'][window[0]].transaction, 'claims_after_se', False):
+            # the edit may lie on either side of the SE that was counted
+            claims = None
+        if claims is None:
+            logger.info("Edit reaches outside claim loops; re-parsing the whole document")
+            self.changed = None
+            self._reset(edited, parse_837(edited, encoding=self.encoding))
+        else:
+            self._splice(edited, window[0], window[1], window[3], claims)
+        return self.parsed
+
+    def _separators(self) -> Tuple[Any, Any]:
+        """Element separator and segment terminator, typed like `raw`."""
+        if self._delimiters is None:
+            self._delimiters = read_segments(self.raw)[0]
+        element, terminator = self._delimiters.element, self._delimiters.segment
+        if isinstance(self.raw, bytes):
+            element, terminator = element.encode('latin-1'), terminator.encode('latin-1')
+        return element, terminator
+
+    def _edited_window(self, edited) -> Optional[Tuple[int, int, int, int]]:
+        """`(first, stop, start, end)`: claims `first:stop` of the previous
+        parse cover the edit, and their edited text is `edited[start:end]`."""
+        raw = self.raw
+        if type(edited) is not type(raw) or type(raw) not in (str, bytes) or not self.parsed.get('claims'):
+            return None
+        self._separators()
+        if read_segments(edited)[0] != self._delimiters:
+            # a damaged ISA lets delimiter detection read into the claims
+            return None
+        if self._spans is None:
+            self._spans = _claim_spans(raw, self.parsed['claims'], self._separators()[1])
+            if self._spans is None:
+                return None
+        starts, ends = self._spans
+        prefix = _common_prefix(raw, edited)
+        suffix = _common_suffix(raw, edited, min(len(raw), len(edited)) - prefix)
+        changed_end = len(raw) - suffix
+
+        first = bisect_right(starts, prefix) - 1
+        if first < 0:
+            return None
+        stop = max(bisect_right(starts, changed_end), first + 1)
+        if changed_end > ends[stop - 1]:
+            return None
+        # loop segments between the claims may have been edited too
+        if any(ends[k] != starts[k + 1] for k in range(first, stop - 1)):
+            return None
+        return first, stop, starts[first], ends[stop - 1] + len(edited) - len(raw)
+
+    def _parse_window(self, edited, first: int, stop: int, start: int, end: int) -> Optional[List[Claim]]:
+        """Claims of `edited[start:end]`, or None when it holds anything but
+        whole claims."""
+        element, terminator = self._separators()
+        split = self.parsed['claims'][first].segments[0]._split
+        parent = self.parsed['claims'][first].parent
+        binary = isinstance(edited, bytes)
+        text = edited[start:end]
+        if text.strip() and not text.rstrip().endswith(terminator):
+            # the last segment now runs on into the text after the window
+            return None
+        window: List[Claim] = []
+        for seg in _tokenize((text,), terminator):
+            pos = seg.find(element)
+            tag = seg if pos < 0 else seg[:pos]
+            if binary:
+                tag = tag.decode('latin-1')
+            if tag == 'CLM':
+                parts = split(seg)
+                window.append(Claim(parts, parent))
+                window[-1].append(Segment(tag, seg, split, parts))
+            elif tag in CLAIM_CLOSING_TAGS or not window:
+                return None
+            else:
+                window[-1].append(Segment(tag, seg, split))
+        return window
+
+    def _splice(self, edited, first: int, stop: int, end: int, window: List[Claim]) -> None:
+        old = self.parsed['claims']
+        if self._digests is None:
+            self._digests = [claim_digest(c) for c in old]
+        # keep the previous objects for claims whose content did not change
+        previous = {self._digests[i]: i for i in range(first, stop)}
+        digests = [claim_digest(c) for c in window]
+        reused = [previous.get(d) for d in digests]
+        window = [c if i is None else old[i] for i, c in zip(reused, window)]
+
+        tag_index = self._updated_tag_index(first, stop, window)
+        claims = old[:first] + window + old[stop:]
+        self.parsed = dict(self.parsed, claims=claims, tag_index=tag_index,
+                           transaction_type=_transaction_type(tag_index))
+        self._update_segment_count(old[first].transaction, old[first:stop], window)
+        self._digests[first:stop] = digests
+
+        starts, ends = self._spans
+        found = _claim_spans(edited, window, self._separators()[1], starts[first])
+        shift = len(edited) - len(self.raw)
+        if found is None or (window and found[1][-1] != end):
+            self._spans = None
+        else:
+            after = (starts[stop:], ends[stop:])
+            if shift:
+                after = tuple([p + shift for p in offsets] for offsets in after)
+            self._spans = (starts[:first] + found[0] + after[0], ends[:first] + found[1] + after[1])
+        self.raw = edited
+        self.changed = (first, first + len(window))
+
+        if self.rules is not None:
+            counts = dict(self._fact_counts)
+            new_facts = [rules_engine.claim_facts(c) if i is None else self._facts[i]
+                         for i, c in zip(reused, window)]
+            for facts, sign in ((self._facts[first:stop], -1), (new_facts, 1)):
+                for claim_facts in facts:
+                    for name, value in zip(rules_engine.CLAIM_FACTS, claim_facts):
+                        counts[name] += sign * value
+            self._facts[first:stop] = new_facts
+            self._fact_counts = counts
+            self.findings = rules_engine.evaluate_rules(self.parsed, self.rules, fact_counts=counts)
+
+    def _update_segment_count(self, transaction, removed: List[Claim], added: List[Claim]) -> None:
+        """Redo the SE01 check of `transaction` after `removed` became `added`."""
+        delta = sum(len(c.segments) for c in added) - sum(len(c.segments) for c in removed)
+        envelope = self.parsed.get('envelope')
+        if not delta or envelope is None or getattr(transaction, 'segment_count', None) is None:
+            return
+        delta += self._segment_delta.get(transaction.number, 0)
+        self._segment_delta[transaction.number] = delta
+        self.parsed['envelope'] = with_segment_count(envelope, transaction, transaction.segment_count + delta)
+
+    def _updated_tag_index(self, first: int, stop: int, window: List[Claim]) -> Dict[str, List[int]]:
+        claims = self.parsed['claims']
+        if len(window) != stop - first:
+            # positions after the window move; rebuild from the per-claim indexes
+            return build_tag_index(claims[:first] + window + claims[stop:])
+        index = dict(self.parsed['tag_index'])
+        touched = {tag for c in claims[first:stop] for tag in c.tag_index}
+        touched.update(tag for c in window for tag in c.tag_index)
+        for tag in touched:
+            positions = list(index.get(tag, ()))
+            positions[bisect_left(positions, first):bisect_left(positions, stop)] = [
+                first + n for n, c in enumerate(window) if tag in c.tag_index]
+            if positions:
+                index[tag] = positions
+            else:
+                index.pop(tag, None)
+        return index
+
+
+def reparse_837(previous: Dict, previous_raw: Union[str, bytes], edited_raw: Union[str, bytes],
+                encoding: str = DEFAULT_ENCODING) -> Dict:
+    """Parse `edited_raw` reusing `previous`, the parse of `previous_raw`.
+
+    Locating the claims costs one pass over the previous text; keep an
+    `IncrementalDocument` across edits to pay that once.
+    """
+    return IncrementalDocument(previous_raw, parsed=previous, encoding=encoding).update(edited_raw)
@@ -1,9 +1,17 @@
 from fastapi import FastAPI, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from app.backend.parser import parse_837
-from app.backend.model import predict_denial
+from engine.model import predict_denial
+from engine.archive import archive_kind, iter_members, parse_archive
+from engine.cache import RESULT_CACHE, cache_key
+from engine.parser import decode_stream
+from engine.rules_engine import RuleProfile, evaluate_rules, load_rules
 import json
 
+# Characters of an upload passed to the predictor as raw context; prompts
+# only quote the first 4000 (see engine.model.build_prompt)
+RAW_CONTEXT_CHARS = 4000
+
 app = FastAPI(title='OptiClaimAI Backend')
 
 app.add_middleware(
@@ -18,21 +26,67 @@ app.add_middleware(
 def health():
     return {'status':'ok'}
 
+def _parse_cached(content: bytes):
+    """Parse an upload, reusing the result for byte-identical re-uploads.
+
+    The upload is decoded chunk by chunk, in the encoding sniffed from its
+    BOM or ISA header, as the parser reads it; `decoding` reports that
+    encoding and any bytes that had to be replaced. A gzip, zip or tar
+    upload is parsed member by member in this process, decompressing as it
+    goes (no worker pool per request), and the result lists each member's
+    parse under `members`.
+    """
+    def parse():
+        if archive_kind(content):
+            return parse_archive(content, parse_837)
+        stream = decode_stream(content)
+        parsed = parse_837(stream)
+        parsed['decoding'] = stream.as_dict()
+        return parsed
+    return RESULT_CACHE.get_or_compute(cache_key('backend-parse', content), parse)
+
 @app.post('/parse')
 async def parse(file: UploadFile = File(...)):
     content = await file.read()
-    raw = content.decode('utf-8', errors='ignore')
-    parsed = parse_837(raw)
+    parsed = _parse_cached(content)
     return parsed
 
 @app.post('/predict')
-async def predict(file: UploadFile = File(...), use_ollama: bool = True):
+async def predict(file: UploadFile = File(...)):
     content = await file.read()
-    raw = content.decode('utf-8', errors='ignore')
-    parsed = parse_837(raw)
-    result = predict_denial(raw, parsed, use_ollama=use_ollama)
+    kind = archive_kind(content)
+    if kind:
+        return {'archive': kind, 'members': _predict_members(content)}
+    raw = decode_stream(content).read(RAW_CONTEXT_CHARS)
+    parsed = _parse_cached(content)
+    result = predict_denial(raw, parsed)
     return result
 
+@app.post('/profile')
+async def profile(file: UploadFile = File(...), scope: str = 'dhcs_comprehensive'):
+    """Per-rule and per-condition timings of the `scope` ruleset over an upload.
+
+    Each member of an archive upload is evaluated into the same profile.
+    """
+    content = await file.read()
+    parsed = _parse_cached(content)
+    rules = load_rules(scope)
+    report = RuleProfile()
+    for doc in parsed.get('members', [parsed]):
+        evaluate_rules(doc, rules, profile=report)
+    return dict(report.as_dict(), ruleset_version=rules.version)
+
+def _predict_members(content: bytes):
+    """Predictions for each member of an archive upload, streamed in order."""
+    results = []
+    for name, stream in iter_members(content):
+        reader = decode_stream(stream)
+        raw = reader.peek(RAW_CONTEXT_CHARS)
+        parsed = parse_837(reader)
+        parsed['decoding'] = reader.as_dict()
+        results.append(dict(predict_denial(raw, parsed), name=name))
+    return results
+
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run('app.backend.main:app', host='0.0.0.0', port=8000, reload=True)
+    uvicorn.run('engine.main:app', host='0.0.0.0', port=8000, reload=True)
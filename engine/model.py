@@ -1,9 +1,16 @@
 # engine/model.py
 import json
+import os
 from pathlib import Path
+from typing import Optional, Tuple, Union
 from . import rules_engine as re_engine
+from .cache import RESULT_CACHE, ResultCache, cache_key
+from .claims import to_plain
 from .llm import call_ollama
 from .logger import setup_logger
+from .parser import parse_837
+from .persist import load_parsed
+from . import vectorized
 
 logger = setup_logger(__name__)
 
@@ -17,7 +24,7 @@ def build_prompt(raw_837: str, parsed_json: dict, findings: list) -> str:
         "parsed_json": parsed_json,
         "rule_findings": findings
     }
-    prompt = PROMPT_TEMPLATE + "\n\nRULE_FINDINGS:\n" + json.dumps(findings, indent=2) + "\n\nINSTANCE_JSON:\n" + json.dumps(instance, indent=2)
+    prompt = PROMPT_TEMPLATE + "\n\nRULE_FINDINGS:\n" + json.dumps(findings, indent=2) + "\n\nINSTANCE_JSON:\n" + json.dumps(instance, indent=2, default=to_plain)
     return prompt
 
 def run_ollama(prompt: str, model: str = 'llama3.1') -> str:
@@ -53,10 +60,45 @@ def detect_claim_type(parsed_json: dict):
         return "Institutional", "Revenue codes detected in claim data"
     return "Professional", "No revenue codes detected, defaulting to professional claim"
 
-def compute_summary(issues: list, parsed_json: dict):
-    total_claims = len(parsed_json.get('claims', []))
-    invalid_claims = 1 if issues else 0
-    invalid_percentage = 100 if invalid_claims else 0
+def _claim_loops(claim):
+    """The claim and, for loop-tree claims, its enclosing loops up to ST."""
+    loop = claim
+    while loop is not None:
+        yield loop
+        loop = getattr(loop, 'parent', None)
+
+def dhcs_applies(parsed_json: dict) -> bool:
+    """True when a claim or its provider/subscriber loops name California:
+    an N4 state of CA or a Medi-Cal NM1/N1 name."""
+    seen = set()
+    for claim in parsed_json.get('claims', []):
+        for loop in _claim_loops(claim):
+            if id(loop) in seen:
+                break
+            seen.add(id(loop))
+            for segment in (loop.get('segments') if isinstance(loop, dict) else loop.segments) or []:
+                tag = segment.get('tag')
+                if tag == 'N4':
+                    parts = segment.get('parts') or ()
+                    if len(parts) > 2 and parts[2].strip().upper() == 'CA':
+                        return True
+                elif tag in ('NM1', 'N1'):
+                    if any('MEDI-CAL' in str(p).upper() for p in segment.get('parts') or ()):
+                        return True
+    return False
+
+def compute_summary(issues: list, parsed_json: dict, claim_results: Optional[dict] = None):
+    """Claim counts and rework estimate; `claim_results` is an
+    `evaluate_claims` result (`engine.vectorized` or `engine.rules_engine`),
+    without which any issue counts as one invalid claim."""
+    if claim_results is not None:
+        total_claims = claim_results['total_claims']
+        invalid_claims = claim_results['invalid_claims']
+        invalid_percentage = claim_results['invalid_percentage']
+    else:
+        total_claims = len(parsed_json.get('claims', []))
+        invalid_claims = 1 if issues else 0
+        invalid_percentage = 100 if invalid_claims else 0
     high_risk_issues = sum(1 for i in issues if i['severity'] == 'High')
     estimated_rework_cost = invalid_claims * 75
     return {
@@ -67,14 +109,23 @@ def compute_summary(issues: list, parsed_json: dict):
         'estimated_rework_cost': estimated_rework_cost
     }
 
-def predict_denial(raw_837: str, parsed_json: dict) -> dict:
+def predict_denial(raw_837: str, parsed_json: Union[dict, str, os.PathLike], rules: Optional[list] = None) -> dict:
+    """Rule findings and summary for a parse, or for the path of a batch
+    saved with `engine.persist.save_parsed`. `rules` default to the current
+    comprehensive ruleset; `ruleset_version` names the rules applied."""
     try:
         logger.info("Starting denial prediction")
-        rules = re_engine.load_rules('dhcs_comprehensive')
-        issues = re_engine.evaluate_rules(parsed_json, rules)
+        if isinstance(parsed_json, (str, os.PathLike)):
+            parsed_json = load_parsed(parsed_json)
+        if rules is None:
+            rules = re_engine.load_rules('dhcs_comprehensive')
+        # document and per-claim findings come from one fact table
+        table = vectorized.fact_table(parsed_json)
+        issues = vectorized.evaluate_rules(parsed_json, rules, table)
+        claim_results = vectorized.evaluate_claims(parsed_json, rules, table)
         claim_type, claim_reason = detect_claim_type(parsed_json)
-        summary = compute_summary(issues, parsed_json)
-        dhcs_applied = 'CA' in str(parsed_json).upper() or 'MEDI-CAL' in str(parsed_json).upper()
+        summary = compute_summary(issues, parsed_json, claim_results)
+        dhcs_applied = dhcs_applies(parsed_json)
         
         logger.info(f"Prediction complete: {claim_type} claim with {len(issues)} issues")
         
@@ -83,7 +134,9 @@ def predict_denial(raw_837: str, parsed_json: dict) -> dict:
             'claim_type': claim_type,
             'claim_reason': claim_reason,
             'summary': summary,
-            'dhcs_applied': dhcs_applied
+            'claim_issues': claim_results['claims'],
+            'dhcs_applied': dhcs_applied,
+            'ruleset_version': claim_results['ruleset_version']
         }
     except Exception as e:
         logger.error(f"Error during prediction: {str(e)}")
@@ -92,5 +145,22 @@ def predict_denial(raw_837: str, parsed_json: dict) -> dict:
             'claim_type': 'Unknown',
             'claim_reason': 'Error occurred',
             'summary': {'total_claims': 0, 'invalid_claims': 1, 'invalid_percentage': 100, 'high_risk_issues': 1, 'estimated_rework_cost': 75},
-            'dhcs_applied': False
+            'claim_issues': [],
+            'dhcs_applied': False,
+            'ruleset_version': ''
         }
+
+
+def analyze_837(raw_837, cache: Optional[ResultCache] = None) -> Tuple[dict, Optional[dict]]:
+    """Parse `raw_837` and predict denials, reusing the result of an identical
+    earlier submission under the same ruleset. The prediction is None when
+    parsing failed."""
+    cache = RESULT_CACHE if cache is None else cache
+    # one ruleset for both the key and the prediction, even if it is reloaded meanwhile
+    rules = re_engine.load_rules('dhcs_comprehensive')
+    key = cache_key('analysis', raw_837, rules.version)
+
+    def analyze():
+        parsed = parse_837(raw_837)
+        return parsed, (None if 'error' in parsed else predict_denial(raw_837, parsed, rules))
+    return cache.get_or_compute(key, analyze)
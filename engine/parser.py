@@ -1,65 +1,435 @@
 """Simple 837 parser.
 Produces a dict with `claims`, `transaction_type`, and basic segment lists.
+
+`iter_claims` streams claims out of a file object one at a time so large
+clearinghouse batches can be processed without holding the whole file;
+`parse_837` is a thin wrapper that collects them into the dict above.
+Claims are compact `engine.claims.Claim` objects that read like dicts.
+
+Byte input (`bytes`, `mmap`, `memoryview` or a binary file object) given
+with an explicit encoding is tokenized without decoding it first: segment
+boundaries are found with byte searches and a segment is decoded, in one
+call, only when its elements are first read, see `parse_837_file`. Without one,
+`parse_837` sniffs the encoding and decodes the input chunk by chunk as it
+is tokenized, see `decode_stream`.
 """
-from typing import List, Dict
+import io
+import mmap
+from itertools import chain
+from typing import Any, Callable, Container, List, Dict, Iterator, Iterable, IO, NamedTuple, Optional, Sequence, Tuple, Union
+from .claims import Claim, Loop, Segment, Transaction, SERVICE_LINE_TAGS, DIAGNOSIS_TAGS, build_tag_index
+from .decoding import DecodingReader
+from .envelope import EnvelopeReport
 from .logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Characters read from a file object per chunk while streaming
+CHUNK_SIZE = 64 * 1024
+
+# Characters buffered before delimiter detection; comfortably holds an ISA
+DELIMITER_LOOKAHEAD = 4096
+
+# Encoding used for element values of byte input unless the caller overrides it
+DEFAULT_ENCODING = 'utf-8'
+
+# Segments that open a claim when they appear before any CLM
+CLAIM_OPENING_TAGS = SERVICE_LINE_TAGS + DIAGNOSIS_TAGS
+
+# Envelope segments whose latest occurrence is attached to each claim
+ENVELOPE_TAGS = ('ISA', 'GS', 'ST')
+
+# Interchange and functional group segments, kept out of the loop tree
+INTERCHANGE_TAGS = ('ISA', 'IEA', 'GS', 'GE')
+
+# Segments that end the open 2300 claim loop
+CLAIM_CLOSING_TAGS = ('CLM', 'HL', 'SE', 'ST') + INTERCHANGE_TAGS
+
+# Envelope headers and trailers checked by `engine.envelope.EnvelopeReport`
+CONTROL_TAGS = frozenset(ENVELOPE_TAGS + ('SE', 'GE', 'IEA'))
+
+# Segments whose elements the loop builder reads; all others stay unsplit
+SPLIT_TAGS = CONTROL_TAGS | {'HL', 'CLM'}
+
+# HL03 hierarchical level code -> loop id
+HL_LOOP_IDS = {'20': '2000A', '22': '2000B', '23': '2000C'}
+
+
+class Delimiters(NamedTuple):
+    """Separators of an interchange, as declared by its ISA header."""
+    element: str = '*'
+    component: str = ':'
+    repetition: str = '^'
+    segment: str = '~'
+
+
+DEFAULT_DELIMITERS = Delimiters()
+
 
 def split_segments(raw: str) -> List[str]:
-    if '~' in raw:
-        raw = raw.replace('\r','')
-        return [s.strip() for s in raw.split('~') if s.strip()]
-    return [s.strip() for s in raw.splitlines() if s.strip()]
+    return list(iter_segments(raw))
 
 
-def detect_transaction_type(segments: List[str]) -> str:
-    """Detect claim type based on service line segments."""
-    if any(s.startswith('SV1') for s in segments):
+def _transaction_type(tags: Container[str]) -> str:
+    """Detect claim type from the service line tags present in the document."""
+    if 'SV1' in tags:
         return 'professional'
-    if any(s.startswith('SV2') for s in segments):
+    if 'SV2' in tags:
         return 'institutional'
     return 'unknown'
 
 
-def parse_837(raw: str) -> Dict:
-    """Parse 837 EDI file into structured format."""
-    try:
-        segments = split_segments(raw)
-        logger.info(f"Parsed {len(segments)} segments from raw 837")
-        
-        parsed = {'claims': [], 'transaction_type': detect_transaction_type(segments)}
-        current_claim = None
-        
-        for seg in segments:
-            parts = seg.split('*')
-            tag = parts[0]
-            
-            if tag == 'CLM':
-                if current_claim:
-                    parsed['claims'].append(current_claim)
-                current_claim = {'CLM': parts, 'segments': []}
-                # record the CLM segment itself
-                current_claim.setdefault('segments', []).append({'tag': tag, 'parts': parts})
-            elif tag in ('SV1','SV2'):
-                if current_claim is None:
-                    current_claim = {'CLM': [], 'segments': []}
-                current_claim.setdefault('service_lines', []).append(parts)
-            elif tag == 'HI':
-                if current_claim is None:
-                    current_claim = {'CLM': [], 'segments': []}
-                current_claim.setdefault('diagnosis', []).append(parts)
-            
-            # record every segment in claim if claim exists
+def detect_transaction_type(segments: List[str]) -> str:
+    """Detect claim type based on service line segments."""
+    return _transaction_type({s.split('*', 1)[0] for s in segments})
+
+
+def _iter_chunks(source: Union[str, bytes, IO], chunk_size: int) -> Iterator[Union[str, bytes]]:
+    """Yield successive chunks of a string, a byte buffer or a file object."""
+    if isinstance(source, memoryview):
+        source = source.cast('B')
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size].tobytes()
+        return
+    if isinstance(source, (str, bytes, bytearray, mmap.mmap)):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _is_binary(source: Any) -> bool:
+    """True for byte buffers and binary file objects."""
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return True
+    if isinstance(source, (str, io.TextIOBase)):
+        return False
+    return isinstance(source, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(source, 'mode', '')
+
+
+def decode_stream(source: Union[bytes, IO], encoding: Optional[str] = None,
+                  chunk_size: int = CHUNK_SIZE) -> DecodingReader:
+    """Text stream over byte input, decoded chunk by chunk as it is read.
+
+    The encoding is sniffed from a byte order mark or the ISA header unless
+    given; the reader's `as_dict()` reports it along with any bytes that
+    could not be decoded.
+    """
+    return DecodingReader(_iter_chunks(source, chunk_size), encoding)
+
+
+def detect_delimiters(head: str) -> Delimiters:
+    """Read the separators from the ISA header at the start of `head`.
+
+    The element separator follows the `ISA` tag, ISA11 holds the repetition
+    separator and ISA16 is the component separator, immediately followed by
+    the segment terminator. Element separators are counted rather than
+    relying on the fixed-width offsets so headers with unpadded IDs still
+    parse. Without an ISA, `~` is used when present, otherwise one segment
+    per line.
+    """
+    start = len(head) - len(head.lstrip())
+    if head.startswith('ISA', start) and len(head) > start + 3:
+        element = head[start + 3]
+        seps = [start + 3]
+        while len(seps) < 16:
+            pos = head.find(element, seps[-1] + 1)
+            if pos < 0:
+                break
+            seps.append(pos)
+        if len(seps) == 16 and len(head) > seps[15] + 2:
+            isa11 = head[seps[10] + 1:seps[11]]
+            return Delimiters(
+                element=element,
+                component=head[seps[15] + 1],
+                repetition=isa11 if len(isa11) == 1 and not isa11.isalnum() else '',
+                segment=head[seps[15] + 2],
+            )
+    if '~' in head:
+        return DEFAULT_DELIMITERS
+    return DEFAULT_DELIMITERS._replace(segment='\n')
+
+
+def read_segments(source: Union[str, bytes, IO], chunk_size: int = CHUNK_SIZE) -> Tuple[Delimiters, Iterator[Union[str, bytes]]]:
+    """Detect the delimiters of `source` and return them with a segment iterator.
+
+    Only the first few KB are buffered for detection; the rest of the input
+    is tokenized chunk by chunk. Byte sources yield `bytes` segments, while
+    the returned delimiters are always `str`.
+    """
+    chunks = _iter_chunks(source, chunk_size)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= DELIMITER_LOOKAHEAD:
+            break
+    if head and not isinstance(head[0], str):
+        # latin-1 maps every byte to one character, so ISA offsets line up
+        delimiters = detect_delimiters(b''.join(head).decode('latin-1'))
+        return delimiters, _tokenize(_prepend(head, chunks), delimiters.segment.encode('latin-1'))
+    delimiters = detect_delimiters(''.join(head))
+    return delimiters, _tokenize(_prepend(head, chunks), delimiters.segment)
+
+
+def iter_segments(source: Union[str, bytes, IO], chunk_size: int = CHUNK_SIZE) -> Iterator[Union[str, bytes]]:
+    """Yield stripped segments, reading `source` in chunks."""
+    return read_segments(source, chunk_size)[1]
+
+
+def _tokenize(chunks: Iterable[Any], terminator: Any) -> Iterator[Any]:
+    """Split chunks on `terminator` in one pass.
+
+    Each chunk is split once; the unterminated remainder is carried over and
+    joined to the first piece of the next chunk, so segments straddling a
+    chunk boundary come out whole without rebuilding the buffer.
+    """
+    tail = ''
+    for chunk in chunks:
+        pieces = chunk.split(terminator)
+        if tail:
+            pieces[0] = tail + pieces[0]
+        tail = pieces.pop()
+        for piece in pieces:
+            piece = piece.strip()
+            if piece:
+                yield piece
+    tail = tail.strip()
+    if tail:
+        yield tail
+
+
+def _prepend(head: List[Any], rest: Iterator[Any]) -> Iterable[Any]:
+    yield from head
+    yield from rest
+
+
+class _TextSplitter:
+    """Splits a raw text segment into its elements, and joins them back."""
+    __slots__ = ('element',)
+
+    def __init__(self, element: str):
+        self.element = element
+
+    def __call__(self, seg: str) -> List[str]:
+        return seg.split(self.element)
+
+    def join(self, parts: Sequence[str]) -> str:
+        return self.element.join(parts)
+
+
+class _ByteSplitter:
+    """Splits a raw byte segment into its decoded elements; picklable, unlike a lambda.
+
+    The segment is decoded in one call and split on the element separator,
+    which is ASCII in every encoding the tokenizer splits bytes in. `join`
+    encodes the elements back, less any bytes that did not decode.
+    """
+    __slots__ = ('element', 'encoding')
+
+    def __init__(self, element: str, encoding: str):
+        self.element = element
+        self.encoding = encoding
+
+    def __call__(self, seg: bytes) -> List[str]:
+        return seg.decode(self.encoding, errors='ignore').split(self.element)
+
+    def join(self, parts: Sequence[str]) -> bytes:
+        return self.element.join(parts).encode(self.encoding)
+
+
+def _segment_splitter(delimiters: Delimiters, binary: bool, encoding: str) -> Callable[[Any], List[str]]:
+    """Return the function turning one raw segment into its `parts`."""
+    if not binary:
+        return _TextSplitter(delimiters.element)
+    return _ByteSplitter(delimiters.element, encoding)
+
+
+def iter_split_segments(source: Union[str, bytes, IO], chunk_size: int = CHUNK_SIZE,
+                        encoding: str = DEFAULT_ENCODING) -> Iterator[Tuple[str, List[str], str]]:
+    """Yield `(tag, parts, text)` for every segment of any supported input.
+
+    The eager counterpart of `iter_claims`, for callers that want plain
+    lists of element strings: byte segments are decoded one at a time as
+    they are tokenized, so no decoded copy of the whole input is made.
+    """
+    delimiters, segments = read_segments(source, chunk_size)
+    element = delimiters.element
+    for seg in segments:
+        if not isinstance(seg, str):
+            seg = seg.decode(encoding, errors='ignore')
+        parts = seg.split(element)
+        yield parts[0], parts, seg
+
+
+def iter_claims(source: Union[str, bytes, IO], chunk_size: int = CHUNK_SIZE,
+                encoding: str = DEFAULT_ENCODING,
+                envelope_report: Optional[EnvelopeReport] = None) -> Iterator[Tuple[Dict, Claim]]:
+    """Stream `(envelope, claim)` pairs out of an 837 file object.
+
+    `envelope` maps ISA/GS/ST to the parts of the latest such segment seen
+    before the claim's CLM, plus the interchange `delimiters`; a new dict is
+    created whenever the envelope changes, so it is safe to keep alongside
+    the claim. Claims are compact `Claim` objects that read like the old
+    claim dicts. For byte input a segment keeps its raw bytes until its
+    parts are read, then decodes them with `encoding`.
+
+    The loop tree is built in the same pass: `HL` segments open 2000A/B/C
+    loops under the loop named by their parent ID, `CLM` opens a 2300 claim
+    under the current HL loop, and `HL`, `SE` and envelope segments close
+    it. Provider and subscriber segments ahead of a CLM therefore land in
+    the claim's ancestor loops rather than on the previous claim. A claim is
+    yielded as soon as it is closed; only it and its ancestors are held.
+
+    With `envelope_report`, the envelope headers and trailers are checked in
+    the same pass (see `engine.envelope`); the report is complete once the
+    iterator is exhausted.
+    """
+    delimiters, segments = read_segments(source, chunk_size)
+    first = next(segments, None)
+    if first is None:
+        return
+    binary = not isinstance(first, str)
+    split = _segment_splitter(delimiters, binary, encoding)
+    separator = delimiters.element
+    element = separator.encode('latin-1') if binary else separator
+    # raw tag -> tag string: byte tags are decoded once, and every segment
+    # with a tag shares one string
+    tags = {}
+    envelope = dict.fromkeys(ENVELOPE_TAGS)
+    envelope['delimiters'] = delimiters
+    claim_envelope = envelope
+    transaction = context = Transaction()
+    st_position = 0
+    hl_loops = {}
+    current_claim = None
+
+    for position, seg in enumerate(chain((first,), segments)):
+        # read the tag with one search; only the segments used below are
+        # split here, the rest only when (and if) a caller reads `parts`
+        end = seg.find(element)
+        raw_tag = seg if end < 0 else seg[:end]
+        tag = tags.get(raw_tag)
+        if tag is None:
+            tag = tags[raw_tag] = raw_tag.decode('latin-1') if binary else raw_tag
+        if tag not in SPLIT_TAGS:
+            # the bulk of the segments open or close nothing: record them
+            # unsplit in the open loop
             if current_claim is not None:
-                current_claim.setdefault('segments', []).append({'tag': tag, 'parts': parts})
-        
-        if current_claim:
-            parsed['claims'].append(current_claim)
-        
+                current_claim.append(Segment(tag, seg, split))
+                continue
+            if tag not in CLAIM_OPENING_TAGS:
+                context.append(Segment(tag, seg, split))
+                continue
+            parts = None
+        else:
+            parts = seg.decode(encoding, errors='ignore').split(separator) if binary else seg.split(element)
+
+        if tag in ENVELOPE_TAGS:
+            envelope = dict(envelope, **{tag: parts})
+
+        if current_claim is not None and tag in CLAIM_CLOSING_TAGS:
+            yield claim_envelope, current_claim
+            current_claim = None
+
+        if tag == 'ST':
+            transaction = context = Transaction(transaction.number + 1)
+            st_position = position
+            hl_loops = {}
+        elif tag == 'HL':
+            # HL*id*parent id*level code*child code
+            parent = hl_loops.get(parts[2]) if len(parts) > 2 and parts[2] else None
+            level = parts[3] if len(parts) > 3 else ''
+            context = Loop(HL_LOOP_IDS.get(level, '2000'), parent or transaction)
+            if len(parts) > 1:
+                hl_loops[parts[1]] = context
+        elif tag == 'CLM':
+            current_claim = Claim(parts, context)
+            claim_envelope = envelope
+            if transaction.segment_count is not None:
+                transaction.claims_after_se = True
+        elif current_claim is None and tag in CLAIM_OPENING_TAGS:
+            # service lines or diagnoses before any CLM still form a claim
+            current_claim = Claim(parent=context)
+            claim_envelope = envelope
+            if transaction.segment_count is not None:
+                transaction.claims_after_se = True
+
+        # record every segment (the CLM included, once) in its loop; the CLM
+        # keeps the parts its claim holds anyway, the other split segments
+        # only their raw text, so no segment keeps both
+        if current_claim is not None:
+            current_claim.append(Segment(tag, seg, split, parts))
+        elif tag == 'SE':
+            transaction.append(Segment(tag, seg, split))
+            context = transaction
+        elif tag not in INTERCHANGE_TAGS:
+            context.append(Segment(tag, seg, split))
+
+        if tag in CONTROL_TAGS:
+            if tag == 'SE' and transaction.number and transaction.segment_count is None:
+                transaction.segment_count = position - st_position + 1
+            if envelope_report is not None:
+                envelope_report.control(tag, parts, transaction)
+
+    if current_claim is not None:
+        yield claim_envelope, current_claim
+    if envelope_report is not None:
+        envelope_report.finish()
+
+
+def parse_837(raw: Union[str, bytes, IO], encoding: Optional[str] = None) -> Dict:
+    """Parse 837 EDI file into structured format.
+
+    `raw` may be text, a text file object or byte input. Byte input is
+    decoded as it streams through the tokenizer, in the encoding sniffed by
+    `decode_stream`, and `decoding` reports that encoding and any replaced
+    bytes; with an explicit `encoding` it is not decoded up front at all,
+    only the segments whose parts are read. `tag_index` maps each segment tag to the
+    positions of the claims holding it, built from the per-claim indexes
+    (`engine.segment_index` extends it to qualifier keys as claim bitsets),
+    `envelope` holds the envelope counters and integrity errors, and
+    `delimiters` the separators the claims were split with.
+    """
+    try:
+        decoder = None
+        if encoding is None and _is_binary(raw):
+            raw = decoder = decode_stream(raw)
+        report = EnvelopeReport()
+        claims = []
+        envelope = {'delimiters': DEFAULT_DELIMITERS}
+        for envelope, claim in iter_claims(raw, encoding=encoding or DEFAULT_ENCODING, envelope_report=report):
+            claims.append(claim)
+        tag_index = build_tag_index(claims)
+        parsed = {'claims': claims, 'transaction_type': _transaction_type(tag_index), 'tag_index': tag_index,
+                  'envelope': report.as_dict(), 'delimiters': envelope['delimiters']}
+        if decoder is not None:
+            parsed['decoding'] = decoder.as_dict()
+            if decoder.replaced:
+                logger.warning(f"Replaced {decoder.replaced} undecodable byte(s) reading {decoder.encoding} input")
         logger.info(f"Successfully parsed {len(parsed['claims'])} claims, type: {parsed['transaction_type']}")
         return parsed
     except Exception as e:
         logger.error(f"Parsing failed: {str(e)}")
-        return {'claims': [], 'transaction_type': 'unknown', 'error': str(e)}
+        return {'claims': [], 'transaction_type': 'unknown', 'tag_index': {}, 'error': str(e)}
+
+
+def parse_837_file(path: str, encoding: str = DEFAULT_ENCODING) -> Dict:
+    """Parse an 837 file on disk through a read-only memory map.
+
+    The file is never read into a single buffer; pages are faulted in as the
+    tokenizer walks them.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return parse_837(b'', encoding=encoding)
+        with mapped:
+            return parse_837(mapped, encoding=encoding)
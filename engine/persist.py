@@ -0,0 +1,317 @@
+"""Compact binary format for parsed 837 batches.
+
+`save_parsed` writes the result of `engine.parser.parse_837` as a versioned
+header followed by length-prefixed columns: the raw segment bytes laid end
+to end, their offsets and tag ids, and a table of the loop tree (kind,
+parent and segment range of every transaction, HL and claim loop). The
+document `tag_index`, `envelope`, `delimiters` and `decoding` are stored alongside, so re-running a
+ruleset over an old batch does not need its 837 text again, and so are the
+counts of claims passing each `rules_engine.CLAIM_FACTS` test, which let
+`evaluate_rules` answer claim-scanning conditions without rebuilding claims.
+
+`load_parsed` memory-maps such a file and returns a parse whose `claims`
+is a `PersistedClaims` sequence: claims are rebuilt from the mapped columns
+only when they are read, and their elements are split and decoded lazily
+as with `engine.parser.parse_837_file`. Loading is therefore independent of
+the batch size apart from the tag index.
+
+File layout (all integers little-endian unless the header says otherwise):
+
+  MAGIC, uint32 format version, uint64 header length, JSON header,
+  zero padding to 8 bytes, then each column at the offset the header gives.
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import rules_engine
+from .claims import Claim, Loop, Segment, Transaction
+from .logger import setup_logger
+from .parser import DEFAULT_ENCODING, Delimiters, _ByteSplitter
+
+logger = setup_logger(__name__)
+
+MAGIC = b'E837PRS\x00'
+
+# File name suffix used by `engine/tools/persist_batch.py`
+SUFFIX = '.e837'
+
+# Bump whenever the header or the columns change meaning
+FORMAT_VERSION = 1
+
+_PREFIX = struct.Struct('<IQ')
+
+# Node `kind` ids are positions in this list; unknown loop ids are appended
+_LOOP_IDS = ['ST', '2000A', '2000B', '2000C', '2000', '2300']
+
+PathLike = Union[str, 'os.PathLike[str]']
+
+
+class PersistedFormatError(ValueError):
+    """The file is not a parsed batch, or was written by another format version."""
+
+
+def _node_of(loop: Loop, nodes: Dict[int, int], order: List[Loop]) -> int:
+    """Index of `loop` in the node table, adding it and its ancestors first."""
+    index = nodes.get(id(loop))
+    if index is None:
+        if loop.parent is not None:
+            _node_of(loop.parent, nodes, order)
+        index = nodes[id(loop)] = len(order)
+        order.append(loop)
+    return index
+
+
+def _columns(parsed: Dict, encoding: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    claims = parsed.get('claims', [])
+    nodes: Dict[int, int] = {}
+    order: List[Loop] = []
+    claim_nodes = array.array('Q', (_node_of(c, nodes, order) for c in claims))
+
+    loop_ids = list(_LOOP_IDS)
+    tags: Dict[str, int] = {}
+    blob = bytearray()
+    seg_offsets = array.array('Q', [0])
+    seg_tags = array.array('H')
+    node_kind = array.array('B')
+    node_parent = array.array('q')
+    node_segments = array.array('Q', [0])
+    node_number = array.array('q')
+    node_segment_count = array.array('q')
+    node_flags = array.array('B')
+    element = None
+    for loop in order:
+        if loop.loop_id not in loop_ids:
+            loop_ids.append(loop.loop_id)
+        node_kind.append(loop_ids.index(loop.loop_id))
+        node_parent.append(nodes[id(loop.parent)] if loop.parent is not None else -1)
+        node_number.append(getattr(loop, 'number', 0))
+        count = getattr(loop, 'segment_count', None)
+        node_segment_count.append(-1 if count is None else count)
+        node_flags.append(1 if getattr(loop, 'claims_after_se', False) else 0)
+        for segment in loop.segments:
+            raw = segment.raw
+            if isinstance(raw, str):
+                raw = raw.encode(encoding)
+            if element is None and len(raw) > len(segment.tag):
+                # the byte right after the tag is the element separator
+                element = raw[len(segment.tag):len(segment.tag) + 1]
+            blob += raw
+            seg_offsets.append(len(blob))
+            seg_tags.append(tags.setdefault(segment.tag, len(tags)))
+        node_segments.append(len(seg_tags))
+
+    tag_index = parsed.get('tag_index', {})
+    index_offsets = array.array('Q', [0])
+    index_positions = array.array('Q')
+    for positions in tag_index.values():
+        index_positions.extend(positions)
+        index_offsets.append(len(index_positions))
+
+    header = {
+        'encoding': encoding,
+        'element': (element or b'*').decode('latin-1'),
+        'byteorder': sys.byteorder,
+        'transaction_type': parsed.get('transaction_type', 'unknown'),
+        'envelope': parsed.get('envelope'),
+        'delimiters': parsed.get('delimiters'),
+        'decoding': parsed.get('decoding'),
+        'tags': list(tags),
+        'loop_ids': loop_ids,
+        'tag_index_tags': list(tag_index),
+        'fact_counts': rules_engine.count_facts([rules_engine.claim_facts(c) for c in claims]),
+    }
+    columns = {
+        'blob': bytes(blob),
+        'seg_offsets': seg_offsets,
+        'seg_tags': seg_tags,
+        'node_kind': node_kind,
+        'node_parent': node_parent,
+        'node_segments': node_segments,
+        'node_number': node_number,
+        'node_segment_count': node_segment_count,
+        'node_flags': node_flags,
+        'claim_nodes': claim_nodes,
+        'tag_index_offsets': index_offsets,
+        'tag_index_positions': index_positions,
+    }
+    return header, columns
+
+
+def save_parsed(parsed: Dict, path: PathLike, encoding: str = DEFAULT_ENCODING) -> None:
+    """Write a `parse_837` result to `path` in the persisted format.
+
+    Text segments are stored encoded with `encoding`; byte segments are
+    stored as they are and must already be in `encoding`.
+    """
+    header, columns = _columns(parsed, encoding)
+    layout = {}
+    offset = 0
+    for name, column in columns.items():
+        size = len(column) * column.itemsize if isinstance(column, array.array) else len(column)
+        typecode = column.typecode if isinstance(column, array.array) else 'B'
+        layout[name] = [offset, typecode, size]
+        offset += -(-size // 8) * 8
+    header['columns'] = layout
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    start = len(MAGIC) + _PREFIX.size + len(header_bytes)
+    start += -start % 8
+
+    tmp = f'{os.fspath(path)}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_PREFIX.pack(FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (start - f.tell()))
+        for name, column in columns.items():
+            f.write(column)
+            f.write(b'\0' * (-f.tell() % 8))
+    os.replace(tmp, path)
+    logger.info(f"Saved {len(parsed.get('claims', []))} claims to {path}")
+
+
+def is_persisted(path: PathLike) -> bool:
+    """True when `path` starts with the persisted-batch magic bytes."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _column(buf: memoryview, header: Dict, name: str):
+    offset, typecode, size = header['columns'][name]
+    view = buf[header['data_start'] + offset:header['data_start'] + offset + size]
+    if header['byteorder'] != sys.byteorder:
+        swapped = array.array(typecode, view.tobytes())
+        swapped.byteswap()
+        return swapped
+    return view.cast(typecode)
+
+
+class PersistedClaims(Sequence):
+    """Claims of a persisted batch, rebuilt from the mapped columns on access.
+
+    Each claim is built once and kept, with its loop ancestors shared
+    between claims as in a fresh parse. Indexing, slicing, iteration and
+    comparison with lists behave like the `claims` list of `parse_837`.
+    `fact_counts` holds the saved `CLAIM_FACTS` counts, or None when they
+    were saved for a different set of facts.
+    """
+
+    def __init__(self, mapped: mmap.mmap, header: Dict):
+        buf = memoryview(mapped)
+        self._mapped = mapped
+        self._blob_start = header['data_start'] + header['columns']['blob'][0]
+        self._seg_offsets = _column(buf, header, 'seg_offsets')
+        self._seg_tags = _column(buf, header, 'seg_tags')
+        self._node_kind = _column(buf, header, 'node_kind')
+        self._node_parent = _column(buf, header, 'node_parent')
+        self._node_segments = _column(buf, header, 'node_segments')
+        self._node_number = _column(buf, header, 'node_number')
+        self._node_segment_count = _column(buf, header, 'node_segment_count')
+        self._node_flags = _column(buf, header, 'node_flags')
+        self._claim_nodes = _column(buf, header, 'claim_nodes')
+        self._tags = header['tags']
+        self._loop_ids = header['loop_ids']
+        self._split = _ByteSplitter(header['element'], header['encoding'])
+        self._loops: Dict[int, Loop] = {}
+        self._claims: List[Optional[Claim]] = [None] * len(self._claim_nodes)
+        counts = header.get('fact_counts')
+        self.fact_counts = counts if counts is not None and list(counts) == list(rules_engine.CLAIM_FACTS) else None
+
+    def __len__(self) -> int:
+        return len(self._claims)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._claims)))]
+        claim = self._claims[index]
+        if claim is None:
+            node = self._claim_nodes[index]
+            claim = self._claims[index] = Claim(parent=self._loop(self._node_parent[node]))
+            self._fill(claim, node)
+            if claim.segments and claim.segments[0].tag == 'CLM':
+                claim.clm = claim.segments[0].parts
+        return claim
+
+    def __iter__(self):
+        for i in range(len(self._claims)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PersistedClaims, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def _loop(self, node: int) -> Optional[Loop]:
+        if node < 0:
+            return None
+        loop = self._loops.get(node)
+        if loop is None:
+            loop_id = self._loop_ids[self._node_kind[node]]
+            if loop_id == 'ST':
+                loop = Transaction(self._node_number[node])
+                count = self._node_segment_count[node]
+                loop.segment_count = None if count < 0 else count
+                loop.claims_after_se = bool(self._node_flags[node])
+                loop.parent = self._loop(self._node_parent[node])
+            else:
+                loop = Loop(loop_id, self._loop(self._node_parent[node]))
+            self._fill(loop, node)
+            self._loops[node] = loop
+        return loop
+
+    def _fill(self, loop: Loop, node: int) -> None:
+        # builds `segments` directly; the loop's tag index is built on first use
+        start, stop = self._node_segments[node], self._node_segments[node + 1]
+        offsets = self._seg_offsets[start:stop + 1].tolist()
+        tags = self._seg_tags[start:stop].tolist()
+        names, mapped, base, split = self._tags, self._mapped, self._blob_start, self._split
+        loop.segments.extend(Segment(names[tag], mapped[base + begin:base + end], split)
+                             for tag, begin, end in zip(tags, offsets, offsets[1:]))
+
+
+def load_parsed(path: PathLike) -> Dict:
+    """Memory-map a file written by `save_parsed` and return its parse.
+
+    Raises `PersistedFormatError` for files in another format or version.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise PersistedFormatError(f'{path} is empty')
+    buf = memoryview(mapped)
+    if buf[:len(MAGIC)] != MAGIC:
+        raise PersistedFormatError(f'{path} is not a persisted 837 batch')
+    version, header_length = _PREFIX.unpack_from(buf, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise PersistedFormatError(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+    start = len(MAGIC) + _PREFIX.size
+    header = json.loads(bytes(buf[start:start + header_length]))
+    start += header_length
+    header['data_start'] = start + -start % 8
+
+    offsets = _column(buf, header, 'tag_index_offsets')
+    positions = _column(buf, header, 'tag_index_positions')
+    tag_index = {tag: positions[offsets[n]:offsets[n + 1]].tolist()
+                 for n, tag in enumerate(header['tag_index_tags'])}
+    claims = PersistedClaims(mapped, header)
+    parsed = {'claims': claims, 'transaction_type': header['transaction_type'], 'tag_index': tag_index}
+    if header['envelope'] is not None:
+        parsed['envelope'] = header['envelope']
+    if header.get('delimiters') is not None:
+        parsed['delimiters'] = Delimiters(*header['delimiters'])
+    if header.get('decoding') is not None:
+        parsed['decoding'] = header['decoding']
+    logger.info(f"Loaded {len(claims)} claims from {path}")
+    return parsed
@@ -1,164 +1,823 @@
 # engine/rules_engine.py
-import json, os
-from typing import Dict, Any, List
+import hashlib, json, logging, os, threading, time
+from typing import Callable, Dict, Any, List, Mapping, NamedTuple, Optional, Tuple, Union
+from .claims import build_tag_index, claim_tags, context_has, tagged_segments
+from .expressions import expression_test
+from .segment_index import ClaimSegments, SegmentIndex, segment_index
 from .logger import setup_logger
 
 logger = setup_logger(__name__)
 
 RULES_DIR = os.path.join(os.path.dirname(__file__), 'rules')
 
-_rules_cache = {}
+# Rules file of a scope, where it is not `<scope>_rules.json`
+RULESET_FILES = {'dhcs_comprehensive': 'dhcs_rules_comprehensive.json'}
+
+# Saved `ConditionStats` of a scope: `<scope>_stats.json` in RULES_DIR
+STATS_SUFFIX = '_stats.json'
+
+# Seconds between checks of a loaded ruleset's files for changes
+RELOAD_INTERVAL = 2.0
 
-def load_rules(scope='dhcs_comprehensive') -> List[Dict[str, Any]]:
-    """Load rules from comprehensive ruleset. Falls back to dhcs_rules if comprehensive not found."""
-    if scope in _rules_cache:
-        return _rules_cache[scope]
 
-    # Try comprehensive first, fallback to dhcs
-    path = os.path.join(RULES_DIR, f'{scope}_rules.json')
+def _ruleset_paths(scope: str, rules_dir: str = RULES_DIR) -> Tuple[str, str]:
+    """`(rules, stats)` file paths of `scope`; the rules fall back to dhcs_rules.json."""
+    # Try the scope's own file first, fallback to dhcs
+    path = os.path.join(rules_dir, RULESET_FILES.get(scope, f'{scope}_rules.json'))
     if not os.path.exists(path):
-        path = os.path.join(RULES_DIR, 'dhcs_rules.json')
-    
+        path = os.path.join(rules_dir, 'dhcs_rules.json')
+    return path, os.path.join(rules_dir, f'{scope}{STATS_SUFFIX}')
+
+
+def read_ruleset(scope: str, rules_dir: str = RULES_DIR, missing_ok: bool = True) -> 'RuleSet':
+    """Read and compile the rules of `scope`, ordered by its saved stats if any.
+
+    A missing rules file gives an empty `RuleSet`, or raises
+    `FileNotFoundError` when `missing_ok` is False.
+    """
+    path, stats_path = _ruleset_paths(scope, rules_dir)
     if not os.path.exists(path):
+        if not missing_ok:
+            raise FileNotFoundError(f"No rules file found at {path}")
         logger.warning(f"No rules file found at {path}")
-        _rules_cache[scope] = []
-        return []
+        return RuleSet()
 
     with open(path, 'r', encoding='utf-8') as f:
         rules = json.load(f)
 
-    logger.info(f"Loaded {len(rules)} rules from {os.path.basename(path)}")
-    _rules_cache[scope] = rules
+    rules = RuleSet(rules)
+    logger.info(f"Loaded {len(rules)} rules from {os.path.basename(path)}, version {rules.version}")
+    if os.path.exists(stats_path):
+        rules.reorder(ConditionStats.load(stats_path))
     return rules
 
 
-def evaluate_rules(parsed_json: Dict[str, Any], rules: List[Dict[str, Any]]):
+def load_rules(scope='dhcs_comprehensive') -> List[Dict[str, Any]]:
+    """Load rules from comprehensive ruleset. Falls back to dhcs_rules if comprehensive not found.
+
+    The rules come back as a `RuleSet` from `RULESETS`, compiled once per
+    version of the files and replaced in the background when they change.
+    When `<scope>_stats.json` (saved `ConditionStats`) sits next to the
+    rules, each rule's conditions are ordered by it.
+    """
+    return RULESETS.get(scope)
+
+
+def ruleset_version(scope='dhcs_comprehensive') -> str:
+    """Short content hash of the rules loaded for `scope`, for cache keys."""
+    return load_rules(scope).version
+
+
+def rules_version(rules: List[Dict[str, Any]]) -> str:
+    """Short content hash of a list of rule dicts."""
+    version = getattr(rules, 'version', None)
+    if version is None:
+        encoded = json.dumps(list(rules), sort_keys=True).encode('utf-8')
+        version = hashlib.sha256(encoded).hexdigest()[:16]
+    return version
+
+
+def _document_tag_index(parsed_json: Dict[str, Any]) -> Dict[str, List[int]]:
+    """Segment tag -> claim positions, as recorded by `engine.parser`.
+
+    Parses from other shapes carry no index; it is built once here so the
+    segment conditions below stay presence checks instead of rescanning
+    every claim for every rule.
+    """
+    index = parsed_json.get('tag_index')
+    if index is None:
+        index = build_tag_index(parsed_json.get('claims', []))
+    return index
+
+
+def _transaction_headers(parsed_json: Dict[str, Any], tag_index: Dict[str, List[int]]):
+    """ST segments of the document's claims.
+
+    Read from each claim's transaction loop; parses without a loop tree keep
+    trailing ST segments among the claim segments, so those are checked too.
+    """
+    claims = parsed_json.get('claims', [])
+    for i in tag_index.get('ST', ()):
+        yield from tagged_segments(claims[i], 'ST')
+    seen = None
+    for c in claims:
+        transaction = getattr(c, 'transaction', None)
+        if transaction is not None and transaction is not seen:
+            seen = transaction
+            st = transaction.find('ST')
+            if st is not None:
+                yield st
+
+
+def _st_is_837(segment: Mapping) -> bool:
+    parts = segment.get('parts') or ()
+    return len(parts) > 1 and parts[1] == '837'
+
+
+def _has_837_header(c: Mapping) -> bool:
+    if any(_st_is_837(s) for s in tagged_segments(c, 'ST')):
+        return True
+    transaction = getattr(c, 'transaction', None)
+    st = transaction.find('ST') if transaction is not None else None
+    return st is not None and _st_is_837(st)
+
+
+def _npi_valid(c: Mapping) -> bool:
+    """Every NPI the claim names is ten digits: its `provider_npi`, and the
+    NM109 of `XX`-qualified NM1 segments in the claim or its 2000A loop.
+    A claim naming no NPI passes; `provider_identified` covers that."""
+    npis = [str(c['provider_npi'])] if c.get('provider_npi') is not None else []
+    segments = list(tagged_segments(c, 'NM1'))
+    ancestor = getattr(c, 'ancestor', None)
+    provider = ancestor('2000A') if ancestor is not None else None
+    if provider is not None:
+        segments.extend(provider.segments[i] for i in provider.positions('NM1'))
+    for segment in segments:
+        parts = segment.get('parts') or ()
+        if len(parts) > 9 and parts[8] == 'XX':
+            npis.append(parts[9])
+    return all(len(npi) == 10 and npi.isdigit() for npi in npis)
+
+
+def _has_bill_type(c: Mapping) -> bool:
+    """The claim carries a bill type: a UB segment, or a CLM05 facility code."""
+    clm = c.get('CLM') or ()
+    return (len(clm) > 5 and bool(clm[5])) or any(True for _ in tagged_segments(c, 'UB'))
+
+
+def _amount_nonzero(c: Mapping) -> bool:
+    clm = c.get('CLM', [None, None, '0'])
+    return len(clm) > 2 and clm[2] not in ('0', None)
+
+
+# Per-claim tests behind the conditions that scan every claim; a document
+# satisfies such a condition when any one of its claims passes the test.
+CLAIM_FACTS: Dict[str, Callable[[Mapping], Any]] = {
+    'service_line_exists': lambda c: c.get('service_lines'),
+    'amount_nonzero': _amount_nonzero,
+    'diagnosis_present': lambda c: c.get('diagnosis'),
+    'transaction_header_valid': _has_837_header,
+    'npi_valid': _npi_valid,
+    'diagnosis_to_procedure_valid': lambda c: c.get('diagnosis') and c.get('service_lines'),
+    'provider_identified': lambda c: c.get('provider_npi') or context_has(c, '2000A', 'NM1'),
+    'subscriber_identified': lambda c: (
+        c.get('subscriber_id')
+        or context_has(c, '2000B', 'NM1', 'DMG') or context_has(c, '2000C', 'NM1', 'DMG')
+    ),
+}
+
+
+def claim_facts(claim: Mapping) -> Tuple[bool, ...]:
+    """The claim's result for every test in `CLAIM_FACTS`, in that order."""
+    return tuple(bool(test(claim)) for test in CLAIM_FACTS.values())
+
+
+def count_facts(facts: List[Tuple[bool, ...]]) -> Dict[str, int]:
+    """Number of claims passing each `CLAIM_FACTS` test, from `claim_facts` tuples."""
+    return dict(zip(CLAIM_FACTS, map(sum, zip(*facts)))) if facts else dict.fromkeys(CLAIM_FACTS, 0)
+
+
+def _any_claim(parsed_json: Dict[str, Any], fact_counts: Optional[Dict[str, int]], fact: str) -> bool:
+    if fact_counts is not None:
+        return fact_counts[fact] > 0
+    test = CLAIM_FACTS[fact]
+    return any(test(c) for c in parsed_json.get('claims', []))
+
+
+def _envelope_errors(envelope: Dict[str, Any], checks) -> List[Dict[str, Any]]:
+    """Envelope errors whose `check` is one of `checks` (a code or a list; all when None)."""
+    if checks is None:
+        return envelope['errors']
+    if isinstance(checks, str):
+        checks = (checks,)
+    return [e for e in envelope['errors'] if e['check'] in checks]
+
+
+class _Document:
+    """What compiled conditions read from one document, resolved once per evaluation.
+
+    `memo` holds the result of every condition test run so far, by
+    condition key (see `condition_key`), so rules sharing a condition share
+    its one evaluation. `segments` answers segment key lookups (see
+    `engine.segment_index`).
+    """
+    __slots__ = ('parsed', 'tag_index', 'segments', 'fact_counts', 'envelope', 'memo')
+
+    def __init__(self, parsed_json: Dict[str, Any], fact_counts: Optional[Dict[str, int]],
+                 segments: Union[SegmentIndex, ClaimSegments, None] = None):
+        self.parsed = parsed_json
+        self.tag_index = _document_tag_index(parsed_json)
+        self.segments = segments if segments is not None else segment_index(parsed_json, self.tag_index)
+        self.fact_counts = fact_counts
+        self.envelope = parsed_json.get('envelope')
+        self.memo: Dict[Tuple, bool] = {}
+
+
+Test = Callable[[_Document], bool]
+
+
+def _claim_fact(fact: str) -> Callable[[Dict], Test]:
+    """Compiler of a condition that holds when any claim passes `CLAIM_FACTS[fact]`."""
+    return lambda cond: lambda doc: _any_claim(doc.parsed, doc.fact_counts, fact)
+
+
+def _compile_txn_is(cond: Dict) -> Test:
+    value = cond.get('value')
+    return lambda doc: doc.parsed.get('transaction_type') == value
+
+
+def _compile_claim_has_segment(cond: Dict) -> Test:
+    # `segment` is a tag or a `TAG*QUALIFIER` key such as `REF*G1`
+    seg = cond.get('segment')
+    return lambda doc: doc.segments.has(seg)
+
+
+def _compile_transaction_header_valid(cond: Dict) -> Test:
+    # Check if ST segment exists and has '837' as first element
+    def test(doc: _Document) -> bool:
+        if doc.envelope is not None:
+            return doc.envelope['valid_headers'] > 0
+        if doc.fact_counts is not None:
+            return doc.fact_counts['transaction_header_valid'] > 0
+        return any(_st_is_837(s) for s in _transaction_headers(doc.parsed, doc.tag_index))
+    return test
+
+
+def _compile_envelope_valid(cond: Dict) -> Test:
+    # No envelope integrity errors (of the given `check` codes, if any)
+    checks = cond.get('check')
+    return lambda doc: doc.envelope is None or not _envelope_errors(doc.envelope, checks)
+
+
+def _compile_decoding_clean(cond: Dict) -> Test:
+    # No bytes of the input had to be replaced while decoding it
+    def test(doc: _Document) -> bool:
+        decoding = doc.parsed.get('decoding')
+        return decoding is None or not decoding['replaced']
+    return test
+
+
+def _compile_bill_type_present(cond: Dict) -> Test:
+    # Check for a bill type (UB-04 segment or CLM05 facility code) in institutional claims
+    return lambda doc: (doc.parsed.get('transaction_type') != 'institutional' or 'UB' in doc.tag_index
+                        or any(_has_bill_type(c) for c in doc.parsed.get('claims', [])))
+
+
+def _compile_provider_identified(cond: Dict) -> Test:
+    # Check for provider loop existence (in the claim or its 2000A loop)
+    return lambda doc: 'NM1' in doc.tag_index or _any_claim(doc.parsed, doc.fact_counts, 'provider_identified')
+
+
+def _compile_subscriber_identified(cond: Dict) -> Test:
+    # Check for subscriber information (in the claim or its 2000B/2000C loops)
+    return lambda doc: ('NM1' in doc.tag_index or 'DMG' in doc.tag_index
+                        or _any_claim(doc.parsed, doc.fact_counts, 'subscriber_identified'))
+
+
+def _compile_expression(cond: Dict) -> Test:
+    # A ruleset.json condition (see `engine.expressions`): holds when it is
+    # true for any claim
+    test = expression_test(cond.get('expr', ''), cond.get('variables'))
+
+    def holds(doc: _Document) -> bool:
+        delimiters = doc.parsed.get('delimiters')
+        component = delimiters.component if delimiters is not None else ':'
+        return any(test(c, component) for c in doc.parsed.get('claims', []))
+    return holds
+
+
+def _always(cond: Dict) -> Test:
+    # Placeholder for checks whose reference data is not wired in yet
+    # (age validation, place of service codes): they pass
+    return lambda doc: True
+
+
+# Condition type -> function binding a condition's constants into its test
+CONDITION_COMPILERS: Dict[str, Callable[[Dict], Test]] = {
+    'txn_is': _compile_txn_is,
+    'claim_has_segment': _compile_claim_has_segment,
+    'service_line_exists': _claim_fact('service_line_exists'),
+    'amount_nonzero': _claim_fact('amount_nonzero'),
+    'diagnosis_present': _claim_fact('diagnosis_present'),
+    'transaction_header_valid': _compile_transaction_header_valid,
+    'envelope_valid': _compile_envelope_valid,
+    'decoding_clean': _compile_decoding_clean,
+    'npi_valid': _claim_fact('npi_valid'),
+    'diagnosis_to_procedure_valid': _claim_fact('diagnosis_to_procedure_valid'),
+    'age_appropriate_procedure': _always,
+    'bill_type_present': _compile_bill_type_present,
+    'provider_identified': _compile_provider_identified,
+    'subscriber_identified': _compile_subscriber_identified,
+    'place_of_service_valid': _always,
+    'expression': _compile_expression,
+}
+
+# Conditions inverted by `"value": false`; the others ignore `value`
+# (`txn_is` compares against it). A rule reporting a failed check negates
+# it: `{"type": "provider_identified", "value": false}`.
+NEGATABLE_CONDITIONS = frozenset({
+    'claim_has_segment', 'amount_nonzero', 'diagnosis_present', 'envelope_valid', 'decoding_clean',
+    'service_line_exists', 'transaction_header_valid', 'npi_valid', 'diagnosis_to_procedure_valid',
+    'age_appropriate_procedure', 'bill_type_present', 'provider_identified', 'subscriber_identified',
+    'place_of_service_valid',
+})
+
+# Condition fields each test depends on; other fields do not change its result
+CONDITION_PARAMS: Dict[str, Tuple[str, ...]] = {
+    'txn_is': ('value',),
+    'claim_has_segment': ('segment',),
+    'envelope_valid': ('check',),
+    'expression': ('expr', 'variables'),
+}
+
+# Conditions whose result depends on the document only, never on which
+# claim is being looked at; `evaluate_claims` tests them once for all claims
+DOCUMENT_CONDITIONS = frozenset({
+    'txn_is', 'envelope_valid', 'decoding_clean', 'age_appropriate_procedure', 'place_of_service_valid',
+})
+
+# Condition types that are the negation of another type's test
+NEGATED_ALIASES = {'claim_missing_segment': 'claim_has_segment'}
+
+
+def _frozen(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(map(_frozen, value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _frozen(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(map(_frozen, value))
+    return value
+
+
+def condition_key(cond: Dict[str, Any]) -> Tuple[Tuple, bool]:
+    """`(key, negated)` of a condition, normalized so equivalent conditions share a key.
+
+    The key names the underlying test: its type and the fields it reads.
+    `negated` is set for `"value": false` on a negatable type and for
+    aliases such as `claim_missing_segment`, which is `claim_has_segment`
+    negated.
+    """
+    typ = cond.get('type')
+    negated = typ in NEGATABLE_CONDITIONS and cond.get('value', True) is False
+    if typ in NEGATED_ALIASES:
+        typ, negated = NEGATED_ALIASES[typ], not negated
+    return (typ,) + tuple(_frozen(cond.get(p)) for p in CONDITION_PARAMS.get(typ, ())), negated
+
+
+# One condition of a compiled rule: its key, its test and whether the
+# test's result is negated
+Step = Tuple[Tuple, Test, bool]
+
+
+def compile_condition(cond: Dict[str, Any]) -> Optional[Step]:
+    """The compiled step of one rule condition, or None for an unknown type (which never fails a rule)."""
+    key, negated = condition_key(cond)
+    compiler = CONDITION_COMPILERS.get(key[0])
+    if compiler is None:
+        return None
+    return key, compiler(cond), negated
+
+
+class CompiledRule(NamedTuple):
+    """A rule's condition steps, in rule order, and the finding it reports."""
+    id: Any
+    steps: Tuple[Step, ...]
+    finding: Dict[str, Any]
+
+
+def compile_rule(rule: Dict[str, Any]) -> CompiledRule:
+    steps = tuple(t for t in map(compile_condition, rule.get('conditions', [])) if t is not None)
+    finding = {
+        'issue_type': rule.get('id'),
+        'severity': rule.get('severity', 'medium').capitalize(),
+        'why_failed': rule.get('message'),
+        'what_to_fix': rule.get('fix'),
+        'reference': rule.get('id')
+    }
+    return CompiledRule(rule.get('id'), steps, finding)
+
+
+class RuleSet(list):
+    """Rule dicts as loaded, with their compiled plans in `plans`.
+
+    It is what `load_rules` caches and returns, so `evaluate_rules` resolves
+    condition handlers and constants once per ruleset instead of once per
+    call. Pickling keeps only the rule dicts; they are recompiled on load.
+    `version` identifies the rules, for stamping results.
+    """
+
+    def __init__(self, rules=()):
+        super().__init__(rules)
+        self.plans = [compile_rule(rule) for rule in self]
+        self._version: Optional[str] = None
+
+    def __reduce__(self):
+        return RuleSet, (list(self),)
+
+    @property
+    def version(self) -> str:
+        """Short content hash of the rules (see `rules_version`)."""
+        if self._version is None:
+            self._version = rules_version(list(self))
+        return self._version
+
+    def reorder(self, stats: 'ConditionStats') -> None:
+        """Order each rule's conditions by `stats` (see `ConditionStats.order`)."""
+        self.plans = [plan._replace(steps=stats.order(plan.steps)) for plan in self.plans]
+
+
+class ConditionStats:
+    """Runtime cost and pass-rate counters per condition, keyed like the memo.
+
+    Passed to `evaluate_rules` or `evaluate_claims`, it times every test
+    that actually runs (memo hits cost nothing and are not counted). `order`
+    then sorts a rule's conjunction so that cheap conditions likely to fail
+    run first: by expected cost per rejection, `cost / (1 - pass rate)`.
+    Conditions never seen keep their place ahead of the measured ones.
+    `save` and `load` keep the counters across processes as JSON.
+    """
+
+    def __init__(self):
+        # condition key -> [tests run, tests that were true, seconds spent]
+        self.counts: Dict[Tuple, List[float]] = {}
+
+    def record(self, key: Tuple, seconds: float, result: bool) -> None:
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0, 0, 0.0]
+        counts[0] += 1
+        counts[1] += result
+        counts[2] += seconds
+
+    def rank(self, step: 'Step') -> float:
+        """Expected seconds spent per rule rejected by this step.
+
+        0 when unmeasured (including counters saved with no calls), infinite
+        when the step has never rejected a rule.
+        """
+        key, _, negated = step
+        counts = self.counts.get(key)
+        if not counts or counts[0] <= 0:
+            return 0.0
+        calls, true, seconds = counts
+        passes = (calls - true if negated else true) / calls
+        if passes >= 1:
+            return float('inf')
+        return seconds / calls / (1 - passes)
+
+    def order(self, steps: Tuple['Step', ...]) -> Tuple['Step', ...]:
+        return tuple(sorted(steps, key=self.rank))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'conditions': [{'key': list(key), 'calls': c[0], 'true': c[1], 'seconds': c[2]}
+                               for key, c in self.counts.items()]}
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'ConditionStats':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        stats = cls()
+        for entry in data.get('conditions', []):
+            stats.counts[_frozen(entry['key'])] = [entry['calls'], entry['true'], entry['seconds']]
+        return stats
+
+
+class _Loaded:
+    """A registry entry: the compiled rules and the file state they were read from."""
+    __slots__ = ('rules', 'signature', 'checked', 'reloading')
+
+    def __init__(self, rules: RuleSet, signature: Tuple, checked: float):
+        self.rules = rules
+        self.signature = signature
+        self.checked = checked
+        self.reloading = False
+
+
+class RuleRegistry:
+    """Compiled rulesets by scope, recompiled in the background when their files change.
+
+    `get` returns the current `RuleSet` of a scope without ever waiting on
+    a reload: at most every `interval` seconds it compares the mtime and
+    size of the rules and stats files with those the rules were read from,
+    and on a change starts a thread that reads and compiles them again. The
+    new `RuleSet` then replaces the old one in a single assignment, so an
+    evaluation holds the ruleset it started with to the end, and results
+    stamped with `RuleSet.version` tell which rules produced them. A file
+    that fails to load, or is removed, keeps the previous rules in place.
+    """
+
+    def __init__(self, rules_dir: str = RULES_DIR, interval: float = RELOAD_INTERVAL):
+        self.rules_dir = rules_dir
+        self.interval = interval
+        self._loaded: Dict[str, _Loaded] = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, scope: str) -> Tuple:
+        signature = []
+        for path in _ruleset_paths(scope, self.rules_dir):
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def _read(self, scope: str, missing_ok: bool = True) -> _Loaded:
+        # the signature is taken first: an edit made while reading is seen next time
+        signature = self._signature(scope)
+        return _Loaded(read_ruleset(scope, self.rules_dir, missing_ok), signature, time.monotonic())
+
+    def get(self, scope: str) -> RuleSet:
+        loaded = self._loaded.get(scope)
+        if loaded is None:
+            with self._lock:
+                loaded = self._loaded.get(scope)
+                if loaded is None:
+                    loaded = self._loaded[scope] = self._read(scope)
+            return loaded.rules
+        now = time.monotonic()
+        if now - loaded.checked >= self.interval and not loaded.reloading:
+            loaded.checked = now
+            if self._signature(scope) != loaded.signature:
+                loaded.reloading = True
+                threading.Thread(target=self._reload, args=(scope, loaded), daemon=True,
+                                 name=f'ruleset-reload-{scope}').start()
+        return loaded.rules
+
+    def _reload(self, scope: str, previous: _Loaded) -> None:
+        try:
+            # with neither the scope's file nor the dhcs fallback left, the
+            # reload fails rather than swapping in no rules
+            loaded = self._read(scope, missing_ok=False)
+        except Exception as e:
+            logger.error(f"Keeping ruleset {scope} version {previous.rules.version}: reload failed: {e}")
+            previous.signature = self._signature(scope)
+            previous.reloading = False
+            return
+        self._loaded[scope] = loaded
+        if loaded.rules.version != previous.rules.version:
+            logger.info(f"Ruleset {scope} reloaded: version {previous.rules.version} -> {loaded.rules.version}")
+
+    def reload(self, scope: str) -> RuleSet:
+        """Read and compile `scope` now, replacing the current rules."""
+        loaded = self._loaded[scope] = self._read(scope)
+        return loaded.rules
+
+    def clear(self) -> None:
+        self._loaded.clear()
+
+
+# The process-wide registry behind `load_rules`
+RULESETS = RuleRegistry()
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> List[CompiledRule]:
+    """Plans of `rules`, taken from a `RuleSet` when they were loaded as one."""
+    if isinstance(rules, RuleSet) and len(rules.plans) == len(rules):
+        return rules.plans
+    return [compile_rule(rule) for rule in rules]
+
+
+def _run_test(key: Tuple, test: Test, doc: _Document, stats: Optional[ConditionStats]) -> bool:
+    if stats is None:
+        return bool(test(doc))
+    start = time.perf_counter()
+    result = bool(test(doc))
+    stats.record(key, time.perf_counter() - start, result)
+    return result
+
+
+class RuleProfile:
+    """Opt-in profile of `evaluate_rules`, per rule and per condition type.
+
+    Pass one as `profile=` to any number of `evaluate_rules` calls; they
+    accumulate into it. Per rule: evaluations, matches, short circuits
+    (evaluations ended by a failing condition before the rule's last) and
+    seconds spent. Per condition type: tests run, memo hits, tests that
+    were true, rules the condition rejected and short-circuited, and the
+    seconds its tests took. `as_dict` is the report, slowest first.
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.seconds = 0.0
+        # rule id -> [evaluations, matches, short circuits, seconds]
+        self.rules: Dict[Any, List[float]] = {}
+        # condition type -> [tests run, memo hits, true, rejections, short circuits, seconds]
+        self.conditions: Dict[str, List[float]] = {}
+
+    def _condition(self, typ: str) -> List[float]:
+        counts = self.conditions.get(typ)
+        if counts is None:
+            counts = self.conditions[typ] = [0, 0, 0, 0, 0, 0.0]
+        return counts
+
+    def _rule(self, rule_id: Any) -> List[float]:
+        counts = self.rules.get(rule_id)
+        if counts is None:
+            counts = self.rules[rule_id] = [0, 0, 0, 0.0]
+        return counts
+
+    def as_dict(self) -> Dict[str, Any]:
+        rules = [{
+            'id': rule_id,
+            'evaluations': c[0],
+            'matches': c[1],
+            'match_rate': round(c[1] / c[0], 4) if c[0] else 0,
+            'short_circuits': c[2],
+            'seconds': c[3],
+        } for rule_id, c in self.rules.items()]
+        conditions = [{
+            'type': typ,
+            'calls': c[0],
+            'memo_hits': c[1],
+            'true_rate': round(c[2] / c[0], 4) if c[0] else 0,
+            'rejections': c[3],
+            'short_circuits': c[4],
+            'seconds': c[5],
+        } for typ, c in self.conditions.items()]
+        return {
+            'documents': self.documents,
+            'seconds': self.seconds,
+            'rules': sorted(rules, key=lambda r: r['seconds'], reverse=True),
+            'conditions': sorted(conditions, key=lambda c: c['seconds'], reverse=True),
+        }
+
+
+def _profiled_findings(doc: _Document, plans: List[CompiledRule], stats: Optional[ConditionStats],
+                       profile: RuleProfile) -> List[Dict[str, Any]]:
+    """The `evaluate_rules` loop, timing and counting into `profile`."""
+    clock = time.perf_counter
+    memo = doc.memo
+    findings = []
+    started = clock()
+    for plan in plans:
+        rule_started = clock()
+        steps = plan.steps
+        matched, short = True, False
+        for n, (key, test, negated) in enumerate(steps):
+            counts = profile._condition(key[0])
+            result = memo.get(key)
+            if result is None:
+                test_started = clock()
+                result = memo[key] = _run_test(key, test, doc, stats)
+                counts[0] += 1
+                counts[2] += result
+                counts[5] += clock() - test_started
+            else:
+                counts[1] += 1
+            if result is negated:
+                matched, short = False, n < len(steps) - 1
+                counts[3] += 1
+                counts[4] += short
+                break
+        if matched:
+            findings.append(dict(plan.finding))
+        counts = profile._rule(plan.id)
+        counts[0] += 1
+        counts[1] += matched
+        counts[2] += short
+        counts[3] += clock() - rule_started
+    profile.documents += 1
+    profile.seconds += clock() - started
+    return findings
+
+
+def evaluate_rules(parsed_json: Dict[str, Any], rules: List[Dict[str, Any]],
+                   fact_counts: Optional[Dict[str, int]] = None, stats: Optional[ConditionStats] = None,
+                   profile: Optional[RuleProfile] = None):
+    """Return a finding for every rule whose conditions all hold for the document.
+
+    `rules` are run through their compiled plans (see `RuleSet`); plain
+    lists of rule dicts are compiled on the way in. Each distinct condition
+    is tested at most once per call, however many rules share it.
+    `fact_counts` (see `count_facts`) lets callers that track per-claim
+    facts, such as `engine.incremental`, answer the claim-scanning
+    conditions without visiting every claim; claims loaded with
+    `engine.persist` carry their saved counts and use them by default.
+    Envelope conditions read the counters and errors
+    `engine.parser.parse_837` leaves in `parsed_json['envelope']`. With
+    `stats`, the cost and result of every test run is recorded in it; with
+    `profile` (a `RuleProfile`), per-rule and per-condition timings and
+    counts. Without either, nothing is timed.
+    """
+    if fact_counts is None:
+        fact_counts = getattr(parsed_json.get('claims'), 'fact_counts', None)
+    doc = _Document(parsed_json, fact_counts)
+    plans = compile_rules(rules)
+    if profile is not None:
+        findings = _profiled_findings(doc, plans, stats, profile)
+        logger.info(f"Evaluated {len(rules)} rules, found {len(findings)} issues")
+        return findings
+
+    memo = doc.memo
     findings = []
+    debug = logger.isEnabledFor(logging.DEBUG)
 
-    for rule in rules:
-        match = True
-
-        for cond in rule.get('conditions', []):
-            typ = cond.get('type')
-            expected = cond.get('value', True)  # Default to True if not specified
-
-            if typ == 'txn_is':
-                result = parsed_json.get('transaction_type') == cond.get('value')
-                match &= result
-
-            elif typ == 'claim_has_segment':
-                seg = cond.get('segment')
-                result = any(
-                    any(s.get('tag') == seg for s in (c.get('segments') or []))
-                    for c in parsed_json.get('claims', [])
-                )
-                # Handle inverted logic: if expected=False, negate result
-                if isinstance(expected, bool):
-                    result = result if expected else not result
-                match &= result
-
-            elif typ == 'claim_missing_segment':
-                # Direct handler for missing segment (clearer than value=false)
-                seg = cond.get('segment')
-                result = not any(
-                    any(s.get('tag') == seg for s in (c.get('segments') or []))
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'service_line_exists':
-                result = any(c.get('service_lines') for c in parsed_json.get('claims', []))
-                match &= result
-
-            elif typ == 'amount_nonzero':
-                result = any(
-                    c.get('CLM', [None, None, '0'])[2] not in ('0', None)
-                    for c in parsed_json.get('claims', [])
-                )
-                if isinstance(expected, bool):
-                    result = result if expected else not result
-                match &= result
-
-            elif typ == 'diagnosis_present':
-                result = any(c.get('diagnosis') for c in parsed_json.get('claims', []))
-                if isinstance(expected, bool):
-                    result = result if expected else not result
-                match &= result
-
-            elif typ == 'transaction_header_valid':
-                # Check if ST segment exists and has '837' as first element
-                st_segments = [s for c in parsed_json.get('claims', []) 
-                              for s in c.get('segments', []) if s.get('tag') == 'ST']
-                result = any(s.get('parts', [None, ''])[1] == '837' for s in st_segments) if st_segments else False
-                match &= result
-
-            elif typ == 'npi_valid':
-                # Check for valid NPI (10 digits)
-                result = any(
-                    len(str(c.get('provider_npi', ''))) == 10
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'diagnosis_to_procedure_valid':
-                # Check that diagnosis and procedures exist and align
-                result = any(
-                    c.get('diagnosis') and c.get('service_lines')
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'age_appropriate_procedure':
-                # Placeholder: assumes age validation data would be available
-                result = True  # Default to passing unless specific age check logic added
-                match &= result
-
-            elif typ == 'bill_type_present':
-                # Check for UB-04 bill type in institutional claims
-                result = parsed_json.get('transaction_type') != 'institutional' or any(
-                    any(s.get('tag') == 'UB' for s in c.get('segments', []))
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'provider_identified':
-                # Check for provider loop existence
-                result = any(
-                    c.get('provider_npi') or any(s.get('tag') == 'NM1' for s in c.get('segments', []))
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'subscriber_identified':
-                # Check for subscriber information
-                result = any(
-                    c.get('subscriber_id') or any(s.get('tag') in ('NM1', 'DMG') for s in c.get('segments', []))
-                    for c in parsed_json.get('claims', [])
-                )
-                match &= result
-
-            elif typ == 'place_of_service_valid':
-                # Check for valid POS code
-                valid_pos = {'01', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20', '21', 
-                            '22', '23', '24', '25', '26', '27', '28', '29', '30', '31', '32', '33',
-                            '34', '35', '36', '37', '38', '39', '40', '41', '42', '43', '44', '45',
-                            '46', '47', '48', '49', '50', '51', '52', '53', '54', '55', '56', '57',
-                            '58', '59', '60', '61'}
-                result = True  # Default to True if POS validation not yet implemented
-                match &= result
-
-            if not match:
+    for plan in plans:
+        for key, test, negated in plan.steps:
+            result = memo.get(key)
+            if result is None:
+                result = memo[key] = _run_test(key, test, doc, stats)
+            if result is negated:
                 break
+        else:
+            findings.append(dict(plan.finding))
+            if debug:
+                logger.debug(f"Rule matched: {plan.id} - {plan.finding['why_failed']}")
 
-        if match:
-            findings.append({
-                'issue_type': rule.get('id'),
-                'severity': rule.get('severity', 'medium').capitalize(),
-                'why_failed': rule.get('message'),
-                'what_to_fix': rule.get('fix'),
-                'reference': rule.get('id')
-            })
-            logger.debug(f"Rule matched: {rule.get('id')} - {rule.get('message')}")
-    
     logger.info(f"Evaluated {len(rules)} rules, found {len(findings)} issues")
     return findings
+
+
+def _claim_id(claim: Mapping) -> str:
+    clm = claim.get('CLM') or ()
+    return clm[1] if len(clm) > 1 else ''
+
+
+# Claim position of every tag in a one-claim document's tag index
+_ONLY_CLAIM = (0,)
+
+
+def _claim_view(parsed_json: Dict[str, Any]) -> Dict[str, Any]:
+    """The document-level keys a one-claim document shares with its parse."""
+    return {key: parsed_json[key] for key in ('transaction_type', 'envelope', 'decoding', 'delimiters')
+            if key in parsed_json}
+
+
+def _claim_document(view: Dict[str, Any], claim: Mapping, segments: Optional[ClaimSegments] = None) -> _Document:
+    """`claim` as a document of its own, for per-claim evaluation.
+
+    `segments` is the claim's view of its batch's `SegmentIndex`, so segment
+    conditions read the batch-wide index instead of indexing the claim again.
+    """
+    return _Document(dict(view, claims=(claim,), tag_index=dict.fromkeys(claim_tags(claim), _ONLY_CLAIM)), None,
+                     segments)
+
+
+def claim_results(total: int, findings: List[Dict[str, Any]], rollups: List[Dict[str, Any]],
+                  version: Optional[str] = None) -> Dict[str, Any]:
+    """The `evaluate_claims` result for `total` claims, under ruleset `version`."""
+    return {
+        'findings': findings,
+        'claims': rollups,
+        'total_claims': total,
+        'invalid_claims': len(rollups),
+        'invalid_percentage': round(100 * len(rollups) / total, 2) if total else 0,
+        'ruleset_version': version,
+    }
+
+
+def evaluate_claims(parsed_json: Dict[str, Any], rules: List[Dict[str, Any]],
+                    stats: Optional[ConditionStats] = None) -> Dict[str, Any]:
+    """Run the rules over each claim on its own, in one pass over the claims.
+
+    Every claim is evaluated as a one-claim document: segment and claim
+    conditions look at that claim alone, while document conditions
+    (`DOCUMENT_CONDITIONS`) are tested once and shared by all claims.
+    Returns `findings` (the `evaluate_rules` finding plus `claim_index`
+    and `claim_id`, CLM01), `claims` (one rollup per claim with findings:
+    its index, id, `rules` matched and `high_risk_issues`), and the
+    `total_claims`, `invalid_claims` and `invalid_percentage` counts, and
+    the `ruleset_version` of `rules` (see `rules_version`). `stats` records test costs and results as in `evaluate_rules`.
+    """
+    plans = compile_rules(rules)
+    claims = parsed_json.get('claims', [])
+    view = _claim_view(parsed_json)
+    segments = segment_index(parsed_json)
+    shared: Dict[Tuple, bool] = {}
+    findings = []
+    rollups = []
+
+    for index, claim in enumerate(claims):
+        doc = _claim_document(view, claim, ClaimSegments(segments, index))
+        memo = doc.memo
+        matched = []
+        for plan in plans:
+            for key, test, negated in plan.steps:
+                results = shared if key[0] in DOCUMENT_CONDITIONS else memo
+                result = results.get(key)
+                if result is None:
+                    result = results[key] = _run_test(key, test, doc, stats)
+                if result is negated:
+                    break
+            else:
+                matched.append(plan)
+        if matched:
+            claim_id = _claim_id(claim)
+            findings.extend(dict(plan.finding, claim_index=index, claim_id=claim_id) for plan in matched)
+            rollups.append({
+                'claim_index': index,
+                'claim_id': claim_id,
+                'rules': [plan.id for plan in matched],
+                'high_risk_issues': sum(plan.finding['severity'] == 'High' for plan in matched),
+            })
+
+    total = len(claims)
+    logger.info(f"Evaluated {len(plans)} rules per claim over {total} claims, {len(rollups)} with issues")
+    return claim_results(total, findings, rollups, rules_version(rules))
@@ -0,0 +1,156 @@
+"""Batch-wide inverted index from segment keys to the claims holding them.
+
+A key is a segment tag (`NM1`) or, for the tags whose first element is a
+qualifier (`QUALIFIED_TAGS`), the tag and that qualifier joined by `*`
+(`NM1*82`, `REF*G1`, `DTP*472`). Like the document tag index, a claim holds
+a key when one of its own segments (its 2300 loop and 2400 lines) does.
+
+`SegmentIndex.bitset` returns the claims holding a key as a Python int with
+bit `i` set for claim `i`, so batch questions are integer set operations::
+
+    index = segment_index(parsed)
+    flagged = index.bitset('DTP*472') & index.missing('REF*G1')
+    members(flagged)  # claim positions
+
+Tag keys come straight from the tag index the parser builds; the qualifier
+keys of a tag are collected in one pass over the claims holding that tag,
+the first time a key of that tag is asked for. Bitsets and boolean columns
+are built on first use and kept.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from .claims import build_tag_index, tagged_segments
+
+# Tags whose first element qualifies the segment, indexed as `TAG*QUALIFIER`
+QUALIFIED_TAGS = frozenset({'NM1', 'N1', 'REF', 'DTP', 'PRV', 'AMT', 'QTY'})
+
+KEY_SEPARATOR = '*'
+
+
+def segment_key(tag: str, qualifier: Optional[str] = None) -> str:
+    return f'{tag}{KEY_SEPARATOR}{qualifier}' if qualifier else tag
+
+
+def _bitset(column: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(column, bitorder='little').tobytes(), 'little')
+
+
+def members(bits: int) -> List[int]:
+    """Claim positions of the set bits of a bitset, in order."""
+    if not bits:
+        return []
+    raw = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little')).tolist()
+
+
+class SegmentIndex:
+    """Segment key -> claims holding it, for the claims of one parse."""
+    __slots__ = ('claims', 'tag_index', 'size', '_positions', '_qualified', '_bits', '_columns')
+
+    def __init__(self, claims: Sequence[Mapping], tag_index: Optional[Dict[str, List[int]]] = None):
+        self.claims = claims
+        self.tag_index = tag_index if tag_index is not None else build_tag_index(claims)
+        self.size = len(claims)
+        self._positions: Dict[str, List[int]] = {}
+        self._qualified = set()
+        self._bits: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def _qualify(self, tag: str) -> None:
+        """Collect the `TAG*QUALIFIER` keys of `tag` in one pass over its claims."""
+        found: Dict[str, List[int]] = {}
+        claims = self.claims
+        for i in self.tag_index.get(tag, ()):
+            seen = set()
+            for segment in tagged_segments(claims[i], tag):
+                parts = segment['parts']
+                qualifier = parts[1] if len(parts) > 1 else ''
+                if qualifier and qualifier not in seen:
+                    seen.add(qualifier)
+                    key = segment_key(tag, qualifier)
+                    positions = found.get(key)
+                    if positions is None:
+                        found[key] = [i]
+                    else:
+                        positions.append(i)
+        self._positions.update(found)
+        self._qualified.add(tag)
+
+    def positions(self, key: str) -> Sequence[int]:
+        """Positions of the claims holding `key`, in order."""
+        if not isinstance(key, str) or KEY_SEPARATOR not in key:
+            return self.tag_index.get(key, ())
+        tag = key.partition(KEY_SEPARATOR)[0]
+        if tag not in self._qualified and tag in QUALIFIED_TAGS:
+            self._qualify(tag)
+        return self._positions.get(key, ())
+
+    def has(self, key: str) -> bool:
+        """True when any claim holds `key`."""
+        return bool(self.positions(key))
+
+    def count(self, key: str) -> int:
+        return len(self.positions(key))
+
+    def column(self, key: str) -> np.ndarray:
+        """Boolean column over the claims: whether each holds `key`."""
+        column = self._columns.get(key)
+        if column is None:
+            column = np.zeros(self.size, dtype=bool)
+            positions = self.positions(key)
+            if positions:
+                column[np.asarray(positions, dtype=np.intp)] = True
+            self._columns[key] = column
+        return column
+
+    def bitset(self, key: str) -> int:
+        """The claims holding `key`, as an int with bit `i` set for claim `i`."""
+        bits = self._bits.get(key)
+        if bits is None:
+            bits = self._bits[key] = _bitset(self.column(key))
+        return bits
+
+    @property
+    def full(self) -> int:
+        """Bitset of every claim."""
+        return (1 << self.size) - 1
+
+    def missing(self, key: str) -> int:
+        """Bitset of the claims not holding `key`."""
+        return self.full & ~self.bitset(key)
+
+    def keys(self) -> List[str]:
+        """Every key held by some claim."""
+        for tag in QUALIFIED_TAGS.intersection(self.tag_index).difference(self._qualified):
+            self._qualify(tag)
+        return list(self.tag_index) + list(self._positions)
+
+    def as_dict(self) -> Dict[str, List[int]]:
+        return {key: list(self.positions(key)) for key in self.keys()}
+
+    def __repr__(self) -> str:
+        return f'SegmentIndex({self.size} claims, {len(self.tag_index)} tags)'
+
+
+class ClaimSegments:
+    """A `SegmentIndex` seen from one of its claims: `has` answers for that claim."""
+    __slots__ = ('index', 'position')
+
+    def __init__(self, index: SegmentIndex, position: int):
+        self.index = index
+        self.position = position
+
+    def has(self, key: str) -> bool:
+        return bool(self.index.column(key)[self.position])
+
+
+def segment_index(parsed: Mapping[str, Any], tag_index: Optional[Dict[str, List[int]]] = None) -> SegmentIndex:
+    """A new `SegmentIndex` over the claims of a parse.
+
+    The index is not kept in the parse itself, so parses stay plain data;
+    callers hold on to it for as long as they query one batch. `tag_index`
+    saves rebuilding the tag index of parses that carry none.
+    """
+    return SegmentIndex(parsed.get('claims', []), tag_index if tag_index is not None else parsed.get('tag_index'))
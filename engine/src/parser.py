@@ -1,48 +1,19 @@
 """Simple 837 parser used by the standalone engine runner.
 Produces a dict with `claims`, `transaction_type`, and basic segment lists.
+The parsing itself is done by `engine.adapters.parse_837_runner`.
 """
-from typing import List, Dict
+import sys
+from pathlib import Path
+from typing import Dict
 
+# allow importing the shared parser when run from the engine/src directory
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
 
-def split_segments(raw: str) -> List[str]:
-    if '~' in raw:
-        raw = raw.replace('\r','')
-        return [s.strip() for s in raw.split('~') if s.strip()]
-    return [s.strip() for s in raw.splitlines() if s.strip()]
+from engine.adapters import parse_837_runner
 
 
-def detect_transaction_type(segments: List[str]) -> str:
-    if any(s.startswith('SV1') for s in segments):
-        return 'professional'
-    if any(s.startswith('SV2') for s in segments):
-        return 'institutional'
-    return 'unknown'
-
-
-def parse_837(raw: str) -> Dict:
-    segments = split_segments(raw)
-    parsed = {'claims': [], 'transaction_type': detect_transaction_type(segments)}
-    current_claim = None
-    for seg in segments:
-        parts = seg.split('*')
-        tag = parts[0]
-        if tag == 'CLM':
-            if current_claim:
-                parsed['claims'].append(current_claim)
-            current_claim = {'CLM': parts, 'segments': []}
-            # record the CLM segment itself
-            current_claim.setdefault('segments', []).append({'tag': tag, 'parts': parts})
-        elif tag in ('SV1','SV2'):
-            if current_claim is None:
-                current_claim = {'CLM': [], 'segments': []}
-            current_claim.setdefault('service_lines', []).append(parts)
-        elif tag == 'HI':
-            if current_claim is None:
-                current_claim = {'CLM': [], 'segments': []}
-            current_claim.setdefault('diagnosis', []).append(parts)
-        # record every segment in claim if claim exists
-        if current_claim is not None:
-            current_claim.setdefault('segments', []).append({'tag': tag, 'parts': parts})
-    if current_claim:
-        parsed['claims'].append(current_claim)
-    return parsed
+def parse_837(raw, encoding: str = 'utf-8') -> Dict:
+    """Parse text, bytes or a file object through the shared `engine` core."""
+    return parse_837_runner(raw, encoding)
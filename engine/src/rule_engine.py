@@ -2,12 +2,33 @@
 Rules are JSON objects with `conditions` array. Each condition is dict with `type` and other fields.
 """
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+
+
+class RuleList(list):
+    """Rules as loaded, with `plans` resolving each condition's handler up front.
+
+    A plan is `(rule, steps)`; each step is `(handler, cond, expected)`, with
+    `handler` None for an unknown condition type.
+    """
+
+    def __init__(self, rules=()):
+        super().__init__(rules)
+        self.plans = compile_rules(self)
+
+    def __reduce__(self):
+        return RuleList, (list(self),)
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[Tuple]]]:
+    return [(r, [(COND_HANDLERS.get(cond.get('type')), cond, cond.get('value', True))
+                 for cond in r.get('conditions', [])])
+            for r in rules]
 
 
 def load_rules(path: str) -> List[Dict[str, Any]]:
     with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+        return RuleList(json.load(f))
 
 
 # Condition handler functions receive parsed_json and the cond dict, and return True when condition satisfied.
@@ -56,17 +77,15 @@ COND_HANDLERS = {
 
 def evaluate_rules(parsed_json: Dict[str, Any], rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     findings = []
-    for r in rules:
+    plans = rules.plans if isinstance(rules, RuleList) else compile_rules(rules)
+    for r, steps in plans:
         try:
             match = True
-            for cond in r.get('conditions', []):
-                typ = cond.get('type')
-                handler = COND_HANDLERS.get(typ)
+            for handler, cond, expected in steps:
                 if not handler:
                     # unknown condition: treat as non-match
                     match = False
                     break
-                expected = cond.get('value', True)
                 result = handler(parsed_json, cond)
                 # If rule expects truthiness, require result==expected (for booleans)
                 if isinstance(expected, bool):
@@ -1,8 +1,15 @@
 """Command-line runner: parse a sample 837 and run rules against it.
 Usage: python run_rules.py ../samples/sample_837_prof.txt
+
+A batch saved with `engine/tools/persist_batch.py` is loaded instead of
+parsed; its claims are the `engine.parser` claim objects, which read like
+the runner's claim dicts. A gzip, zip or tar bundle of 837s is read member
+by member as it decompresses, with the members parsed and checked across
+a process pool; the output then has one entry per member.
 """
 import sys
 import json
+from functools import partial
 from pathlib import Path
 
 # allow running from engine/src directory or project root
@@ -12,6 +19,27 @@ sys.path.insert(0, str(BASE.joinpath('src')))
 # import modules directly from the added src path
 import parser
 import rule_engine
+from engine.archive import archive_kind, map_members
+from engine.parser import decode_stream
+from engine.persist import is_persisted, load_parsed
+
+
+def _rules_path():
+    """The runner's rules: dhcs_rules_v2.json when present, else dhcs_rules.json."""
+    path = BASE.joinpath('rules', 'dhcs_rules_v2.json')
+    if not path.exists():
+        path = BASE.joinpath('rules', 'dhcs_rules.json')
+    return path
+
+
+def _summary(parsed):
+    return {'transaction_type': parsed.get('transaction_type'), 'claim_count': len(parsed.get('claims', []))}
+
+
+def _run_member(rules, name, stream):
+    """Parse one archive member as it decompresses and run the rules on it."""
+    parsed = parser.parse_837(decode_stream(stream))
+    return {'member': name, 'parsed_summary': _summary(parsed), 'findings': rule_engine.evaluate_rules(parsed, rules)}
 
 
 def main():
@@ -22,12 +50,19 @@ def main():
     if not sample_path.exists():
         print('Sample file not found:', sample_path)
         sys.exit(2)
-    raw = sample_path.read_text(encoding='utf-8')
-    parsed = parser.parse_837(raw)
-    rules_path = BASE.joinpath('rules','dhcs_rules_v2.json')
-    rules = rule_engine.load_rules(str(rules_path))
+    rules = rule_engine.load_rules(str(_rules_path()))
+    if archive_kind(sample_path):
+        members = [result for _, result in map_members(sample_path, partial(_run_member, rules))]
+        print(json.dumps({'sample': str(sample_path), 'members': members}, indent=2))
+        return
+    if is_persisted(sample_path):
+        parsed = load_parsed(sample_path)
+    else:
+        # the parser splits the bytes itself and decodes segment by segment
+        raw = sample_path.read_bytes()
+        parsed = parser.parse_837(raw)
     findings = rule_engine.evaluate_rules(parsed, rules)
-    out = {'sample': str(sample_path), 'parsed_summary': {'transaction_type': parsed.get('transaction_type'), 'claim_count': len(parsed.get('claims', []))}, 'findings': findings}
+    out = {'sample': str(sample_path), 'parsed_summary': _summary(parsed), 'findings': findings}
     print(json.dumps(out, indent=2))
 
 if __name__ == '__main__':
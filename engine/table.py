@@ -0,0 +1,194 @@
+"""Columnar claim tables built from the parsed model.
+
+`claim_tables` walks the claims of a `parse_837` result once and returns two
+pandas DataFrames: one row per claim and one row per service line (2400
+loop), linked by `claim_index`, the claim's position in `parsed['claims']`.
+Amounts, charges and units are float64, dates datetime64, positions int32,
+and code columns (place of service, frequency, procedures, modifiers,
+diagnoses) are categoricals, so analytics and vectorized checks are whole-
+column operations instead of loops over claim dicts. Missing or malformed
+values are NaN / NaT.
+
+Claim columns: claim_index, claim_id (CLM01), amount (CLM02),
+place_of_service, facility_qualifier and frequency (CLM05-1/2/3),
+claim_type, line_count, line_charge_total, service_date_from,
+service_date_to, diagnosis_qualifier and diagnosis_1..N (HI codes in order).
+
+Service line columns: claim_index, line_number (LX01, else the line's
+position), service_tag (SV1/SV2), revenue_code (SV201), procedure_qualifier,
+procedure_code, modifier_1..4, charge, unit_basis, units,
+place_of_service (SV105), diagnosis_pointers (SV107), service_date_from,
+service_date_to (the line's DTP*472).
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .logger import setup_logger
+from .parser import DEFAULT_DELIMITERS
+
+logger = setup_logger(__name__)
+
+# Modifier components of a procedure composite (qualifier:code:mod1..mod4)
+MODIFIER_COUNT = 4
+
+# DTP qualifiers read as claim dates: 472 service date, 434 statement dates
+SERVICE_DATE_QUALIFIERS = ('472', '434')
+
+# (procedure composite, charge, unit basis, units) element positions per line segment
+_LINE_ELEMENTS = {'SV1': (1, 2, 3, 4), 'SV2': (2, 3, 4, 5)}
+
+
+class ClaimTables(NamedTuple):
+    """The claim-level and service-line-level tables of one parse."""
+    claims: pd.DataFrame
+    service_lines: pd.DataFrame
+
+
+# Blank elements appended to a segment so optional positions index safely
+_PAD = [''] * 8
+
+
+def _padded(parts: Sequence[str]) -> List[str]:
+    """The elements as a list, followed by blanks for any missing ones."""
+    return list(parts) + _PAD
+
+
+def _date_range(dtp: Sequence[str]) -> Tuple[str, str]:
+    """(from, to) CCYYMMDD strings of a padded DTP segment (D8 or RD8)."""
+    value = dtp[3]
+    if dtp[2] == 'RD8' and '-' in value:
+        start, _, end = value.partition('-')
+        return start, end
+    return value, value
+
+
+def _codes(values: List[Optional[str]]) -> pd.Categorical:
+    return pd.Categorical([v or None for v in values])
+
+
+def _numbers(values: List[str]) -> np.ndarray:
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _dates(values: List[str]) -> pd.Series:
+    return pd.to_datetime(pd.Series(values, dtype=object), format='%Y%m%d', errors='coerce')
+
+
+def _claim_type(claim: Any) -> str:
+    if claim.has('SV1'):
+        return 'professional'
+    if claim.has('SV2'):
+        return 'institutional'
+    return 'unknown'
+
+
+def claim_tables(parsed: Dict) -> ClaimTables:
+    """Build the claim and service line tables of a `parse_837` result."""
+    component = parsed.get('delimiters', DEFAULT_DELIMITERS).component
+    claim_cols: Dict[str, List[Any]] = {name: [] for name in (
+        'claim_id', 'amount', 'place_of_service', 'facility_qualifier', 'frequency',
+        'claim_type', 'line_count', 'service_date_from', 'service_date_to', 'diagnosis_qualifier')}
+    diagnoses: List[List[str]] = []
+    line_cols: Dict[str, List[Any]] = {name: [] for name in (
+        'claim_index', 'line_number', 'service_tag', 'revenue_code', 'procedure_qualifier',
+        'procedure_code', 'charge', 'unit_basis', 'units', 'place_of_service', 'diagnosis_pointers',
+        'service_date_from', 'service_date_to')}
+    modifiers: List[List[str]] = [[] for _ in range(MODIFIER_COUNT)]
+
+    for index, claim in enumerate(parsed.get('claims', [])):
+        clm = _padded(claim.clm)
+        facility = clm[5].split(component) + _PAD
+        claim_cols['claim_id'].append(clm[1])
+        claim_cols['amount'].append(clm[2])
+        claim_cols['place_of_service'].append(facility[0])
+        claim_cols['facility_qualifier'].append(facility[1])
+        claim_cols['frequency'].append(facility[2])
+        claim_cols['claim_type'].append(_claim_type(claim))
+
+        dtps = [_padded(claim.segments[i].parts) for i in claim.positions('DTP')]
+        dates = [_date_range(dtp) for dtp in dtps if dtp[1] in SERVICE_DATE_QUALIFIERS]
+        claim_cols['service_date_from'].append(min((d[0] for d in dates), default=''))
+        claim_cols['service_date_to'].append(max((d[1] for d in dates), default=''))
+
+        codes, qualifier = [], ''
+        for hi in claim.diagnosis:
+            for composite in list(hi)[1:]:
+                parts = composite.split(component)
+                if not qualifier:
+                    qualifier = parts[0]
+                if len(parts) > 1 and parts[1]:
+                    codes.append(parts[1])
+        claim_cols['diagnosis_qualifier'].append(qualifier)
+        diagnoses.append(codes)
+
+        lines = claim.service_line_loops()
+        claim_cols['line_count'].append(len(lines))
+        for number, line in enumerate(lines, 1):
+            sv = next((line.segments[i] for i in line.positions('SV1', 'SV2')), None)
+            if sv is None:
+                continue
+            parts = _padded(sv.parts)
+            composite_at, charge_at, basis_at, units_at = _LINE_ELEMENTS[sv.tag]
+            procedure = parts[composite_at].split(component) + _PAD
+            lx = line.find('LX')
+            dtp = line.find('DTP', '472')
+            start, end = _date_range(_padded(dtp.parts)) if dtp is not None else ('', '')
+            professional = sv.tag == 'SV1'
+            line_cols['claim_index'].append(index)
+            line_cols['line_number'].append(_padded(lx.parts)[1] if lx is not None else str(number))
+            line_cols['service_tag'].append(sv.tag)
+            line_cols['revenue_code'].append('' if professional else parts[1])
+            line_cols['procedure_qualifier'].append(procedure[0])
+            line_cols['procedure_code'].append(procedure[1])
+            for n in range(MODIFIER_COUNT):
+                modifiers[n].append(procedure[n + 2])
+            line_cols['charge'].append(parts[charge_at])
+            line_cols['unit_basis'].append(parts[basis_at])
+            line_cols['units'].append(parts[units_at])
+            line_cols['place_of_service'].append(parts[5] if professional else '')
+            line_cols['diagnosis_pointers'].append(parts[7] if professional else '')
+            line_cols['service_date_from'].append(start)
+            line_cols['service_date_to'].append(end)
+
+    lines = pd.DataFrame({
+        'claim_index': np.asarray(line_cols['claim_index'], dtype=np.int32),
+        'line_number': pd.to_numeric(pd.Series(line_cols['line_number'], dtype=object),
+                                     errors='coerce').fillna(0).to_numpy(dtype=np.int32),
+        'service_tag': _codes(line_cols['service_tag']),
+        'revenue_code': _codes(line_cols['revenue_code']),
+        'procedure_qualifier': _codes(line_cols['procedure_qualifier']),
+        'procedure_code': _codes(line_cols['procedure_code']),
+        **{f'modifier_{n + 1}': _codes(modifiers[n]) for n in range(MODIFIER_COUNT)},
+        'charge': _numbers(line_cols['charge']),
+        'unit_basis': _codes(line_cols['unit_basis']),
+        'units': _numbers(line_cols['units']),
+        'place_of_service': _codes(line_cols['place_of_service']),
+        'diagnosis_pointers': _codes(line_cols['diagnosis_pointers']),
+        'service_date_from': _dates(line_cols['service_date_from']),
+        'service_date_to': _dates(line_cols['service_date_to']),
+    })
+
+    count = len(claim_cols['claim_id'])
+    width = max(map(len, diagnoses), default=0)
+    charges = np.zeros(count)
+    np.add.at(charges, lines['claim_index'].to_numpy(), np.nan_to_num(lines['charge'].to_numpy()))
+    claims = pd.DataFrame({
+        'claim_index': np.arange(count, dtype=np.int32),
+        'claim_id': pd.array(claim_cols['claim_id'], dtype='string'),
+        'amount': _numbers(claim_cols['amount']),
+        'place_of_service': _codes(claim_cols['place_of_service']),
+        'facility_qualifier': _codes(claim_cols['facility_qualifier']),
+        'frequency': _codes(claim_cols['frequency']),
+        'claim_type': _codes(claim_cols['claim_type']),
+        'line_count': np.asarray(claim_cols['line_count'], dtype=np.int32),
+        'line_charge_total': charges,
+        'service_date_from': _dates(claim_cols['service_date_from']),
+        'service_date_to': _dates(claim_cols['service_date_to']),
+        'diagnosis_qualifier': _codes(claim_cols['diagnosis_qualifier']),
+        **{f'diagnosis_{n + 1}': _codes([codes[n] if len(codes) > n else '' for codes in diagnoses])
+           for n in range(width)},
+    })
+    logger.info(f"Built claim tables: {len(claims)} claims, {len(lines)} service lines")
+    return ClaimTables(claims, lines)
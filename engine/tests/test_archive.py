@@ -0,0 +1,60 @@
+from pathlib import Path
+import gzip
+import io
+import sys
+import tarfile
+import zipfile
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.archive import archive_kind, iter_members, parse_archive
+from engine.batch import validate_archive, validate_batch
+from engine.parser import parse_837
+from engine.rules_engine import load_rules
+
+SAMPLES = ['sample_837_prof.txt', 'sample_837_inst.txt', 'sample_837_mixed_big.txt']
+
+
+def _zip() -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('drop/', '')
+        for name in SAMPLES:
+            archive.write(ROOT / 'samples' / name, f'drop/{name}')
+    return buf.getvalue()
+
+
+def _tar_gz() -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+        for name in SAMPLES:
+            archive.add(ROOT / 'samples' / name, name)
+    return buf.getvalue()
+
+
+def test_members_stream_out_of_each_archive_kind(tmp_path):
+    sample = ROOT / 'samples' / 'sample_837_prof.txt'
+    gz = tmp_path / 'sample_837_prof.txt.gz'
+    gz.write_bytes(gzip.compress(sample.read_bytes()))
+    assert archive_kind(sample) is None
+    assert [archive_kind(s) for s in (_zip(), _tar_gz(), gz)] == ['zip', 'tar', 'gzip']
+    assert [name for name, _ in iter_members(_zip())] == [f'drop/{name}' for name in SAMPLES]
+    assert [name for name, _ in iter_members(gz)] == ['sample_837_prof.txt']
+
+    parsed = parse_archive(_tar_gz())
+    assert [m['name'] for m in parsed['members']] == SAMPLES
+    for member, name in zip(parsed['members'], SAMPLES):
+        whole = parse_837((ROOT / 'samples' / name).read_bytes())
+        assert [c.as_dict() for c in member['claims']] == [c.as_dict() for c in whole['claims']]
+        assert member['decoding'] == whole['decoding']
+
+
+def test_pooled_archive_validation_matches_each_file():
+    rules = load_rules('dhcs_comprehensive')
+    expected = [validate_batch(ROOT / 'samples' / name, rules, workers=1)['transactions'] for name in SAMPLES]
+    for content in (_zip(), _tar_gz()):
+        result = validate_archive(content, rules, workers=2)
+        assert [m['transactions'] for m in result['members']] == expected
+        assert result['claim_count'] == sum(t['claim_count'] for ts in expected for t in ts)
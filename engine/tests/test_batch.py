@@ -0,0 +1,39 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.batch import validate_batch
+from engine.parser import parse_837
+from engine.rules_engine import evaluate_rules, load_rules
+
+SAMPLE = ROOT / 'samples' / 'sample_837_mixed_big.txt'
+
+
+def test_sharded_pool_matches_single_process():
+    rules = load_rules('dhcs_comprehensive')
+    whole = validate_batch(SAMPLE, rules, workers=1)
+    # three interchanges back to back, cut into many small shards
+    sharded = validate_batch(SAMPLE.read_bytes() * 3, rules, workers=2, shard_size=1000)
+    assert whole['claim_count'] == 100
+    assert sharded['shard_count'] > 3
+    assert sharded['transactions'] == whole['transactions'] * 3
+    # a str is 837 text, not a path
+    text = validate_batch(SAMPLE.read_text(encoding='utf-8') * 3, rules, workers=1, shard_size=1000)
+    assert text == sharded
+
+
+def test_shards_report_envelope_errors_of_their_transaction_sets():
+    rules = load_rules('dhcs_comprehensive')
+    raw = (ROOT / 'samples' / '837_5errs.txt').read_bytes()
+    # a bad SE01 is caught by the worker, a bad IEA01 by the parent
+    fixed = raw.replace(b'SE*45*', b'SE*34*')
+    cases = ((raw, ['ENVELOPE-SEGMENT-COUNT']), (fixed, []), (fixed.replace(b'IEA*1*', b'IEA*2*'), ['ENVELOPE-COUNTS']))
+    for body, envelope_rules in cases:
+        expected = evaluate_rules(parse_837(body), rules)
+        assert [e['issue_type'] for e in expected if e['issue_type'].startswith('ENVELOPE-')] == envelope_rules
+        sharded = validate_batch(body * 3, rules, workers=1, shard_size=100)
+        assert sharded['shard_count'] == 3
+        assert [t['findings'] for t in sharded['transactions']] == [expected] * 3
@@ -0,0 +1,45 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.cache import CACHE_DIR_ENV, ResultCache, cache_key, shared_cache
+from engine.model import analyze_837
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_key_covers_content_and_ruleset_version():
+    assert cache_key('analysis', 'ISA*', 'v1') == cache_key('analysis', b'ISA*', 'v1')
+    assert cache_key('analysis', 'ISA*', 'v1') != cache_key('analysis', 'ISA*', 'v2')
+    assert cache_key('analysis', 'ISA*', 'v1') != cache_key('analysis', 'ISA~', 'v1')
+
+
+def test_repeat_analysis_is_served_from_disk(tmp_path):
+    raw = ROOT.joinpath('samples', 'sample_837_mixed_big.txt').read_bytes()
+    parsed, result = analyze_837(raw, ResultCache(directory=str(tmp_path)))
+    fresh = ResultCache(directory=str(tmp_path))
+    again = analyze_837(raw, fresh)
+    assert fresh.hits == 1 and fresh.misses == 0
+    assert again[1] == result
+    assert [c['CLM'] for c in again[0]['claims']] == [c['CLM'] for c in parsed['claims']]
+
+
+def test_shared_cache_uses_the_directory_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv(CACHE_DIR_ENV, raising=False)
+    assert shared_cache().directory is None
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / 'results'))
+    shared_cache().put('a', 1)
+    fresh = shared_cache()
+    assert fresh.directory == str(tmp_path / 'results')
+    assert fresh.get('a') == 1 and fresh.hits == 1
@@ -0,0 +1,59 @@
+from pathlib import Path
+import codecs
+import io
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.decoding import sniff_encoding
+from engine.parser import decode_stream, parse_837
+from engine.persist import load_parsed, save_parsed
+from engine.rules_engine import evaluate_rules, load_rules
+
+SAMPLE = ROOT.joinpath('samples', 'sample_837_prof.txt').read_text(encoding='utf-8')
+ACCENTED = SAMPLE.replace('PROVIDER NAME', 'CLÍNICA MÉDICA')
+
+
+def _provider(parsed):
+    return parsed['claims'][0].find('NM1', '85')['parts'][3]
+
+
+def test_encoding_is_sniffed_from_bom_and_isa():
+    assert sniff_encoding(ACCENTED.encode('utf-8')) == ('utf-8', b'')
+    assert sniff_encoding(ACCENTED.encode('latin-1')) == ('latin-1', b'')
+    assert sniff_encoding(codecs.BOM_UTF8 + b'ISA*') == ('utf-8', codecs.BOM_UTF8)
+    assert sniff_encoding(ACCENTED.encode('utf-16-le')) == ('utf-16-le', b'')
+    for encoding in ('latin-1', 'utf-8-sig', 'utf-16'):
+        parsed = parse_837(ACCENTED.encode(encoding))
+        assert _provider(parsed) == 'CLÍNICA MÉDICA', encoding
+        assert parsed['decoding']['replaced'] == 0
+        assert parsed['delimiters'].element == '*'
+
+
+def test_replaced_bytes_are_reported_as_findings(tmp_path):
+    # a stray latin-1 byte past the bytes the encoding is sniffed from
+    filler = ROOT.joinpath('samples', 'sample_837_mixed_big.txt').read_bytes() * 3
+    head, _, tail = filler.rpartition(b'CLM*CLM100*')
+    raw = ACCENTED.encode('utf-8') + head + b'CLM*CLM\xe9*' + tail
+    parsed = parse_837(io.BytesIO(raw))
+    assert parsed['decoding']['encoding'] == 'utf-8'
+    assert parsed['decoding']['replaced'] == 1
+    assert [c['CLM'][1] for c in parsed['claims']].count('CLM\ufffd') == 1
+    assert _provider(parsed) == 'CLÍNICA MÉDICA'
+    rule = {'id': 'ENC', 'conditions': [{'type': 'decoding_clean', 'value': False}]}
+    assert [f['issue_type'] for f in evaluate_rules(parsed, [rule])] == ['ENC']
+    assert evaluate_rules(parse_837(ACCENTED.encode('utf-8')), [rule]) == []
+    # the shipped rule runs through load_rules, and on a saved batch
+    path = tmp_path / 'batch.e837'
+    save_parsed(parsed, path)
+    assert load_parsed(path)['decoding'] == parsed['decoding']
+    for doc in (parsed, load_parsed(path)):
+        assert 'ENCODING-REPLACED-BYTES' in [f['issue_type'] for f in evaluate_rules(doc, load_rules('dhcs_comprehensive'))]
+
+
+def test_stream_reads_in_chunks():
+    stream = decode_stream(ACCENTED.encode('latin-1'), chunk_size=16)
+    pieces = iter(lambda: stream.read(7), '')
+    assert ''.join(pieces) == ACCENTED
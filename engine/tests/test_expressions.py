@@ -0,0 +1,36 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.expressions import ExpressionError, Scope, compile_expression, load_ruleset
+from engine.parser import parse_837
+from engine.rules_engine import evaluate_claims, evaluate_rules
+
+
+def test_conditions_compile_to_cached_whitelisted_closures():
+    claim = parse_837((ROOT / 'samples' / 'sample_837_prof.txt').read_bytes())['claims'][0]
+    scope = Scope(claim, ':', {'npi': '12345', 'codes': ['99213']})
+    expr = compile_expression('clm05_1 is null')
+    assert compile_expression('clm05_1 is null') is expr
+    assert expr.elements == {'clm05_1'} and not expr.names
+    assert compile_expression('clm05_1')(scope) == claim.clm[5].split(':')[0]
+    assert compile_expression('st01 == "837" and sv101_2 in codes')(scope) is (claim.find('SV1')['parts'][1].split(':')[1] == '99213')
+    assert compile_expression('len(npi) != 10 or not npi.isdigit()').holds(scope)
+    assert not compile_expression('clm01 < 5').holds(scope)
+    for text in ("__import__('os')", 'npi.__class__', "open('x')", 'npi.format()', '[c for c in codes]', 'clm01 +'):
+        with pytest.raises(ExpressionError):
+            compile_expression(text)
+
+
+def test_ruleset_runs_through_the_rules_engine():
+    parsed = parse_837((ROOT / 'samples' / 'sample_837_prof.txt').read_bytes())
+    rules = load_ruleset()
+    assert [f['issue_type'] for f in evaluate_rules(parsed, rules)] == ['R2001']
+    rules = load_ruleset(variables={'npi': '123', 'taxonomy': None})
+    assert [f['issue_type'] for f in evaluate_rules(parsed, rules)] == ['R2001', 'R4001', 'R4002']
+    assert evaluate_claims(parsed, rules)['claims'][0]['rules'] == ['R2001', 'R4001', 'R4002']
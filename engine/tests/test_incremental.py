@@ -0,0 +1,48 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.incremental import IncrementalDocument
+from engine.parser import parse_837
+from engine.rules_engine import load_rules, evaluate_rules
+
+SAMPLE = ROOT.joinpath('samples', 'sample_837_mixed_big.txt').read_text(encoding='utf-8')
+
+
+def _claims(parsed):
+    return [[s.raw for s in c.segments] for c in parsed['claims']]
+
+
+def test_claim_edits_are_spliced_and_revalidated():
+    rules = load_rules('dhcs_comprehensive')
+    doc = IncrementalDocument(SAMPLE, rules)
+    before = doc.parsed
+    clm = SAMPLE.index('CLM*CLM50*')
+    dtp = SAMPLE.index('DTP', clm)
+    edits = [
+        SAMPLE[:dtp] + 'HI*ABK:Z23~\n' + SAMPLE[dtp:],                                   # add a segment
+        SAMPLE[:clm] + 'CLM*CLM50*0' + SAMPLE[clm + 13:],                                # change an element
+        SAMPLE[:clm] + 'CLM*NEW*10~\nSV1*HC:99213*10~\n' + SAMPLE[clm:],                 # insert a claim
+    ]
+    for edited in edits:
+        parsed = doc.update(edited)
+        full = parse_837(edited)
+        assert doc.changed is not None and doc.changed[0] == 49
+        assert _claims(parsed) == _claims(full)
+        assert parsed['tag_index'] == full['tag_index']
+        assert parsed['envelope'] == full['envelope']
+        assert doc.findings == evaluate_rules(full, rules)
+    # the original parse is left untouched and unchanged claims are shared
+    assert len(before['claims']) == 100
+    assert doc.parsed['claims'][0] is before['claims'][0]
+
+
+def test_edits_outside_claims_reparse_everything():
+    doc = IncrementalDocument(SAMPLE)
+    edited = SAMPLE.replace('HL*2*1*22*0~', 'HL*2*1*23*0~', 1)
+    parsed = doc.update(edited)
+    assert doc.changed is None
+    assert parsed['claims'][0].patient is not None
@@ -0,0 +1,55 @@
+from pathlib import Path
+import gzip
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+pytest.importorskip('fastapi')
+pytest.importorskip('multipart')
+from fastapi.testclient import TestClient
+
+from engine import archive
+from engine.main import app
+from engine.rules_engine import load_rules
+
+
+def _upload(client, path, content, **params):
+    response = client.post(path, params=params, files={'file': ('claims.837', content)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_endpoints_parse_predict_and_profile_uploads(monkeypatch):
+    client = TestClient(app)
+    assert client.get('/health').json() == {'status': 'ok'}
+    raw = (ROOT / 'samples' / 'sample_837_prof.txt').read_bytes()
+
+    parsed = _upload(client, '/parse', raw)
+    assert len(parsed['claims']) == 1 and parsed['decoding']['encoding'] == 'utf-8'
+
+    predicted = _upload(client, '/predict', raw)
+    assert predicted['issues'] and predicted['issues'][0]['issue_type'] != 'Processing Error'
+    assert predicted['ruleset_version'] == load_rules('dhcs_comprehensive').version
+    members = _upload(client, '/predict', gzip.compress(raw))
+    assert members['archive'] == 'gzip' and members['members'][0]['issues'] == predicted['issues']
+
+    # archives are parsed in the request's process, without a worker pool
+    monkeypatch.setattr(archive, 'ProcessPoolExecutor', None)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as drop:
+        drop.writestr('a.837', raw)
+        drop.writestr('b.837', raw)
+    archived = _upload(client, '/parse', buf.getvalue())
+    assert archived['archive'] == 'zip' and [m['claims'] for m in archived['members']] == [parsed['claims']] * 2
+
+    profile = _upload(client, '/profile', raw, scope='dhcs')
+    assert profile['ruleset_version'] == load_rules('dhcs').version
+    assert profile['rules'] and all(r['evaluations'] == 1 for r in profile['rules'])
@@ -0,0 +1,30 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.model import dhcs_applies, predict_denial
+from engine.parser import parse_837
+
+
+def test_dhcs_applied_reads_addresses_and_payer_names():
+    # the California addresses sit in the 2010AA/2010BA loops above the claims
+    raw = (ROOT / 'samples' / '837_5errs.txt').read_text()
+    assert dhcs_applies(parse_837(raw))
+    assert predict_denial(raw, parse_837(raw))['dhcs_applied']
+    assert not dhcs_applies(parse_837(raw.replace('*CA*', '*NV*')))
+    prof = (ROOT / 'samples' / 'sample_837_prof.txt').read_text()
+    parsed = parse_837(prof)
+    assert not dhcs_applies(parsed) and not predict_denial(prof, parsed)['dhcs_applied']
+    assert dhcs_applies({'claims': [{'segments': [{'tag': 'NM1', 'parts': ['NM1', 'PR', '2', 'MEDI-CAL']}]}]})
+
+
+def test_failed_prediction_keeps_the_result_shape(tmp_path):
+    raw = (ROOT / 'samples' / 'sample_837_prof.txt').read_text()
+    result = predict_denial(raw, parse_837(raw))
+    failed = predict_denial(raw, tmp_path / 'missing.e837')
+    assert failed['issues'][0]['issue_type'] == 'Processing Error'
+    assert failed.keys() == result.keys()
+    assert (failed['claim_issues'], failed['ruleset_version']) == ([], '')
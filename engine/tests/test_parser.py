@@ -0,0 +1,117 @@
+import io
+import json
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.adapters import SHAPES
+from engine.parser import (Delimiters, detect_delimiters, detect_transaction_type, iter_claims, parse_837, parse_837_file,
+                           split_segments)
+
+
+def test_iter_claims_handles_segments_split_across_chunks():
+    sample = ROOT.joinpath('samples','sample_837_mixed_big.txt').read_text(encoding='utf-8')
+    whole = parse_837(sample)
+    # a tiny chunk size forces terminators to straddle chunk boundaries
+    streamed = [claim for _, claim in iter_claims(io.StringIO(sample), chunk_size=7)]
+    assert [c.as_dict() for c in streamed] == [c.as_dict() for c in whole['claims']]
+    assert len(streamed) == 100
+
+
+def test_iter_claims_yields_envelope_context():
+    sample = ROOT.joinpath('samples','sample_837_prof.txt').read_text(encoding='utf-8')
+    envelope, claim = next(iter_claims(io.StringIO(sample)))
+    assert envelope['ST'][:2] == ['ST', '837']
+    assert envelope['GS'][8] == '005010X222'
+    assert claim['CLM'][1] == '10001'
+
+
+def test_delimiters_are_read_from_isa_header():
+    sample = ROOT.joinpath('samples','sample_837_prof.txt').read_text(encoding='utf-8')
+    # trading-partner style: `|` elements, `^` components, `{` repetition
+    partner = sample.replace('*^*', '*{*').replace('*', '|').replace(':', '^')
+    assert detect_delimiters(partner) == Delimiters('|', '^', '{', '~')
+    parsed = parse_837(partner)
+    assert parsed['transaction_type'] == 'professional'
+    assert parsed['claims'][0]['CLM'][:3] == ['CLM', '10001', '150']
+
+
+def test_file_mode_matches_text_mode_and_decodes_lazily():
+    path = ROOT.joinpath('samples','sample_837_mixed_big.txt')
+    mapped = parse_837_file(str(path))
+    assert mapped['claims'][0]['CLM'][2] == '250'
+    # segments the parser does not read stay undecoded bytes until accessed
+    dtp = next(s for s in mapped['claims'][0].segments if s.tag == 'DTP')
+    assert isinstance(dtp._data, bytes)
+    assert dtp['parts'] is dtp['parts'] and dtp._data is dtp['parts']
+    # once split, the parts stand in for the raw bytes
+    assert dtp.raw == next(s.strip() for s in path.read_bytes().split(b'~') if s.strip().startswith(b'DTP*'))
+    text = parse_837(path.read_text(encoding='utf-8'))
+    assert [c.as_dict() for c in mapped.pop('claims')] == [c.as_dict() for c in text.pop('claims')]
+    assert mapped == text
+
+
+def test_claims_keep_the_dict_shape():
+    sample = ROOT.joinpath('samples','sample_837_prof.txt').read_text(encoding='utf-8')
+    claim = parse_837(sample)['claims'][0]
+    assert [s['tag'] for s in claim['segments']].count('CLM') == 1
+    assert claim.get('service_lines') == [['SV1', 'HC:99213', '150', 'UN', '1', '', '', '1']]
+    assert claim.get('diagnosis') == [['HI', 'ABK:Z23']]
+    assert json.loads(json.dumps(claim.as_dict())) == dict(claim)
+
+
+def test_claims_compare_by_identity():
+    sample = ROOT.joinpath('samples','sample_837_prof.txt').read_text(encoding='utf-8')
+    claim, again = parse_837(sample)['claims'][0], parse_837(sample)['claims'][0]
+    # equal content from two parses is still two claims, and both can be hashed
+    assert claim == claim and claim != again and claim != claim.as_dict()
+    assert claim.as_dict() == again.as_dict()
+    assert len({claim, again, claim}) == 2
+    assert {claim: 'first'}[claim] == 'first'
+
+
+def test_loop_tree_attaches_provider_and_subscriber_to_their_claim():
+    sample = ROOT.joinpath('samples','sample_837_mixed_big.txt').read_text(encoding='utf-8')
+    claims = parse_837(sample)['claims']
+    first, second = claims[0], claims[1]
+    # the next transaction's header and HL loops no longer leak into the claim
+    assert [s['tag'] for s in first['segments']] == ['CLM', 'SV1', 'DTP']
+    assert second.billing_provider.find('NM1', '85')['parts'][3] == 'GOOD CLINIC'
+    assert second.subscriber.find('NM1', 'IL')['parts'][3] == 'DOE'
+    assert second.subscriber.parent is second.billing_provider
+    assert second.transaction.find('ST')['parts'][:2] == ['ST', '837']
+    assert first.transaction is not second.transaction
+
+
+def test_adapter_shapes_share_the_core():
+    raw = ROOT.joinpath('samples', 'sample_837_mixed_big.txt').read_bytes()
+    outputs = {shape: parse(raw) for shape, parse in SHAPES.items()}
+    clms = {shape: [list(c['CLM']) for c in out['claims']] for shape, out in outputs.items()}
+    assert clms['engine'] == clms['runner'] == clms['backend']
+    assert outputs['backend'] == SHAPES['backend'](raw.decode('utf-8'))
+    assert outputs['runner']['claims'][0]['segments'][0] == {'tag': 'CLM', 'parts': clms['runner'][0]}
+    # every shape, and the segment-list helpers, detect the type the same way
+    kinds = {out['transaction_type'] for out in outputs.values()}
+    assert kinds == {detect_transaction_type(split_segments(raw.decode('utf-8')))}
+
+
+def test_envelope_counts_and_control_numbers_are_checked():
+    sample = ROOT.joinpath('samples', 'sample_837_mixed_big.txt').read_text(encoding='utf-8')
+    envelope = parse_837(sample)['envelope']
+    assert (envelope['interchanges'], envelope['groups'], envelope['transactions']) == (1, 1, 100)
+    assert envelope['valid_headers'] == 100
+    # every ST..SE holds 12 segments but declares 15, and GE01 says 1 of 100
+    checks = [e['check'] for e in envelope['errors']]
+    assert checks == ['SE01'] * 100 + ['GE01']
+    assert envelope['errors'][0]['expected'] == '12'
+    fixed = sample.replace('SE*15*', 'SE*12*').replace('GE*1*1~', 'GE*100*1~')
+    assert parse_837(fixed)['envelope']['errors'] == []
+    broken = fixed.replace('SE*12*0001~', 'SE*12*0002~', 1).rsplit('IEA', 1)[0]
+    assert [e['check'] for e in parse_837(broken)['envelope']['errors']] == ['SE02', 'IEA']
+    # an empty GS06 is reported as an empty control number
+    unnumbered = fixed.replace('*1253*1*X*', '*1253**X*').replace('GE*100*1~', 'GE*99*~')
+    [error] = parse_837(unnumbered)['envelope']['errors']
+    assert (error['check'], error['control_number'], error['expected']) == ('GE01', '', '100')
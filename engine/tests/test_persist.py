@@ -0,0 +1,50 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+import pytest
+
+from engine.model import predict_denial
+from engine.parser import parse_837
+from engine.persist import PersistedFormatError, is_persisted, load_parsed, save_parsed
+from engine.rules_engine import evaluate_rules, load_rules
+
+SAMPLE = ROOT.joinpath('samples', 'sample_837_mixed_big.txt')
+
+
+def test_saved_batch_loads_back_lazily(tmp_path):
+    parsed = parse_837(SAMPLE.read_text(encoding='utf-8'))
+    path = tmp_path / 'batch.e837'
+    save_parsed(parsed, path)
+    assert is_persisted(path) and not is_persisted(SAMPLE)
+
+    loaded = load_parsed(path)
+    claims = loaded['claims']
+    second = claims[1]
+    assert second.subscriber.find('NM1', 'IL')['parts'][3] == 'DOE'
+    assert second.transaction.segment_count == parsed['claims'][1].transaction.segment_count
+    assert claims[0].transaction is not second.transaction
+    assert claims._claims[5] is None
+    assert [c.as_dict() for c in claims] == [c.as_dict() for c in parsed['claims']]
+    assert loaded['tag_index'] == parsed['tag_index']
+    assert loaded['envelope'] == parsed['envelope']
+
+
+def test_rules_run_on_saved_counts(tmp_path):
+    parsed = parse_837(SAMPLE.read_bytes())
+    path = tmp_path / 'batch.e837'
+    save_parsed(parsed, path)
+    rules = load_rules('dhcs_comprehensive')
+    loaded = load_parsed(path)
+    assert evaluate_rules(loaded, rules) == evaluate_rules(parsed, rules)
+    # the saved fact counts answer the claim scans without building claims
+    assert all(c is None for c in loaded['claims']._claims)
+    assert predict_denial('', str(path))['issues'] == evaluate_rules(parsed, rules)
+
+
+def test_other_files_are_rejected(tmp_path):
+    with pytest.raises(PersistedFormatError):
+        load_parsed(SAMPLE)
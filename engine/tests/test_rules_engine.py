@@ -0,0 +1,225 @@
+from pathlib import Path
+import json
+import os
+import pickle
+import sys
+import time
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.parser import parse_837
+from engine import rules_engine
+from engine.model import compute_summary
+from engine.rules_engine import (ConditionStats, RuleProfile, RuleRegistry, RuleSet, load_rules, evaluate_claims,
+                                  evaluate_rules, read_ruleset)
+
+SAMPLES = ['sample_837_prof.txt', 'sample_837_inst.txt', 'sample_837_mixed_big.txt', '837_5errs.txt']
+
+
+def _parse(name):
+    return parse_837(ROOT.joinpath('samples', name).read_text(encoding='utf-8'))
+
+
+def test_indexed_claims_match_plain_dict_scan():
+    # the plain copies below carry no loop tree or envelope, so only the
+    # segment-level dhcs rules answer the same for both
+    rules = load_rules('dhcs')
+    for name in SAMPLES:
+        parsed = _parse(name)
+        # plain dicts without a tag index take the scanning path
+        plain = {'claims': [c.as_dict() for c in parsed['claims']], 'transaction_type': parsed['transaction_type']}
+        assert evaluate_rules(parsed, rules) == evaluate_rules(plain, rules), name
+
+
+CLEAN_837 = '~'.join([
+    'ISA*00*          *00*          *ZZ*SUBMITTER      *ZZ*RECEIVER       *250101*1253*^*00501*000000001*0*P*:',
+    'GS*HC*SENDER*RECEIVER*20250101*1253*1*X*005010X222A1', 'ST*837*0001', 'BHT*0019*00*0123*20250101*1253*CH',
+    'HL*1**20*1', 'NM1*85*2*GOOD CLINIC*****XX*1234567893', 'N4*SACRAMENTO*CA*95814',
+    'HL*2*1*22*0', 'NM1*IL*1*DOE*JOHN****MI*123456789', 'DMG*D8*19800101*M',
+    'CLM*CLM1*150***11:B:1*Y*A*Y*Y', 'HI*ABK:Z23', 'LX*1', 'SV1*HC:99213*150*UN*1***1', 'DTP*472*D8*20241215',
+    'SE*14*0001', 'GE*1*1', 'IEA*1*000000001']) + '~'
+
+
+def test_comprehensive_rules_report_failed_checks_only():
+    rules = load_rules('dhcs_comprehensive')
+    parsed = parse_837(CLEAN_837)
+    assert [f['issue_type'] for f in evaluate_rules(parsed, rules)] == ['DHCS-TXN-PROFESSIONAL']
+    assert not [f for f in evaluate_claims(parsed, rules)['findings'] if f['severity'] == 'Critical']
+    # a malformed NPI and a claim without service lines are reported
+    broken = parse_837(CLEAN_837.replace('1234567893', '12345').replace('SV1*HC:99213*150*UN*1***1~', 'NTE*ADD*X~'))
+    found = [f['issue_type'] for f in evaluate_rules(broken, rules)]
+    assert 'NPI-VALIDITY' in found and 'SERVICE-LINE-EXISTS' in found and 'PROVIDER-IDENTIFICATION' not in found
+
+
+def test_comprehensive_scope_loads_envelope_rules():
+    rules = load_rules('dhcs_comprehensive')
+    ids = [r['id'] for r in rules]
+    assert 'ENVELOPE-SEGMENT-COUNT' in ids and 'ENCODING-REPLACED-BYTES' in ids
+    raw = ROOT.joinpath('samples', '837_5errs.txt').read_text(encoding='utf-8')
+    found = [f['issue_type'] for f in evaluate_rules(parse_837(raw), rules)]
+    assert 'ENVELOPE-SEGMENT-COUNT' in found
+    found = [f['issue_type'] for f in evaluate_rules(parse_837(raw.replace('SE*45*', 'SE*34*')), rules)]
+    assert not [i for i in found if i.startswith('ENVELOPE-')]
+
+
+def test_loop_tree_context_passes_header_provider_and_subscriber_checks():
+    # valid samples name their ST header, provider and subscriber in the
+    # claims' ST and 2000A/B loops, so these checks hold for every claim
+    checks = ['transaction_header_valid', 'provider_identified', 'subscriber_identified']
+    rules = RuleSet([{'id': typ, 'conditions': [{'type': typ}]} for typ in checks])
+    for name in SAMPLES:
+        parsed = _parse(name)
+        assert [f['issue_type'] for f in evaluate_rules(parsed, rules)] == checks, name
+        result = evaluate_claims(parsed, rules)
+        assert [c['rules'] for c in result['claims']] == [checks] * len(parsed['claims']), name
+    # the claim segments alone of 837_5errs hold none of them
+    parsed = _parse('837_5errs.txt')
+    plain = {'claims': [c.as_dict() for c in parsed['claims']], 'transaction_type': parsed['transaction_type']}
+    assert evaluate_rules(plain, rules) == []
+
+
+def test_document_tag_index_points_at_claims():
+    parsed = _parse('sample_837_mixed_big.txt')
+    assert parsed['tag_index']['CLM'] == list(range(100))
+    assert 'HI' not in parsed['tag_index']
+
+
+def test_compiled_ruleset_matches_plain_rules():
+    rules = load_rules('dhcs_comprehensive')
+    assert isinstance(rules, RuleSet) and len(rules.plans) == len(rules)
+    negated = [{'id': 'NO-HI', 'conditions': [{'type': 'claim_has_segment', 'segment': 'HI', 'value': False},
+                                              {'type': 'not_a_condition'}]}]
+    restored = pickle.loads(pickle.dumps(rules))
+    for name in SAMPLES:
+        parsed = _parse(name)
+        assert evaluate_rules(parsed, rules) == evaluate_rules(parsed, list(rules)) == evaluate_rules(parsed, restored)
+        assert evaluate_rules(parsed, negated) == ([] if 'HI' in parsed['tag_index'] else [
+            {'issue_type': 'NO-HI', 'severity': 'Medium', 'why_failed': None, 'what_to_fix': None, 'reference': 'NO-HI'}])
+
+
+def test_shared_conditions_run_once_per_document(monkeypatch):
+    parsed = _parse('sample_837_mixed_big.txt')
+    plain = {'claims': [c.as_dict() for c in parsed['claims']], 'transaction_type': parsed['transaction_type']}
+    calls = []
+    test = rules_engine.CLAIM_FACTS['diagnosis_present']
+    monkeypatch.setitem(rules_engine.CLAIM_FACTS, 'diagnosis_present', lambda c: calls.append(c) or test(c))
+    rules = [{'id': f'R{i}', 'conditions': [{'type': 'diagnosis_present', 'value': i % 2 == 0},
+                                            {'type': 'claim_missing_segment', 'segment': 'HI'}]}
+             for i in range(10)]
+    rules.append({'id': 'HAS-HI', 'conditions': [{'type': 'claim_has_segment', 'segment': 'HI', 'value': False}]})
+    findings = evaluate_rules(plain, rules)
+    single = len(calls)
+    calls.clear()
+    evaluate_rules(plain, rules[:1])
+    assert single == len(calls) == len(plain['claims'])
+    # the sample has no diagnoses, so the rules expecting none match
+    assert [f['issue_type'] for f in findings] == [f'R{i}' for i in range(1, 10, 2)] + ['HAS-HI']
+
+
+def test_per_claim_evaluation_flags_only_failing_claims():
+    text = ''.join(ROOT.joinpath('samples', name).read_text(encoding='utf-8')
+                   for name in ('sample_837_prof.txt', 'sample_837_mixed_big.txt'))
+    parsed = parse_837(text)
+    rules = [{'id': 'NO-DX', 'severity': 'high', 'conditions': [{'type': 'diagnosis_present', 'value': False}]},
+             {'id': 'INST', 'conditions': [{'type': 'txn_is', 'value': 'institutional'}]}]
+    result = evaluate_claims(parsed, rules)
+    # only the first claim carries diagnoses
+    assert result['total_claims'] == 101 and result['invalid_claims'] == 100
+    assert result['invalid_percentage'] == round(100 * 100 / 101, 2)
+    assert result['claims'][0] == {'claim_index': 1, 'claim_id': 'CLM1', 'rules': ['NO-DX'], 'high_risk_issues': 1}
+    assert [f['claim_index'] for f in result['findings']] == list(range(1, 101))
+    assert compute_summary(result['findings'], parsed, result)['estimated_rework_cost'] == 100 * 75
+
+
+def test_conditions_are_reordered_by_recorded_stats(tmp_path):
+    parsed = _parse('sample_837_mixed_big.txt')
+    rules = RuleSet([{'id': f'R{i}', 'conditions': [
+        {'type': 'subscriber_identified'}, {'type': 'claim_has_segment', 'segment': f'X{i}'},
+        {'type': 'txn_is', 'value': 'institutional'}]} for i in range(5)])
+    expected = evaluate_claims(parsed, rules)
+    stats = ConditionStats()
+    assert evaluate_claims(parsed, rules, stats) == expected
+    path = tmp_path / 'stats.json'
+    stats.save(str(path))
+    rules.reorder(ConditionStats.load(str(path)))
+    # the professional sample never matches, so txn_is rejects every rule first
+    assert [step[0] for step in rules.plans[0].steps][0] == ('txn_is', 'institutional')
+    assert evaluate_claims(parsed, rules) == expected
+
+    # counters with no calls rank as unmeasured, steps that never reject last
+    keys = [step[0] for step in rules.plans[0].steps]
+    saved = ConditionStats.load(str(path))
+    saved.counts[keys[0]] = [0, 0, 0.0]
+    saved.counts[keys[1]] = [4, 4, 0.5]
+    assert saved.rank((keys[0], None, False)) == 0.0 and saved.rank((keys[1], None, False)) == float('inf')
+    assert saved.rank((keys[1], None, True)) == 0.5 / 4
+    (tmp_path / 'demo_rules.json').write_text(json.dumps(list(rules)))
+    saved.save(str(tmp_path / 'demo_stats.json'))
+    assert [step[0] for step in read_ruleset('demo', str(tmp_path)).plans[0].steps][-1] == keys[1]
+
+
+def test_registry_swaps_in_edited_rules_in_the_background(tmp_path):
+    parsed = _parse('sample_837_mixed_big.txt')
+    path = tmp_path / 'demo_rules.json'
+    path.write_text(json.dumps([{'id': 'R1', 'severity': 'high', 'conditions': [{'type': 'claim_has_segment', 'segment': 'CLM'}]}]))
+    registry = RuleRegistry(str(tmp_path), interval=0)
+    first = registry.get('demo')
+    assert registry.get('demo') is first
+
+    path.write_text(json.dumps([{'id': 'R2', 'severity': 'high', 'conditions': []}]))
+    os.utime(path, ns=(0, 0))
+    deadline = time.monotonic() + 10
+    while registry.get('demo') is first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second = registry.get('demo')
+    assert [r['id'] for r in second] == ['R2'] and second.version != first.version
+    # rules already handed out are left as they were
+    assert [f['issue_type'] for f in evaluate_rules(parsed, first)] == ['R1']
+    assert evaluate_claims(parsed, second)['ruleset_version'] == second.version
+
+    path.write_text('[not json')
+    os.utime(path, ns=(1, 1))
+    registry.get('demo')
+    deadline = time.monotonic() + 10
+    while registry._loaded['demo'].reloading and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert registry.get('demo') is second
+
+    # neither is a removed file: the previous rules stay
+    path.unlink()
+    registry.get('demo')
+    deadline = time.monotonic() + 10
+    while registry._loaded['demo'].reloading and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert registry.get('demo') is second
+
+    # a rules file that appears later is loaded: first the dhcs fallback,
+    # then the scope's own file
+    for name, rule_id in (('dhcs_rules.json', 'FALLBACK'), ('demo_rules.json', 'OWN')):
+        current = registry.get('demo')
+        (tmp_path / name).write_text(json.dumps([{'id': rule_id, 'severity': 'high', 'conditions': []}]))
+        deadline = time.monotonic() + 10
+        while registry.get('demo') is current and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [r['id'] for r in registry.get('demo')] == [rule_id]
+
+
+def test_profile_counts_rule_and_condition_work():
+    parsed = _parse('sample_837_prof.txt')
+    rules = RuleSet([
+        {'id': 'R1', 'conditions': [{'type': 'txn_is', 'value': 'institutional'}, {'type': 'diagnosis_present'}]},
+        {'id': 'R2', 'conditions': [{'type': 'txn_is', 'value': 'professional'}, {'type': 'diagnosis_present'}]},
+    ])
+    profile = RuleProfile()
+    for _ in range(2):
+        assert evaluate_rules(parsed, rules, profile=profile) == evaluate_rules(parsed, rules)
+    report = profile.as_dict()
+    assert report['documents'] == 2
+    by_id = {r['id']: r for r in report['rules']}
+    assert (by_id['R1']['evaluations'], by_id['R1']['matches'], by_id['R1']['short_circuits']) == (2, 0, 2)
+    assert (by_id['R2']['matches'], by_id['R2']['match_rate'], by_id['R2']['short_circuits']) == (2, 1.0, 0)
+    by_type = {c['type']: c for c in report['conditions']}
+    assert (by_type['txn_is']['calls'], by_type['txn_is']['rejections']) == (4, 2)
+    assert (by_type['diagnosis_present']['calls'], by_type['diagnosis_present']['true_rate']) == (2, 1.0)
@@ -0,0 +1,46 @@
+from pathlib import Path
+import json
+import subprocess
+import sys
+import zipfile
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.parser import parse_837
+from engine.persist import SUFFIX, save_parsed
+
+RUNNER = ROOT / 'src' / 'run_rules.py'
+SAMPLES = ['sample_837_prof.txt', 'sample_837_inst.txt']
+
+
+def _run(path):
+    done = subprocess.run([sys.executable, str(RUNNER), str(path)], capture_output=True, text=True, timeout=120)
+    assert done.returncode == 0, done.stderr
+    return json.loads(done.stdout)
+
+
+def _plain(name):
+    return _run(ROOT / 'samples' / name)
+
+
+def test_runner_checks_text_and_persisted_batches(tmp_path):
+    plain = _plain('sample_837_prof.txt')
+    assert [f['id'] for f in plain['findings']] == ['DHCS-TXN-PROFESSIONAL']
+    persisted = tmp_path / f'sample_837_prof.txt{SUFFIX}'
+    save_parsed(parse_837((ROOT / 'samples' / 'sample_837_prof.txt').read_bytes()), persisted)
+    out = _run(persisted)
+    assert (out['parsed_summary'], out['findings']) == (plain['parsed_summary'], plain['findings'])
+
+
+def test_runner_checks_each_member_of_an_archive(tmp_path):
+    drop = tmp_path / 'drop.zip'
+    with zipfile.ZipFile(drop, 'w') as archive:
+        for name in SAMPLES:
+            archive.write(ROOT / 'samples' / name, name)
+    members = _run(drop)['members']
+    assert [m['member'] for m in members] == SAMPLES
+    for member in members:
+        expected = _plain(member['member'])
+        assert (member['parsed_summary'], member['findings']) == (expected['parsed_summary'], expected['findings'])
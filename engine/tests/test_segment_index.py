@@ -0,0 +1,39 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine.parser import parse_837
+from engine.rules_engine import evaluate_claims, evaluate_rules
+from engine.segment_index import members, segment_index
+from engine.vectorized import evaluate_claims as vectorized_claims
+
+
+def test_qualifier_keys_index_claims_as_bitsets():
+    prof = (ROOT / 'samples' / 'sample_837_prof.txt').read_text()
+    big = (ROOT / 'samples' / 'sample_837_mixed_big.txt').read_text()
+    parsed = parse_837(prof + big + prof.replace('NM1*85', 'NM1*82'))
+    claims = parsed['claims']
+    index = segment_index(parsed)
+    # the index is not part of the parse, so printing a parse stays stable
+    assert 'segment_index' not in parsed and repr(index) == f'SegmentIndex({len(claims)} claims, {len(parsed["tag_index"])} tags)'
+
+    for tag, qualifier in (('NM1', '85'), ('NM1', '82'), ('DTP', '472')):
+        key = f'{tag}*{qualifier}'
+        expected = [i for i, c in enumerate(claims) if c.find(tag, qualifier) is not None]
+        assert expected and members(index.bitset(key)) == expected
+        assert members(index.missing(key)) == [i for i in range(len(claims)) if i not in expected]
+    assert index.bitset('NM1*ZZ') == 0 and not index.has('NM1*ZZ')
+    assert members(index.bitset('CLM')) == list(range(len(claims)))
+
+    key = 'NM1*85'
+    rules = [{'id': 'R1', 'severity': 'high', 'conditions': [{'type': 'claim_missing_segment', 'segment': key}]},
+             {'id': 'R2', 'severity': 'high', 'conditions': [{'type': 'claim_has_segment', 'segment': key}]}]
+    flagged = [c['claim_index'] for c in evaluate_claims(parsed, rules)['claims'] if c['rules'] == ['R1']]
+    assert flagged == members(index.missing(key))
+    assert vectorized_claims(parsed, rules) == evaluate_claims(parsed, rules)
+    assert len(flagged) == len(claims) - 1
+    # document-level: some claim has the key
+    assert [f['issue_type'] for f in evaluate_rules(parsed, rules)] == ['R2']
@@ -0,0 +1,51 @@
+from pathlib import Path
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+import numpy as np
+
+from engine.parser import parse_837
+from engine.table import claim_tables
+
+PROFESSIONAL = (
+    'ISA*00*          *00*          *ZZ*SUBMITTER*ZZ*RECEIVER*251201*1253*^*00501*000000905*0*P*:~'
+    'GS*HC*SENDER*RECEIVER*20251201*1253*1*X*005010X222~ST*837*0001~'
+    'HL*1**20*1~NM1*85*2*GOOD CLINIC*****XX*1234567893~HL*2*1*22*0~NM1*IL*1*DOE*JOHN****MI*123~'
+    'CLM*A1*250.50***11:B:1*Y*A*Y*Y~HI*ABK:Z23*ABF:E119~'
+    'LX*1~SV1*HC:99213:25*150*UN*1*11**1~DTP*472*D8*20241215~'
+    'LX*2~SV1*HC:85025*100.50*UN*2***1:2~DTP*472*RD8*20241216-20241218~'
+    'CLM*A2*abc***21:B:7~SV1*HC:99214*80*UN*1~'
+    'SE*15*0001~GE*1*1~IEA*1*000000905~'
+)
+
+
+def test_claim_and_line_tables_are_typed_columns():
+    for source in (PROFESSIONAL, PROFESSIONAL.encode()):
+        claims, lines = claim_tables(parse_837(source))
+        assert list(claims['claim_id']) == ['A1', 'A2']
+        assert claims['amount'].dtype == np.float64
+        assert claims['amount'][0] == 250.5 and np.isnan(claims['amount'][1])
+        assert list(claims['frequency']) == ['1', '7']
+        assert claims['place_of_service'].dtype == 'category'
+        assert list(claims[['diagnosis_1', 'diagnosis_2']].iloc[0]) == ['Z23', 'E119']
+        assert str(claims['service_date_to'][0].date()) == '2024-12-18'
+        assert list(claims['line_count']) == [2, 1]
+        assert list(claims['line_charge_total']) == [250.5, 80.0]
+
+        assert list(lines['claim_index']) == [0, 0, 1]
+        assert list(lines['procedure_code']) == ['99213', '85025', '99214']
+        assert lines['modifier_1'][0] == '25' and lines['modifier_1'].isna()[1]
+        assert list(lines['units']) == [1.0, 2.0, 1.0]
+        assert lines['place_of_service'][0] == '11'
+        assert str(lines['service_date_from'][1].date()) == '2024-12-16'
+        # whole-column checks replace per-claim loops
+        assert (lines.groupby('claim_index')['charge'].sum() == claims['line_charge_total']).all()
+
+
+def test_empty_parse_gives_empty_tables():
+    claims, lines = claim_tables({'claims': []})
+    assert len(claims) == 0 and len(lines) == 0
+    assert 'procedure_code' in lines.columns
@@ -0,0 +1,34 @@
+from pathlib import Path
+import json
+import sys
+
+# ensure the repo root is importable so `engine` resolves as a package
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT.parent))
+
+from engine import vectorized
+from engine.adapters import parse_837_runner
+from engine.parser import parse_837
+from engine.rules_engine import RuleSet, evaluate_claims, evaluate_rules
+
+SAMPLES = ['sample_837_prof.txt', 'sample_837_inst.txt', 'sample_837_mixed_big.txt', '837_5errs.txt']
+
+RULES = RuleSet(json.loads(ROOT.joinpath('rules', 'dhcs_rules_comprehensive.json').read_text(encoding='utf-8')) + [
+    {'id': 'NO-DX-LINES', 'severity': 'high', 'conditions': [
+        {'type': 'diagnosis_present', 'value': False}, {'type': 'service_line_exists'}]},
+    {'id': 'NO-REF', 'conditions': [{'type': 'claim_missing_segment', 'segment': 'REF'}]},
+])
+
+
+def test_masks_match_scalar_per_claim_evaluation():
+    for name in SAMPLES:
+        raw = ROOT.joinpath('samples', name).read_bytes()
+        for parsed in (parse_837(raw), parse_837(raw, encoding='utf-8'), parse_837_runner(raw)):
+            table = vectorized.fact_table(parsed)
+            assert vectorized.evaluate_claims(parsed, RULES, table) == evaluate_claims(parsed, RULES), name
+            assert vectorized.evaluate_rules(parsed, RULES, table) == evaluate_rules(parsed, RULES), name
+            # a second ruleset reuses the table's columns
+            assert 'has:REF' in table.columns
+            matches = vectorized.rule_matches(parsed, RULES[-2:], table)
+            assert list(matches.columns) == ['NO-DX-LINES', 'NO-REF']
+            assert matches.any(axis=1).sum() == evaluate_claims(parsed, RULES[-2:])['invalid_claims']
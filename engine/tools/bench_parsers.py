@@ -0,0 +1,90 @@
+"""Benchmark the 837 parse shapes and check they agree.
+
+Every shape in `engine.adapters.SHAPES` is run over each input as text and
+as bytes. The script exits non-zero when, for any file:
+  - a shape gives different output for text and byte input
+  - the shapes disagree on the claims found (their CLM segments)
+  - the engine and runner shapes disagree on the transaction type
+
+Usage: python engine/tools/bench_parsers.py [files...] [--repeat N]
+(defaults to every file in engine/samples)
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# allow running as a script from anywhere in the checkout
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import logging
+logging.disable(logging.INFO)
+
+from engine.adapters import SHAPES
+from engine.claims import to_plain
+
+
+def _plain(parsed):
+    # the decoding report only exists for byte input
+    parsed = {k: v for k, v in parsed.items() if k != 'decoding'}
+    return json.loads(json.dumps(parsed, default=to_plain))
+
+
+def _claim_ids(parsed):
+    return [list(c['CLM']) for c in parsed['claims']]
+
+
+def _best_of(fn, arg, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(path: Path, repeat: int):
+    raw = path.read_bytes()
+    text = raw.decode('utf-8', errors='ignore')
+    problems = []
+    timings = {}
+    outputs = {}
+    for shape, parse in SHAPES.items():
+        from_text = _plain(parse(text))
+        if from_text != _plain(parse(raw)):
+            problems.append(f'{shape}: text and bytes output differ')
+        outputs[shape] = from_text
+        timings[shape] = (_best_of(parse, text, repeat), _best_of(parse, raw, repeat))
+
+    claims = {shape: _claim_ids(out) for shape, out in outputs.items()}
+    if len({json.dumps(c) for c in claims.values()}) > 1:
+        problems.append('shapes disagree on claims: ' + ', '.join(f'{s}={len(c)}' for s, c in claims.items()))
+    if outputs['engine']['transaction_type'] != outputs['runner']['transaction_type']:
+        problems.append('engine and runner disagree on transaction_type')
+    return len(raw), len(claims['engine']), timings, problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('files', nargs='*', type=Path)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+    files = args.files or sorted(p for p in REPO_ROOT.joinpath('engine', 'samples').iterdir() if p.is_file())
+
+    failed = False
+    print(f"{'file':32} {'bytes':>10} {'claims':>7}  " + '  '.join(f'{s + " text/bytes ms":>26}' for s in SHAPES))
+    for path in files:
+        size, count, timings, problems = bench(path, args.repeat)
+        cols = '  '.join(f'{t * 1000:12.2f} / {b * 1000:11.2f}' for t, b in timings.values())
+        print(f'{path.name[:32]:32} {size:10d} {count:7d}  {cols}')
+        for problem in problems:
+            failed = True
+            print(f'  MISMATCH {problem}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark the single-pass tokenizer against whole-input splitting.
+
+`whole-input` is how the parsers used to split segments: strip every `\\r`
+from a copy of the input, split that copy on `~` and strip each piece.
+`tokenizer` is `engine.parser.iter_segments`, collected into a list and
+streamed (each segment dropped once counted). Peak memory is measured with
+tracemalloc. The script exits non-zero when the two disagree on the
+segments of any file.
+
+Usage: python engine/tools/bench_tokenizer.py [files...] [--repeat N]
+(defaults to every file in engine/samples)
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# allow running as a script from anywhere in the checkout
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from engine.parser import iter_segments
+
+
+def whole_input(raw: str):
+    if '~' in raw:
+        raw = raw.replace('\r', '')
+        return [s.strip() for s in raw.split('~') if s.strip()]
+    return [s.strip() for s in raw.splitlines() if s.strip()]
+
+
+def tokenizer(raw: str):
+    return list(iter_segments(raw))
+
+
+def streamed(raw: str):
+    return sum(1 for _ in iter_segments(raw))
+
+
+CASES = {'whole-input': whole_input, 'tokenizer': tokenizer, 'streamed': streamed}
+
+
+def _measure(fn, raw, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(raw)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(raw)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('files', nargs='*', type=Path)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+    files = args.files or sorted(p for p in REPO_ROOT.joinpath('engine', 'samples').iterdir() if p.is_file())
+
+    failed = False
+    print(f"{'file':32} {'bytes':>10}  " + '  '.join(f'{c + " ms / peak MB":>26}' for c in CASES))
+    for path in files:
+        raw = path.read_text(encoding='utf-8', errors='ignore')
+        results = [_measure(fn, raw, args.repeat) for fn in CASES.values()]
+        cols = '  '.join(f'{t * 1000:14.2f} / {peak / 1e6:9.2f}' for t, peak in results)
+        print(f'{path.name[:32]:32} {len(raw):10d}  {cols}')
+        if whole_input(raw) != tokenizer(raw):
+            failed = True
+            print('  MISMATCH tokenizer and whole-input segments differ')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
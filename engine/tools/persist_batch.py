@@ -0,0 +1,45 @@
+"""Parse 837 files and save them in the persisted batch format.
+
+Each input is parsed through a memory map and written next to it (or into
+--out-dir) with a `.e837` suffix; `engine.persist.load_parsed`,
+`engine/src/run_rules.py` and `engine.model.predict_denial` read the result
+without parsing the 837 again.
+
+Usage: python engine/tools/persist_batch.py FILE... [--out-dir DIR]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# allow running as a script from anywhere in the checkout
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from engine.parser import parse_837_file
+from engine.persist import SUFFIX, save_parsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('files', nargs='+', type=Path)
+    ap.add_argument('--out-dir', type=Path)
+    args = ap.parse_args()
+
+    failed = False
+    for path in args.files:
+        start = time.perf_counter()
+        parsed = parse_837_file(str(path))
+        if 'error' in parsed:
+            failed = True
+            print(f'{path}: {parsed["error"]}')
+            continue
+        out = (args.out_dir or path.parent).joinpath(path.name + SUFFIX)
+        save_parsed(parsed, out)
+        print(f'{path} -> {out}: {len(parsed["claims"])} claims in {time.perf_counter() - start:.2f}s')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
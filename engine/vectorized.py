@@ -0,0 +1,258 @@
+"""Vectorized per-claim rule evaluation over a columnar table of claim facts.
+
+`fact_table` holds one boolean column per claim-level fact a ruleset reads:
+`has:<KEY>` segment presence and the `rules_engine.CLAIM_FACTS` tests.
+Segment columns come straight from the batch's `engine.segment_index`, and
+the facts of `engine.parser` claims come from that index and from one walk
+over the claims' loop parents, so no per-claim predicate runs for them.
+Claims of other shapes fall back to the scalar tests, once per column.
+
+`evaluate_claims` then turns every condition into a mask over that table
+(document conditions into a single bool), every rule into the conjunction
+of its masks, and returns exactly what `rules_engine.evaluate_claims`
+does; `evaluate_rules` reduces the same masks to the document findings of
+`rules_engine.evaluate_rules`. Pass the same `table` to later calls to
+reuse its columns.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from . import rules_engine
+from .claims import Claim, DIAGNOSIS_TAGS, SERVICE_LINE_TAGS
+from .logger import setup_logger
+from .segment_index import segment_index
+
+logger = setup_logger(__name__)
+
+Mask = Union[np.ndarray, bool]
+
+
+def _scalar_column(claims: Sequence, test: Callable) -> np.ndarray:
+    return np.fromiter((bool(test(c)) for c in claims), dtype=bool, count=len(claims))
+
+
+def _transaction_column(claims: Sequence[Claim]) -> np.ndarray:
+    """Whether the ST header of each claim's transaction set identifies an 837."""
+    by_parent: Dict[Any, bool] = {}
+    column = np.empty(len(claims), dtype=bool)
+    for i, claim in enumerate(claims):
+        parent = claim.parent
+        result = by_parent.get(parent)
+        if result is None:
+            transaction = claim.transaction
+            st = transaction.find('ST') if transaction is not None else None
+            result = by_parent[parent] = st is not None and rules_engine._st_is_837(st)
+        column[i] = result
+    return column
+
+
+def _context_column(claims: Sequence[Claim], loop_ids: Sequence[str], tags: Sequence[str]) -> np.ndarray:
+    """Whether each claim's enclosing `loop_ids` loops hold any of `tags` (see `context_has`).
+
+    Claims under the same parent loop share one answer, and each enclosing
+    loop is checked once.
+    """
+    by_parent: Dict[Any, bool] = {}
+    by_loop: Dict[Any, bool] = {}
+    column = np.empty(len(claims), dtype=bool)
+    for i, claim in enumerate(claims):
+        parent = claim.parent
+        result = by_parent.get(parent)
+        if result is None:
+            result = False
+            loop = parent
+            while loop is not None and not result:
+                if loop.loop_id in loop_ids:
+                    result = by_loop.get(loop)
+                    if result is None:
+                        index = loop.tag_index
+                        result = by_loop[loop] = any(tag in index for tag in tags)
+                loop = loop.parent
+            by_parent[parent] = result
+        column[i] = result
+    return column
+
+
+def _amounts(claims: Sequence[Claim]) -> np.ndarray:
+    """CLM02 of each claim as strings; None where the CLM is too short."""
+    return np.array([clm[2] if len(clm) > 2 else None for clm in (c.clm for c in claims)], dtype=object)
+
+
+def _claim_object_fact(name: str, claims: Sequence[Claim], column: Callable[[str], np.ndarray]) -> Optional[np.ndarray]:
+    """Column of a `CLAIM_FACTS` test for `engine.parser` claims, without running it per claim.
+
+    Claim objects have no `provider_npi` or `subscriber_id` key, so those
+    parts of the tests never hold for them. `npi_valid` reads NM1 elements
+    and is left to the scalar test.
+    """
+    if name == 'service_line_exists':
+        return np.logical_or.reduce([column(f'has:{t}') for t in SERVICE_LINE_TAGS])
+    if name == 'diagnosis_present':
+        return np.logical_or.reduce([column(f'has:{t}') for t in DIAGNOSIS_TAGS])
+    if name == 'diagnosis_to_procedure_valid':
+        return column('diagnosis_present') & column('service_line_exists')
+    if name == 'amount_nonzero':
+        amounts = _amounts(claims)
+        return (amounts != None) & (amounts != '0')  # noqa: E711 - elementwise
+    if name == 'transaction_header_valid':
+        values = _transaction_column(claims)
+        # an ST among the claim's own segments is rare; test those claims in full
+        for i in np.flatnonzero(column('has:ST')).tolist():
+            values[i] = bool(rules_engine.CLAIM_FACTS[name](claims[i]))
+        return values
+    if name == 'provider_identified':
+        return _context_column(claims, ('2000A',), ('NM1',))
+    if name == 'subscriber_identified':
+        return _context_column(claims, ('2000B', '2000C'), ('NM1', 'DMG'))
+    return None
+
+
+def _claim_id(claim: Any) -> str:
+    if isinstance(claim, Claim):
+        clm = claim.clm
+        return clm[1] if len(clm) > 1 else ''
+    return rules_engine._claim_id(claim)
+
+
+def fact_table(parsed: Dict[str, Any]) -> pd.DataFrame:
+    """Empty fact table of a parse; `evaluate_claims` adds columns as rules need them."""
+    return pd.DataFrame(index=pd.RangeIndex(len(parsed.get('claims', []))))
+
+
+def _columns(parsed: Dict[str, Any], table: pd.DataFrame) -> Callable[[str], np.ndarray]:
+    """Accessor of `table` columns that computes and stores missing ones."""
+    claims = parsed.get('claims', [])
+    objects = all(isinstance(c, Claim) for c in claims)
+    segments = segment_index(parsed, rules_engine._document_tag_index(parsed))
+
+    def column(name: str) -> np.ndarray:
+        if name not in table.columns:
+            if name.startswith('has:'):
+                values = segments.column(name[4:])
+            else:
+                values = _claim_object_fact(name, claims, column) if objects else None
+                if values is None:
+                    values = _scalar_column(claims, rules_engine.CLAIM_FACTS[name])
+            table[name] = values
+        return table[name].to_numpy()
+    return column
+
+
+def _condition_mask(key: tuple, test: Callable, parsed: Dict[str, Any],
+                    column: Callable[[str], np.ndarray]) -> Mask:
+    """Mask of the claims passing a compiled condition test, by its normalized key."""
+    typ = key[0]
+    envelope = parsed.get('envelope')
+    if typ in rules_engine.DOCUMENT_CONDITIONS:
+        # the same answer for every claim: test it on the document once
+        return bool(test(rules_engine._claim_document(rules_engine._claim_view(parsed), {})))
+    if typ == 'claim_has_segment':
+        return column(f'has:{key[1]}')
+    if typ == 'transaction_header_valid' and envelope is not None:
+        return envelope['valid_headers'] > 0
+    if typ == 'bill_type_present':
+        if parsed.get('transaction_type') != 'institutional':
+            return True
+        return column('has:UB') | _scalar_column(parsed.get('claims', []), rules_engine._has_bill_type)
+    if typ == 'provider_identified':
+        return column('has:NM1') | column(typ)
+    if typ == 'subscriber_identified':
+        return column('has:NM1') | column('has:DMG') | column(typ)
+    if typ in rules_engine.CLAIM_FACTS:
+        return column(typ)
+    # a condition type without a vectorized form: run its test per claim
+    view = rules_engine._claim_view(parsed)
+    return _scalar_column(parsed.get('claims', []), lambda c: test(rules_engine._claim_document(view, c)))
+
+
+def _match_matrix(parsed: Dict[str, Any], plans: List[rules_engine.CompiledRule],
+                  table: Optional[pd.DataFrame]) -> np.ndarray:
+    """Boolean (rule, claim) matrix of the rules each claim satisfies."""
+    size = len(parsed.get('claims', []))
+    column = _columns(parsed, fact_table(parsed) if table is None else table)
+    masks: Dict[tuple, Mask] = {}
+    matrix = np.ones((len(plans), size), dtype=bool)
+    for row, plan in zip(matrix, plans):
+        for key, test, negated in plan.steps:
+            mask = masks.get(key)
+            if mask is None:
+                mask = masks[key] = _condition_mask(key, test, parsed, column)
+            row &= np.logical_not(mask) if negated else mask
+            if not row.any():
+                break
+    return matrix
+
+
+def evaluate_rules(parsed: Dict[str, Any], rules: List[Dict[str, Any]],
+                   table: Optional[pd.DataFrame] = None) -> List[Dict[str, Any]]:
+    """`rules_engine.evaluate_rules`, read off the same masks as `evaluate_claims`.
+
+    A condition holds for the document when it holds for any claim, so each
+    mask is reduced with `any` before the rule's negations apply. Pass the
+    `table` of an `evaluate_claims` call on the same parse to share its columns.
+    """
+    plans = rules_engine.compile_rules(rules)
+    column = _columns(parsed, fact_table(parsed) if table is None else table)
+    held: Dict[tuple, bool] = {}
+    findings = []
+    for plan in plans:
+        for key, test, negated in plan.steps:
+            result = held.get(key)
+            if result is None:
+                result = held[key] = bool(np.any(_condition_mask(key, test, parsed, column)))
+            if result is negated:
+                break
+        else:
+            findings.append(dict(plan.finding))
+    logger.info(f"Evaluated {len(plans)} rules as masks, found {len(findings)} issues")
+    return findings
+
+
+def rule_matches(parsed: Dict[str, Any], rules: List[Dict[str, Any]],
+                 table: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Claims x rules boolean frame: whether each claim satisfies each rule.
+
+    Columns are the rule ids in rule order. Counting or grouping over this
+    frame avoids building a finding dict per match, which is what most of
+    `evaluate_claims` time goes into when findings are plentiful.
+    """
+    plans = rules_engine.compile_rules(rules)
+    return pd.DataFrame(_match_matrix(parsed, plans, table).T, columns=[plan.id for plan in plans])
+
+
+def evaluate_claims(parsed: Dict[str, Any], rules: List[Dict[str, Any]],
+                    table: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """`rules_engine.evaluate_claims`, computed as boolean masks over `table`."""
+    plans = rules_engine.compile_rules(rules)
+    claims = parsed.get('claims', [])
+    size = len(claims)
+    matrix = _match_matrix(parsed, plans, table)
+
+    high = np.array([plan.finding['severity'] == 'High' for plan in plans], dtype=bool)
+    flagged = np.flatnonzero(matrix.any(axis=0))
+    high_counts = matrix[high].sum(axis=0) if high.any() else np.zeros(size, dtype=np.int64)
+    # (claim, rule) pairs of the matches, claim by claim and in rule order within each
+    claim_indexes, rule_indexes = np.nonzero(matrix.T)
+    starts = np.searchsorted(claim_indexes, flagged).tolist() + [len(claim_indexes)]
+    rule_indexes = rule_indexes.tolist()
+    findings = []
+    rollups = []
+    for n, index in enumerate(flagged.tolist()):
+        claim_id = _claim_id(claims[index])
+        matched = [plans[r] for r in rule_indexes[starts[n]:starts[n + 1]]]
+        for plan in matched:
+            finding = plan.finding.copy()
+            finding['claim_index'] = index
+            finding['claim_id'] = claim_id
+            findings.append(finding)
+        rollups.append({
+            'claim_index': index,
+            'claim_id': claim_id,
+            'rules': [plan.id for plan in matched],
+            'high_risk_issues': int(high_counts[index]),
+        })
+
+    logger.info(f"Evaluated {len(plans)} rules as masks over {size} claims, {len(rollups)} with issues")
+    return rules_engine.claim_results(size, findings, rollups, rules_engine.rules_version(rules))
@@ -6,8 +6,7 @@ import streamlit as st
 import json
 import plotly.graph_objects as go
 from pathlib import Path
-from engine.parser import parse_837
-from engine.model import predict_denial
+from engine.model import analyze_837
 from engine.llm import explain_issue, check_ollama, check_online_ai
 
 # ============================================================================
@@ -684,9 +683,9 @@ with st.sidebar:
             if sample_path.exists():
                 with st.spinner("Processing..."):
                     raw = sample_path.read_text(encoding='utf-8')
-                    parsed = parse_837(raw)
+                    parsed, results = analyze_837(raw)
                     if 'error' not in parsed:
-                        st.session_state.results = predict_denial(raw, parsed)
+                        st.session_state.results = results
                         st.session_state.claim_type = st.session_state.results['claim_type']
                         st.session_state.summary_metrics = st.session_state.results['summary']
                         st.session_state.parsed = parsed
@@ -701,9 +700,9 @@ with st.sidebar:
             if sample_path.exists():
                 with st.spinner("Processing..."):
                     raw = sample_path.read_text(encoding='utf-8')
-                    parsed = parse_837(raw)
+                    parsed, results = analyze_837(raw)
                     if 'error' not in parsed:
-                        st.session_state.results = predict_denial(raw, parsed)
+                        st.session_state.results = results
                         st.session_state.claim_type = st.session_state.results['claim_type']
                         st.session_state.summary_metrics = st.session_state.results['summary']
                         st.session_state.parsed = parsed
@@ -938,11 +937,13 @@ elif page == "📤 Upload Claims":
     if uploaded and st.button("▶️ Run Analysis", use_container_width=True, key="run_analysis_btn"):
         with st.spinner("Analyzing claim..."):
             try:
-                raw = uploaded.getvalue().decode('utf-8', errors='ignore')
-                parsed = parse_837(raw)
+                # pass the upload bytes; the parser decodes them chunk by chunk in the
+                # encoding sniffed from the BOM or ISA header (see decode_stream)
+                raw = uploaded.getvalue()
+                parsed, results = analyze_837(raw)
                 
                 if 'error' not in parsed:
-                    st.session_state.results = predict_denial(raw, parsed)
+                    st.session_state.results = results
                     st.session_state.claim_type = st.session_state.results['claim_type']
                     st.session_state.summary_metrics = st.session_state.results['summary']
                     st.session_state.parsed = parsed